@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+消息分类基准测试
+
+用模拟消息流（中文普通消息、@消息、指定范围消息、系统提示、自己发出的消息、刚转发的AI回复）
+测量监听回调中每条消息的分类开销，分阶段统计：
+
+- is_system_message：系统消息判断
+- is_self_message：自己消息判断（含最近AI回复检查）
+- is_recent_ai_reply：最近AI回复的循环防护检查
+- find_matching_rules：规则索引匹配
+- message_matches_filter：单条规则过滤条件（每次调用都重新编译过滤条件）
+- pipeline：按监听回调的顺序完整分类一条消息，即实际吞吐量
+
+不依赖微信和 Windows，可在 Linux 上运行。修改规则引擎前后各运行一次，
+用 --save 保存结果、--baseline 对比，即可看到每个阶段的变化。
+
+用法：
+    python TEST/bench_message_classification.py
+    python TEST/bench_message_classification.py --rules 10 100 1000 10000 --messages 20000
+    python TEST/bench_message_classification.py --save before.json
+    python TEST/bench_message_classification.py --baseline before.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from forwarder.loop_guard import LoopGuard
+from forwarder.message_classifier import MessageClassifier
+from forwarder.message_filter import SYSTEM_KEYWORDS
+from forwarder.rule_index import RuleIndex
+
+
+NICKNAME = '小助手'
+STAGES = ['is_system_message', 'is_self_message', 'is_recent_ai_reply',
+          'find_matching_rules', 'message_matches_filter', 'pipeline']
+
+QUESTIONS = [
+    '模拟器练习的流程是什么',
+    '请问今天的作业什么时候交',
+    '考试报名从哪里进入，链接发一下',
+    '第三章的课件在哪里下载',
+    '直播回放什么时候上传',
+]
+CHATTER = ['收到', '好的谢谢老师', '哈哈哈哈', '今天天气不错，大家周末愉快', '[图片]', '明天几点上课？']
+AI_REPLIES = [
+    '模拟器练习分为三个步骤：先完成理论学习，再进行模拟器操作，最后提交练习报告。',
+    '作业请在本周五晚上十点前通过学习平台提交，逾期将无法提交。',
+    '考试报名入口在学习平台首页的"考试中心"，点击"我要报名"即可。',
+]
+
+
+class Message:
+    """模拟wxauto消息对象"""
+
+    def __init__(self, content, sender='张三', attr='friend', type='text'):
+        self.content = content
+        self.sender = sender
+        self.attr = attr
+        self.type = type
+
+
+class SystemMessage(Message):
+    pass
+
+
+def make_rules(count, chat_count, seed=0):
+    """生成测试规则：过滤类型随机，约5%为通配规则，约20%带关键词过滤"""
+    rng = random.Random(seed)
+    rules = []
+    for i in range(count):
+        filter_type = rng.choice(['all', 'at_me', 'range'])
+        source = {
+            'type': rng.choice(['wechat', 'wecom']),
+            'contact': '' if rng.random() < 0.05 else f'群聊{rng.randrange(chat_count)}',
+            'filter_type': filter_type,
+            'range_start': '@开始' if filter_type == 'range' else '',
+            'range_end': '结束' if filter_type == 'range' else '',
+        }
+        if rng.random() < 0.2:
+            source['filters'] = {
+                'keywords': rng.sample(['作业', '考试', '课件', '直播', '报名', '模拟器'], 3),
+                'exclude_keywords': ['广告'],
+            }
+        rules.append({
+            'id': f'rule_{i}',
+            'name': f'规则{i}',
+            'enabled': rng.random() > 0.1,
+            'source': source,
+            'target': {'type': 'wecom', 'contact': f'AI助手{i % 10}'},
+        })
+    return rules
+
+
+def make_messages(count, chat_count, seed=1):
+    """生成消息流：(消息, 聊天名, 来源类型)"""
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.05:
+            msg = SystemMessage(rng.choice(SYSTEM_KEYWORDS), sender='system', attr='system')
+        elif roll < 0.10:
+            msg = Message(rng.choice(AI_REPLIES), sender=NICKNAME, attr='self')
+        elif roll < 0.15:
+            # 其他人转贴的AI回复（格式略有变化），只能靠循环防护识别
+            msg = Message(rng.choice(AI_REPLIES).replace('，', ', ') + ' ', sender='李四')
+        elif roll < 0.45:
+            msg = Message(f'@{NICKNAME} {rng.choice(QUESTIONS)}', sender=f'学员{rng.randrange(500)}')
+        elif roll < 0.55:
+            msg = Message(f'@开始 {rng.choice(QUESTIONS)} 结束', sender=f'学员{rng.randrange(500)}')
+        else:
+            msg = Message(rng.choice(CHATTER), sender=f'学员{rng.randrange(500)}')
+        messages.append((msg, f'群聊{rng.randrange(chat_count)}', rng.choice(['wechat', 'wecom'])))
+    return messages
+
+
+def make_classifier(rules, reply_count=500):
+    """构建分类器，循环防护中预先记录若干条最近的AI回复"""
+    rule_index = RuleIndex(rules, nickname_provider=lambda: NICKNAME)
+    loop_guard = LoopGuard()
+    for i in range(reply_count):
+        loop_guard.record(f'{AI_REPLIES[i % len(AI_REPLIES)]}（第{i}次回复）')
+    for reply in AI_REPLIES:
+        loop_guard.record(reply)
+    return MessageClassifier(lambda: rule_index, loop_guard, self_name_provider=lambda: NICKNAME)
+
+
+def time_stage(func, items, repeat):
+    """多次运行取最快的一次，返回每条消息的平均耗时（微秒）"""
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for item in items:
+            func(item)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(items) * 1e6
+
+
+def bench(rule_count, message_count, chat_count, repeat):
+    rules = make_rules(rule_count, chat_count)
+    messages = make_messages(message_count, chat_count)
+    classifier = make_classifier(rules)
+    rng = random.Random(2)
+    filter_sources = [rng.choice(rules)['source'] for _ in messages]
+
+    def pipeline(item):
+        msg, chat_name, source_type = item
+        if classifier.is_system_message(msg) or classifier.is_self_message(msg):
+            return None
+        return classifier.find_matching_rules(msg, chat_name, source_type)
+
+    results = {
+        'is_system_message': time_stage(lambda item: classifier.is_system_message(item[0]), messages, repeat),
+        'is_self_message': time_stage(lambda item: classifier.is_self_message(item[0]), messages, repeat),
+        'is_recent_ai_reply': time_stage(lambda item: classifier.is_recent_ai_reply(item[0].content), messages, repeat),
+        'find_matching_rules': time_stage(lambda item: classifier.find_matching_rules(*item), messages, repeat),
+        'message_matches_filter': time_stage(
+            lambda i: classifier.message_matches_filter(messages[i][0], filter_sources[i]),
+            range(len(messages)), repeat),
+        'pipeline': time_stage(pipeline, messages, repeat),
+    }
+
+    # 分类结果统计，便于确认消息流的构成
+    counts = {'system': 0, 'self': 0, 'matched': 0, 'unmatched': 0}
+    for msg, chat_name, source_type in messages:
+        if classifier.is_system_message(msg):
+            counts['system'] += 1
+        elif classifier.is_self_message(msg):
+            counts['self'] += 1
+        elif classifier.find_matching_rules(msg, chat_name, source_type):
+            counts['matched'] += 1
+        else:
+            counts['unmatched'] += 1
+    return results, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='消息分类基准测试')
+    parser.add_argument('--rules', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--chats', type=int, default=200, help='聊天数量')
+    parser.add_argument('--repeat', type=int, default=3, help='每个阶段重复次数，取最快一次')
+    parser.add_argument('--save', help='保存结果到JSON文件，作为后续对比的基线')
+    parser.add_argument('--baseline', help='与之前保存的结果对比')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    report = {}
+    for rule_count in args.rules:
+        results, counts = bench(rule_count, args.messages, args.chats, args.repeat)
+        report[str(rule_count)] = results
+
+        print(f"\n规则数 {rule_count}，消息 {args.messages} 条"
+              f"（系统{counts['system']} / 自己{counts['self']} / 匹配{counts['matched']} / 未匹配{counts['unmatched']}）")
+        print(f"{'阶段':<28}{'us/条':>10}{'条/秒':>14}{'基线us/条':>14}{'变化':>11}")
+        for stage in STAGES:
+            us = results[stage]
+            line = f"{stage:<28}{us:>10.2f}{1e6 / us:>14.0f}"
+            before = baseline.get(str(rule_count), {}).get(stage)
+            if before:
+                line += f"{before:>14.2f}{(us - before) / before:>+11.1%}"
+            print(line)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.save}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
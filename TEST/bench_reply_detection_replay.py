@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回复检测离线回放基准测试
+
+读取调试截图记录器保存的截图序列（temp/<消息ID>/manifest.json + frame_NNN.png），
+用虚拟时钟驱动 ReplyCompletionDetector 的轮询调度，把各截图类检测策略
+在每个序列上跑一遍。每次采样取录制时的下一帧，并把虚拟时钟推进到该帧的采集时间：
+录制时两帧之间除了轮询间隔还有截图耗时（激活窗口约1秒），只按轮询间隔推进时钟
+会反复读到同一帧而误判完成。统计：
+
+- 检测耗时：判定完成时间 - 真实完成时间（truth_completed_at）
+- 提前判定：回复尚未完成就判定完成的次数（真实完成时间来自判定完成后的独立采样，
+  只有截图推断的完成时间（truth_source 为 frames）时发现不了录制时的提前判定）
+- 漏判：超时仍未判定完成的次数
+- 每帧CPU耗时：策略采样+比较的进程CPU时间
+
+只依赖 Pillow 和录制好的文件，不需要企业微信窗口，可在 Linux 上运行。
+
+用法：
+    python TEST/bench_reply_detection_replay.py temp/
+    python TEST/bench_reply_detection_replay.py temp/msg_123 --strategies pixel block_hash --interval 2
+    python TEST/bench_reply_detection_replay.py --self-check
+
+说明：
+- 录制时的截图间隔就是实际轮询间隔（含截图耗时），回放时每次采样最多前进一帧，
+  使用更短的 --interval 不会更快判定，更长的 --interval 会跳过中间的帧
+- 截图按 debug_frames.scale 缩小并转为灰度保存，CPU耗时对应录制分辨率
+- 录制时需设置 debug_frames.keep_last 为0保留完整序列，部分截图已被轮换删除的序列会被跳过
+- uia 策略不产生截图，无法离线回放
+"""
+
+import argparse
+import bisect
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from forwarder.frame_recorder import completion_time
+from forwarder.reply_detection import ReplyCompletionDetector, PixelDiffStrategy, BlockHashStrategy
+
+
+STRATEGIES = {
+    'pixel': PixelDiffStrategy,
+    'block_hash': BlockHashStrategy,
+}
+
+
+class VirtualClock:
+    """虚拟时钟，sleep直接推进时间"""
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class ReplaySequence:
+    """一段录制好的截图序列"""
+
+    def __init__(self, name, timestamps, images, truth, truth_source=None):
+        self.name = name
+        self.timestamps = timestamps
+        self.images = images
+        self.start = timestamps[0]
+        self.truth = truth
+        self.truth_source = truth_source
+
+    @classmethod
+    def load(cls, directory):
+        """读取截图目录（manifest.json + frame_NNN.png）"""
+        with open(os.path.join(directory, 'manifest.json'), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+        frames = sorted(manifest['frames'], key=lambda frame: frame['timestamp'])
+        if any(f.get('dropped') or not os.path.exists(os.path.join(directory, f['file'])) for f in frames):
+            # 缺帧的序列回放时会跳过回复中途的变化，统计结果没有意义
+            raise ValueError('部分截图已按 keep_last 轮换删除，录制回放用的序列需设置 "keep_last": 0')
+        if not frames:
+            raise ValueError('没有可用的截图')
+
+        # 预先解码，避免PNG解码耗时计入策略CPU耗时
+        images = []
+        for frame in frames:
+            with Image.open(os.path.join(directory, frame['file'])) as image:
+                image.load()
+                images.append(image.copy())
+
+        truth = manifest.get('truth_completed_at')
+        truth_source = manifest.get('truth_source')
+        if truth is None:
+            truth, truth_source = completion_time(frames, manifest.get('truth_samples'))
+        return cls(os.path.basename(os.path.normpath(directory)), [f['timestamp'] for f in frames],
+                   images, truth, truth_source)
+
+    def next_frame(self, t):
+        """t时刻发起的截图得到的画面：采集时间不早于t的第一帧
+
+        Returns:
+            tuple: (画面, 采集时间)，录制已结束时返回最后一帧和t
+        """
+        index = bisect.bisect_left(self.timestamps, t)
+        if index >= len(self.timestamps):
+            return self.images[-1], t
+        return self.images[index], self.timestamps[index]
+
+
+def instrument(strategy, counters):
+    """统计策略采样和比较的进程CPU时间"""
+    sample, is_stable = strategy.sample, strategy.is_stable
+
+    def timed_sample():
+        t0 = time.process_time()
+        try:
+            return sample()
+        finally:
+            counters['cpu'] += time.process_time() - t0
+            counters['frames'] += 1
+
+    def timed_is_stable(previous, current):
+        t0 = time.process_time()
+        try:
+            return is_stable(previous, current)
+        finally:
+            counters['cpu'] += time.process_time() - t0
+
+    strategy.sample = timed_sample
+    strategy.is_stable = timed_is_stable
+    return strategy
+
+
+def replay(sequence, strategy_name, interval=None, timeout=None, tolerance=0.001):
+    """在一段序列上回放单个策略"""
+    clock = VirtualClock(sequence.start)
+    counters = {'cpu': 0.0, 'frames': 0}
+
+    def capture(hwnd):
+        # 截图耗时计入时钟：时钟推进到录制时这一帧的采集时间
+        image, clock.now = sequence.next_frame(clock.now)
+        return image
+
+    def factory():
+        strategy = STRATEGIES[strategy_name](capture)
+        if interval:
+            strategy.poll_interval = interval
+        return instrument(strategy, counters)
+
+    detector = ReplyCompletionDetector({strategy_name: factory}, clock=clock.time, sleep=clock.sleep)
+    if timeout is None:
+        timeout = sequence.timestamps[-1] - sequence.start + 60
+    result = detector.detect(0, [strategy_name], timeout=timeout)
+
+    outcome = {
+        'sequence': sequence.name,
+        'strategy': strategy_name,
+        'completed': result.completed,
+        'polls': result.polls,
+        'frames': counters['frames'],
+        'cpu_ms_per_frame': counters['cpu'] / counters['frames'] * 1000 if counters['frames'] else 0.0,
+        'time_to_detect': None,
+        'premature': False,
+        'truth_source': sequence.truth_source,
+    }
+    if result.completed and sequence.truth is not None:
+        delta = clock.now - sequence.truth
+        outcome['premature'] = delta < -tolerance
+        outcome['time_to_detect'] = delta
+    return outcome
+
+
+def find_sequences(paths):
+    """查找包含 manifest.json 的截图目录"""
+    directories = []
+    for path in paths:
+        if os.path.exists(os.path.join(path, 'manifest.json')):
+            directories.append(path)
+            continue
+        for name in sorted(os.listdir(path)):
+            sub_dir = os.path.join(path, name)
+            if os.path.exists(os.path.join(sub_dir, 'manifest.json')):
+                directories.append(sub_dir)
+    return directories
+
+
+def percentile(values, ratio):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+def print_report(outcomes, strategies):
+    print(f"{'策略':<12}{'序列':>6}{'判定':>6}{'提前':>6}{'漏判':>6}"
+          f"{'平均耗时(s)':>14}{'P95耗时(s)':>14}{'CPU/帧(ms)':>14}")
+    for name in strategies:
+        rows = [o for o in outcomes if o['strategy'] == name]
+        if not rows:
+            continue
+        detected = [o for o in rows if o['completed']]
+        premature = [o for o in detected if o['premature']]
+        latencies = [o['time_to_detect'] for o in detected if not o['premature'] and o['time_to_detect'] is not None]
+        frames = sum(o['frames'] for o in rows)
+        cpu_ms = sum(o['cpu_ms_per_frame'] * o['frames'] for o in rows) / frames if frames else 0.0
+        print(f"{name:<12}{len(rows):>6}{len(detected):>6}{len(premature):>6}{len(rows) - len(detected):>6}"
+              f"{(statistics.mean(latencies) if latencies else 0.0):>14.2f}"
+              f"{percentile(latencies, 0.95):>14.2f}{cpu_ms:>14.2f}")
+
+
+def self_check():
+    """用合成的慢速序列检查回放本身：回复持续变化约43秒、每帧间隔6.2秒（5秒轮询+截图耗时），
+    各策略都应在回复完成后才判定完成，不能报告为提前判定"""
+    gap, changing = 6.2, 8
+    levels = [10 + 25 * i for i in range(changing)] + [10 + 25 * (changing - 1)] * 2
+    timestamps = [1000.0 + gap * i for i in range(len(levels))]
+    images = [Image.new('L', (64, 96), level) for level in levels]
+    truth = timestamps[changing - 1]
+    sequence = ReplaySequence('self-check', timestamps, images, truth, 'frames')
+
+    failures = 0
+    for name in STRATEGIES:
+        outcome = replay(sequence, name)
+        ok = outcome['completed'] and not outcome['premature'] and outcome['time_to_detect'] >= 0
+        failures += not ok
+        print(f"{'✅' if ok else '❌'} {name}: 采样{outcome['polls']}次，"
+              f"判定耗时{outcome['time_to_detect']:.1f}秒，提前判定={outcome['premature']}")
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='回复检测离线回放基准测试')
+    parser.add_argument('paths', nargs='*', help='截图目录或其上级目录（如 temp/）')
+    parser.add_argument('--strategies', nargs='+', default=list(STRATEGIES), choices=list(STRATEGIES))
+    parser.add_argument('--interval', type=float, default=None, help='覆盖策略的轮询间隔（秒）')
+    parser.add_argument('--timeout', type=float, default=None, help='单个序列的检测超时（秒）')
+    parser.add_argument('--verbose', action='store_true', help='输出每个序列的结果')
+    parser.add_argument('--self-check', action='store_true', help='用合成的慢速序列检查回放不会误报提前判定')
+    args = parser.parse_args()
+
+    if args.self_check:
+        return self_check()
+    if not args.paths:
+        parser.error('需要指定截图目录')
+
+    directories = find_sequences(args.paths)
+    if not directories:
+        print("❌ 未找到包含 manifest.json 的截图目录")
+        return 1
+
+    outcomes = []
+    for directory in directories:
+        try:
+            sequence = ReplaySequence.load(directory)
+        except Exception as e:
+            print(f"⚠️ 跳过 {directory}: {e}")
+            continue
+        for name in args.strategies:
+            outcome = replay(sequence, name, args.interval, args.timeout)
+            outcomes.append(outcome)
+            if args.verbose:
+                print(outcome)
+
+    sequences = {o['sequence']: o['truth_source'] for o in outcomes}
+    frames_only = sum(1 for source in sequences.values() if source != 'tail')
+    print(f"📊 共回放 {len(sequences)} 个截图序列，其中 {len(sequences) - frames_only} 个的完成时间来自判定后的独立采样，"
+          f"{frames_only} 个只有截图推断的完成时间")
+    print_report(outcomes, args.strategies)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+转发规则匹配基准测试
+
+对比逐条遍历全部规则（原 find_matching_rules 的做法）与 RuleIndex 索引匹配，
+在 1k / 10k 条规则下的单条消息匹配耗时和索引构建耗时。不依赖微信，可在任意平台运行。
+
+用法：
+    python TEST/bench_rule_index.py
+    python TEST/bench_rule_index.py --rules 1000 10000 50000 --messages 20000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from forwarder.rule_index import RuleIndex, compile_filter
+
+
+NICKNAME = '小助手'
+
+
+def make_rules(count, chat_count, seed=0):
+    """生成测试规则：约5%为通配规则，过滤条件随机"""
+    rng = random.Random(seed)
+    rules = []
+    for i in range(count):
+        filter_type = rng.choice(['all', 'at_me', 'range'])
+        rules.append({
+            'id': f'rule_{i}',
+            'name': f'规则{i}',
+            'enabled': rng.random() > 0.1,
+            'source': {
+                'type': rng.choice(['wechat', 'wecom']),
+                'contact': '' if rng.random() < 0.05 else f'群聊{rng.randrange(chat_count)}',
+                'filter_type': filter_type,
+                'range_start': '@开始' if filter_type == 'range' else '',
+                'range_end': '结束' if filter_type == 'range' else '',
+            },
+            'target': {'type': 'wecom', 'contact': f'AI助手{i % 10}'},
+        })
+    return rules
+
+
+class Message:
+    def __init__(self, content):
+        self.content = content
+        self.sender = '张三'
+        self.type = 'text'
+
+
+def make_messages(count, chat_count, seed=1):
+    rng = random.Random(seed)
+    contents = ['普通消息', f'@{NICKNAME} 请问一下', '@开始 问题内容 结束', '今天天气不错']
+    return [
+        (Message(rng.choice(contents)), f'群聊{rng.randrange(chat_count)}', rng.choice(['wechat', 'wecom']))
+        for _ in range(count)
+    ]
+
+
+def linear_match(rules, msg, chat_name, source_type):
+    """原实现：每条消息遍历全部规则"""
+    matching_rules = []
+    for rule in rules:
+        if not rule['enabled']:
+            continue
+        if rule['source']['type'] != source_type:
+            continue
+        if rule['source']['contact'] and rule['source']['contact'] != chat_name:
+            continue
+        if compile_filter(rule['source'], lambda: NICKNAME)(msg.content):
+            matching_rules.append(rule)
+    return matching_rules
+
+
+def bench(rule_count, message_count, chat_count):
+    rules = make_rules(rule_count, chat_count)
+    messages = make_messages(message_count, chat_count)
+
+    t0 = time.perf_counter()
+    index = RuleIndex(rules, nickname_provider=lambda: NICKNAME)
+    build_ms = (time.perf_counter() - t0) * 1000
+
+    # 线性遍历太慢，只取部分消息
+    linear_messages = messages[:max(1, min(message_count, 2000000 // rule_count))]
+    t0 = time.perf_counter()
+    for msg, chat_name, source_type in linear_messages:
+        linear_match(rules, msg, chat_name, source_type)
+    linear_us = (time.perf_counter() - t0) / len(linear_messages) * 1e6
+
+    t0 = time.perf_counter()
+    for msg, chat_name, source_type in messages:
+        index.match(msg, chat_name, source_type)
+    index_us = (time.perf_counter() - t0) / len(messages) * 1e6
+
+    # 校验两种方式结果一致
+    for msg, chat_name, source_type in linear_messages[:200]:
+        expected = [r['id'] for r in linear_match(rules, msg, chat_name, source_type)]
+        actual = [r['id'] for r in index.match(msg, chat_name, source_type)]
+        assert expected == actual, (msg.content, chat_name, source_type)
+
+    print(f"{rule_count:>8}{chat_count:>8}{build_ms:>12.1f}{linear_us:>14.1f}{index_us:>14.2f}{linear_us / index_us:>10.0f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='转发规则匹配基准测试')
+    parser.add_argument('--rules', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--chats', type=int, default=200, help='聊天数量')
+    args = parser.parse_args()
+
+    print(f"{'规则数':>8}{'聊天数':>8}{'构建(ms)':>12}{'遍历(us/条)':>14}{'索引(us/条)':>14}{'加速':>11}")
+    for rule_count in args.rules:
+        bench(rule_count, args.messages, args.chats)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
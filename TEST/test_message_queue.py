@@ -15,7 +15,7 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 # 导入消息转发器
 try:
-    from wechat_message_forwarder_fixed import MessageQueue
+    from forwarder.engine import MessageQueue
     print("✅ 成功导入 MessageQueue 类")
 except ImportError as e:
     print(f"❌ 导入失败: {e}")
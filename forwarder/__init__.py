@@ -0,0 +1,3 @@
+"""
+微信消息转发助手 - 转发引擎组件
+"""
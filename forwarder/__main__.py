@@ -0,0 +1,68 @@
+"""
+命令行入口
+
+    python -m forwarder --headless --config forwarder_config.json
+
+无界面模式：加载配置中的规则，恢复消息队列后开始转发，直到收到 Ctrl+C / 终止信号；
+输出只有日志（控制台和 logs/ 目录）和本地指标接口。转发循环异常停止或规则配置无效时以非零状态退出，
+便于由计划任务或服务管理程序重新启动。
+
+不加 --headless 时启动图形界面（与直接运行 wechat_message_forwarder_fixed.py 相同）。
+"""
+
+import argparse
+import signal
+import sys
+import threading
+
+
+def run_headless(config_path):
+    """无界面运行转发引擎，返回退出状态"""
+    from .engine import ForwarderEngine, enable_dpi_awareness
+
+    enable_dpi_awareness()
+    engine = ForwarderEngine(config_path)
+    engine.initialize()
+    engine.refresh_wechat_nickname()
+
+    stop_requested = threading.Event()
+
+    def request_stop(signum, frame):
+        engine.log_message(f"收到退出信号（{signum}），正在停止...")
+        stop_requested.set()
+
+    for name in ('SIGINT', 'SIGTERM', 'SIGBREAK'):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), request_stop)
+
+    if not engine.start_forwarding():
+        engine.shutdown()
+        return 1
+
+    engine.log_message("微信消息转发助手已启动（无界面模式）")
+    # 等待期间保持主线程可以响应信号
+    while engine.is_forwarding and not stop_requested.wait(1):
+        pass
+
+    engine.shutdown()
+    return 0 if stop_requested.is_set() else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m forwarder', description='微信消息转发助手')
+    parser.add_argument('--headless', action='store_true', help='不启动图形界面，只输出日志和指标')
+    parser.add_argument('--config', default='forwarder_config.json', help='配置文件路径（默认 forwarder_config.json）')
+    args = parser.parse_args(argv)
+
+    if args.headless:
+        return run_headless(args.config)
+
+    if args.config != 'forwarder_config.json':
+        parser.error('--config 只能与 --headless 一起使用')
+    from wechat_message_forwarder_fixed import main as gui_main
+    gui_main()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
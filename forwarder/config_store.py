@@ -0,0 +1,219 @@
+"""
+配置存储
+
+forwarder_config.json 只在启动时读取一次，之后所有读取都从内存中的不可变快照返回。
+文件被外部修改时（mtime或大小变化）自动重新加载，检查文件状态的频率受限，
+消息处理热路径不会访问磁盘。写入先更新内存快照，再合并为一次原子写入
+（临时文件 + os.replace），避免输入框每次按键都重写整个文件。
+"""
+
+from types import MappingProxyType
+import threading
+import atexit
+import copy
+import json
+import os
+import time
+
+
+def _freeze(value):
+    """把dict/list递归转换为只读的MappingProxyType/tuple"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _thaw(value):
+    """_freeze的逆操作，返回可修改的副本"""
+    if isinstance(value, MappingProxyType):
+        return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(v) for v in value]
+    return value
+
+
+class ConfigSnapshot:
+    """某一时刻配置的只读快照"""
+
+    __slots__ = ('_data', 'version')
+
+    def __init__(self, data, version=0):
+        self._data = _freeze(data)
+        self.version = version      # 每次加载或修改后递增
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def to_dict(self):
+        """返回可修改的完整配置副本"""
+        return _thaw(self._data)
+
+    def thaw(self, key, default=None):
+        """返回某个配置项的可修改副本"""
+        return _thaw(self._data.get(key, default))
+
+    @property
+    def detection_delay(self) -> int:
+        try:
+            return int(self._data.get('detection_delay', 2))
+        except (TypeError, ValueError):
+            return 2
+
+    @property
+    def log_retention_days(self) -> int:
+        return int(self._data.get('log_retention_days', 10))
+
+    @property
+    def queue_max_size(self) -> int:
+        return int(self._data.get('queue_max_size', 600))
+
+    @property
+    def wechat_nickname(self) -> str:
+        return self._data.get('wechat_nickname') or ''
+
+    def copy_coordinates(self, target_contact):
+        """目标联系人的复制坐标配置，未配置时返回None"""
+        return self._data.get('copy_coordinates', {}).get(target_contact)
+
+
+class ConfigStore:
+    """带文件变化检测和合并写入的配置存储"""
+
+    def __init__(self, path='forwarder_config.json', check_interval=2.0, write_delay=0.5, log=None):
+        """
+        Args:
+            path (str): 配置文件路径
+            check_interval (float): 两次检查文件状态的最小间隔，单位秒
+            write_delay (float): 修改后延迟多久写盘，期间的修改合并为一次写入
+            log (Callable[[str], None], optional): 日志回调
+        """
+        self.path = path
+        self.check_interval = check_interval
+        self.write_delay = write_delay
+        self.log = log
+
+        self._lock = threading.RLock()
+        self._data = {}
+        self._snapshot = ConfigSnapshot({})
+        self._file_state = None         # 最近一次读写时文件的 (mtime_ns, size)
+        self._next_check = 0.0
+        self._dirty = False
+        self._write_timer = None
+
+        # 程序退出时写入尚未落盘的修改
+        atexit.register(self.flush)
+
+    def _log(self, message):
+        if self.log:
+            self.log(message)
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def reload(self):
+        """强制从文件重新加载
+
+        Raises:
+            FileNotFoundError: 配置文件不存在
+            json.JSONDecodeError: 配置文件格式错误
+        """
+        with self._lock:
+            file_state = self._stat()
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._set_data(data)
+            self._file_state = file_state
+            self._next_check = time.monotonic() + self.check_interval
+            return self._snapshot
+
+    def _set_data(self, data):
+        self._data = data
+        self._snapshot = ConfigSnapshot(data, self._snapshot.version + 1)
+
+    def _check_file(self):
+        """文件被外部修改时重新加载；有未写盘的修改时以内存为准"""
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        if self._dirty:
+            return
+        file_state = self._stat()
+        if file_state is None or file_state == self._file_state:
+            return
+        try:
+            self.reload()
+            self._log("🔄 配置文件已变化，已重新加载")
+        except Exception as e:
+            # 外部编辑器写到一半等情况，保留上一份快照，下次再试
+            self._file_state = file_state
+            self._log(f"⚠️ 重新加载配置文件失败: {e}")
+
+    def snapshot(self) -> ConfigSnapshot:
+        """获取当前配置快照"""
+        with self._lock:
+            self._check_file()
+            return self._snapshot
+
+    def get(self, key, default=None):
+        return self.snapshot().get(key, default)
+
+    def update(self, changes=None, **kwargs):
+        """更新若干顶层配置项，返回新快照"""
+        def apply(config):
+            config.update(changes or {})
+            config.update(kwargs)
+        return self.mutate(apply)
+
+    def mutate(self, func):
+        """在配置的可修改副本上执行func，然后替换快照并安排写盘
+
+        Args:
+            func (Callable[[dict], None]): 直接修改传入的配置字典
+        """
+        with self._lock:
+            self._check_file()
+            data = copy.deepcopy(self._data)
+            func(data)
+            self._set_data(data)
+            self._schedule_write()
+            return self._snapshot
+
+    def _schedule_write(self):
+        self._dirty = True
+        if self._write_timer is None:
+            self._write_timer = threading.Timer(self.write_delay, self.flush)
+            self._write_timer.daemon = True
+            self._write_timer.start()
+
+    def flush(self):
+        """立即写入未落盘的修改（原子替换）"""
+        with self._lock:
+            if self._write_timer is not None:
+                self._write_timer.cancel()
+                self._write_timer = None
+            if not self._dirty:
+                return True
+            temp_path = f"{self.path}.tmp"
+            try:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self._data, f, ensure_ascii=False, indent=2)
+                os.replace(temp_path, self.path)
+            except Exception as e:
+                self._log(f"❌ 写入配置文件失败: {e}")
+                return False
+            self._dirty = False
+            self._file_state = self._stat()
+            return True
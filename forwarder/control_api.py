@@ -0,0 +1,286 @@
+"""
+本地控制接口
+
+在指标接口的同一端口上提供消息队列的操作，运维脚本和压力测试不必经过界面：
+
+- GET  /queue?status=failed&rule=rule_1&offset=0&limit=50
+  分页查询消息（status 可选 pending / waiting / processing / replied / failed，逗号分隔多个），
+  同时返回各状态的消息数，可据此轮询队列是否已处理完
+- POST /queue/enqueue   批量注入消息：{"messages": [{"chat": "群名", "sender": "张三", "content": "...",
+  "source_type": "wechat"}, {"replay": "<消息ID>"}, ...]}，按当前规则匹配后入队，与监听到的消息相同
+- POST /queue/retry     重试失败的消息：{"ids": [...]}
+- POST /queue/delete    删除消息：{"ids": [...]}
+- POST /queue/clear     清除已完成的消息 {"scope": "completed"} 或全部消息 {"scope": "all"}
+- GET  /events          队列事件流（Server-Sent Events）：?types=replied,failed 只接收部分事件，
+  ?since=<序号> 先补发该序号之后的最近事件（断线重连时使用）
+
+POST 请求体必须是 JSON（Content-Type: application/json），浏览器页面无法跨站直接调用。
+默认关闭，通过配置 control_api 启用。
+"""
+
+from collections import deque
+from types import SimpleNamespace
+import json
+import queue
+import threading
+import time
+
+
+STATUSES = ('pending', 'waiting', 'processing', 'replied', 'failed')
+
+# 单次请求最多返回/处理的消息数
+MAX_PAGE_SIZE = 500
+MAX_BATCH_SIZE = 5000
+
+
+class _Subscription:
+    def __init__(self, types, size):
+        self.types = types
+        self.queue = queue.Queue(maxsize=size)
+        self.dropped = 0
+
+
+class EventStream:
+    """队列事件广播：保留最近的事件，并分发给每个订阅者各自的缓冲队列"""
+
+    def __init__(self, backlog=1000, subscriber_buffer=1000):
+        """
+        Args:
+            backlog (int): 保留的最近事件数（用于断线重连时补发）
+            subscriber_buffer (int): 每个订阅者的缓冲事件数，读取过慢时丢弃新事件
+        """
+        self.subscriber_buffer = subscriber_buffer
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._recent = deque(maxlen=backlog)
+        self._subscribers = []
+
+    def publish(self, event_type, **data):
+        """发布事件（不阻塞，可以在持有队列锁时调用）"""
+        with self._lock:
+            self._seq += 1
+            event = {'seq': self._seq, 'type': event_type, 'time': time.time(), **data}
+            self._recent.append(event)
+            for subscription in self._subscribers:
+                if subscription.types and event_type not in subscription.types:
+                    continue
+                try:
+                    subscription.queue.put_nowait(event)
+                except queue.Full:
+                    subscription.dropped += 1
+
+    def subscribe(self, types=None, since=None):
+        """订阅事件，since 不为None时先放入该序号之后的最近事件"""
+        subscription = _Subscription(set(types or ()), self.subscriber_buffer)
+        with self._lock:
+            if since is not None:
+                for event in self._recent:
+                    if event['seq'] > since and (not subscription.types or event['type'] in subscription.types):
+                        try:
+                            subscription.queue.put_nowait(event)
+                        except queue.Full:
+                            subscription.dropped += 1
+            self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+    def close(self):
+        """结束所有订阅（关闭接口时调用）"""
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, []
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(None)
+            except queue.Full:
+                # 缓冲区已满时丢弃最早的事件，保证结束标记能放入
+                subscription.queue.get_nowait()
+                subscription.queue.put_nowait(None)
+
+    def stream(self, types=None, since=None, heartbeat=15):
+        """按 Server-Sent Events 格式逐条生成事件文本，客户端断开后由调用方关闭生成器"""
+        subscription = self.subscribe(types, since)
+        try:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    event = subscription.queue.get(timeout=heartbeat)
+                except queue.Empty:
+                    # 定时发送注释行，及时发现已断开的客户端
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    return
+                if subscription.dropped:
+                    yield f"event: dropped\ndata: {json.dumps({'count': subscription.dropped})}\n\n"
+                    subscription.dropped = 0
+                yield f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+
+def _json(status, data):
+    return status, json.dumps(data, ensure_ascii=False) + '\n', 'application/json; charset=utf-8'
+
+
+def _id_list(data):
+    ids = data.get('ids') if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not all(isinstance(message_id, str) for message_id in ids):
+        raise ValueError('请求体需要 {"ids": ["消息ID", ...]}')
+    return ids
+
+
+class ControlAPI:
+    """消息队列控制接口，登记到 MetricsServer 上"""
+
+    def __init__(self, engine):
+        """
+        Args:
+            engine: ForwarderEngine，使用其 message_queue、events、is_system_message、is_self_message 和 log_message
+        """
+        self.engine = engine
+        self.enabled = False
+
+    def register(self, server):
+        server.add_route('GET', '/queue', self.handle_query)
+        server.add_route('POST', '/queue/enqueue', self.handle_enqueue, json_body=True)
+        server.add_route('POST', '/queue/retry', self.handle_retry, json_body=True)
+        server.add_route('POST', '/queue/delete', self.handle_delete, json_body=True)
+        server.add_route('POST', '/queue/clear', self.handle_clear, json_body=True)
+        server.add_route('GET', '/events', self.handle_events)
+
+    def _unavailable(self):
+        if not self.enabled:
+            return _json(403, {'error': '控制接口未启用（配置 control_api.enabled）'})
+        if self.engine.message_queue is None:
+            return _json(503, {'error': '消息队列未初始化'})
+        return None
+
+    # ---------- 查询 ----------
+
+    def handle_query(self, query, body):
+        unavailable = self._unavailable()
+        if unavailable:
+            return unavailable
+        statuses = [status for status in query.get('status', '').split(',') if status]
+        unknown = set(statuses) - set(STATUSES)
+        if unknown:
+            return _json(400, {'error': f"未知的状态: {', '.join(sorted(unknown))}"})
+        try:
+            offset = max(0, int(query.get('offset', 0)))
+            limit = min(MAX_PAGE_SIZE, max(1, int(query.get('limit', 50))))
+        except ValueError:
+            return _json(400, {'error': 'offset 和 limit 需要是整数'})
+
+        total, counts, items = self.engine.message_queue.query_messages(
+            statuses=statuses or None, rule_id=query.get('rule') or None, offset=offset, limit=limit)
+        return _json(200, {'total': total, 'offset': offset, 'limit': limit, 'counts': counts, 'items': items})
+
+    # ---------- 入队 ----------
+
+    def handle_enqueue(self, query, data):
+        unavailable = self._unavailable()
+        if unavailable:
+            return unavailable
+        messages = data.get('messages') if isinstance(data, dict) else data
+        if not isinstance(messages, list):
+            return _json(400, {'error': '请求体需要 {"messages": [...]}'})
+        if len(messages) > MAX_BATCH_SIZE:
+            return _json(413, {'error': f'单次最多注入 {MAX_BATCH_SIZE} 条消息'})
+
+        message_queue = self.engine.message_queue
+        added, skipped = [], []
+        for index, spec in enumerate(messages):
+            try:
+                msg, chat, source_type = self._build_message(spec)
+            except ValueError as e:
+                skipped.append({'index': index, 'reason': str(e)})
+                continue
+            if self.engine.is_system_message(msg) or self.engine.is_self_message(msg):
+                skipped.append({'index': index, 'reason': '系统消息或自己发送的消息'})
+                continue
+            items = message_queue.add_message_items(msg, msg.sender, chat, source_type, save=False)
+            if items:
+                added.extend(item['id'] for item in items)
+            else:
+                skipped.append({'index': index, 'reason': '未匹配任何规则或已合并到相同问题'})
+        message_queue.save_to_file()
+
+        self.engine.log_message(f"📥 控制接口注入 {len(messages)} 条消息：入队 {len(added)} 条，跳过 {len(skipped)} 条")
+        return _json(200, {'enqueued': added, 'skipped': skipped})
+
+    def _build_message(self, spec):
+        """把请求中的一项转换为与监听回调相同的 (消息, 聊天, 来源类型)"""
+        if not isinstance(spec, dict):
+            raise ValueError('每条消息需要是对象')
+        if 'replay' in spec:
+            original = self.engine.message_queue.find_message(spec['replay'])
+            if original is None:
+                raise ValueError(f"未找到消息: {spec['replay']}")
+            spec = {'chat': original.get('chat_name'), 'sender': original.get('sender'),
+                    'content': original.get('content'), 'source_type': original.get('source_type', 'wechat')}
+
+        content, chat_name = spec.get('content'), spec.get('chat')
+        if not isinstance(content, str) or not content or not isinstance(chat_name, str) or not chat_name:
+            raise ValueError('需要 chat 和 content')
+        source_type = spec.get('source_type', 'wechat')
+        if source_type not in ('wechat', 'wecom'):
+            raise ValueError(f"未知的来源类型: {source_type}")
+        msg = SimpleNamespace(content=content, sender=spec.get('sender') or '控制接口',
+                              type=spec.get('type', 'text'), attr=spec.get('attr', 'friend'))
+        return msg, SimpleNamespace(name=chat_name), source_type
+
+    # ---------- 重试、删除、清除 ----------
+
+    def handle_retry(self, query, data):
+        unavailable = self._unavailable()
+        if unavailable:
+            return unavailable
+        try:
+            ids = _id_list(data)
+        except ValueError as e:
+            return _json(400, {'error': str(e)})
+        retried, skipped = self.engine.message_queue.retry_messages(ids)
+        return _json(200, {'retried': retried, 'skipped': skipped})
+
+    def handle_delete(self, query, data):
+        unavailable = self._unavailable()
+        if unavailable:
+            return unavailable
+        try:
+            ids = _id_list(data)
+        except ValueError as e:
+            return _json(400, {'error': str(e)})
+        deleted = self.engine.message_queue.delete_messages(ids)
+        self.engine.log_message(f"🗑️ 控制接口删除 {deleted} 条消息")
+        return _json(200, {'deleted': deleted})
+
+    def handle_clear(self, query, data):
+        unavailable = self._unavailable()
+        if unavailable:
+            return unavailable
+        scope = data.get('scope') if isinstance(data, dict) else None
+        if scope == 'completed':
+            cleared = self.engine.message_queue.clear_completed()
+        elif scope == 'all':
+            cleared = self.engine.message_queue.clear_all()
+        else:
+            return _json(400, {'error': '请求体需要 {"scope": "completed"} 或 {"scope": "all"}'})
+        self.engine.log_message(f"🗑️ 控制接口清除{'已完成' if scope == 'completed' else '全部'}消息 {cleared} 条")
+        return _json(200, {'cleared': cleared})
+
+    # ---------- 事件流 ----------
+
+    def handle_events(self, query, body):
+        unavailable = self._unavailable()
+        if unavailable:
+            return unavailable
+        types = [event_type for event_type in query.get('types', '').split(',') if event_type]
+        try:
+            since = int(query['since']) if 'since' in query else None
+        except ValueError:
+            return _json(400, {'error': 'since 需要是整数'})
+        return 200, self.engine.events.stream(types, since), 'text/event-stream; charset=utf-8'
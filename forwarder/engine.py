@@ -0,0 +1,3064 @@
+"""
+转发引擎
+
+监听消息、消息队列、发送到目标、等待并提取AI回复、转发回源聊天的全部逻辑，不依赖 Tk：
+- 图形界面（wechat_message_forwarder_fixed.py）的 WeChatMessageForwarder 继承 ForwarderEngine，
+  只增加界面控件和界面相关的处理
+- 无界面模式（python -m forwarder --headless）直接运行 ForwarderEngine，只输出日志和指标
+
+需要界面配合的地方（错误提示、延迟调用、日志显示、规则列表刷新、剪贴板备用方法）
+都是可以重写的方法，默认实现只写日志或在后台线程中执行。
+"""
+
+import itertools
+import json
+import threading
+import time
+import os
+import traceback
+from datetime import datetime
+from wxauto import WeChat, WeCom
+from wxauto.utils.win32 import SetClipboardText
+from .reply_detection import (
+    ReplyCompletionDetector, UIAStructureStrategy, PixelDiffStrategy, BlockHashStrategy,
+    UIAMessageListProbe, images_identical, extract_last_reply
+)
+from .frame_recorder import FrameRecorder
+from .config_store import ConfigStore
+from .rule_index import RuleIndex
+from .message_classifier import MessageClassifier
+from .range_window import RangeWindowTracker
+from .loop_guard import LoopGuard
+from .reply_cache import ReplyCache
+from .file_log import AsyncFileLogWriter
+from .question_index import QuestionIndex, normalize_question
+from .listener_reconciler import ListenerReconciler, desired_listeners
+from .queue_snapshot import QueueSnapshot, build_queue_rows
+from .metrics import MetricsRegistry, MetricsServer
+from .tracing import Tracer
+from .profiler import Profiler
+from .control_api import ControlAPI, EventStream
+from PIL import ImageGrab
+from ctypes import windll
+import win32gui
+import win32con
+import win32api
+
+
+class MessageQueue:
+    """消息队列类 - 负责管理消息的存储、处理状态和持久化"""
+    
+    def __init__(self, forwarder):
+        self.forwarder = forwarder  # 引用主应用
+        
+        # 内存中的消息队列
+        self.pending_messages = []      # 待处理消息
+        self.processing_message = None   # 当前处理中的消息
+        self.replied_messages = []      # 已回复消息（最近100条）
+        self.is_processing = False      # 处理状态锁
+        self.version = 0                # 队列内容每次变化递增，界面据此判断是否需要刷新
+        self.on_change = None           # 队列内容变化后的回调（界面模式唤醒快照线程），需可在任意线程调用
+        # 队列锁：修改队列时持有；后台线程生成界面快照时短暂持有，复制需要显示的字段
+        # 加锁顺序：先 lock 后 coalesce_lock
+        self.lock = threading.RLock()
+        
+        # 文件路径
+        self.queue_file = "message_queue.json"
+        self.history_file = "message_history.json"  # 旧的历史文件，用于兼容
+        
+        # 规则对应的历史文件字典 {rule_id: history_file_path}
+        self.rule_history_files = {}
+        # 规则对应的历史消息 {rule_id: [messages]}
+        self.rule_replied_messages = {}
+        
+        # 相同问题合并：发往企业微信AI助手的问题在等待或处理期间，
+        # 后续相同（或近似）的提问合并到它上面，只发送一次，回复分发给每位提问者
+        self.coalesce_enabled = True
+        self.coalesce_lock = threading.Lock()
+        self.inflight_questions = QuestionIndex(near_duplicate=True)
+        self.inflight_items = {}        # {消息ID: 消息项}
+        self.id_sequence = itertools.count(1)   # 消息ID序号，同一毫秒内入队的相同内容也不会重复
+        
+        # 入队时命中回复缓存的消息：不进入待处理队列，由单独的线程直接转发缓存的回复
+        self.cached_messages = []
+        self.cached_ready = threading.Event()
+        
+        # 启动时加载历史数据
+        self.load_from_file()
+    
+    def generate_rule_history_filename(self, rule):
+        """生成规则对应的历史文件名"""
+        try:
+            source_type = rule['source']['type']
+            source_contact = rule['source']['contact']
+            target_type = rule['target']['type']
+            target_contact = rule['target']['contact']
+            
+            # 格式: message_history(源类型源联系人<>目标类型目标联系人).json
+            filename = f"message_history({source_type}{source_contact}<>{target_type}{target_contact}).json"
+            
+            # 处理文件名中的非法字符
+            import re
+            filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
+            
+            return filename
+        except Exception as e:
+            # 如果生成失败，使用规则ID作为后备
+            return f"message_history_rule_{rule.get('id', 'unknown')}.json"
+    
+    def get_rule_history_file(self, rule):
+        """获取规则对应的历史文件路径"""
+        rule_id = rule['id']
+        if rule_id not in self.rule_history_files:
+            self.rule_history_files[rule_id] = self.generate_rule_history_filename(rule)
+        return self.rule_history_files[rule_id]
+    
+    def get_rule_replied_messages(self, rule_id):
+        """获取规则对应的已回复消息列表"""
+        if rule_id not in self.rule_replied_messages:
+            self.rule_replied_messages[rule_id] = []
+        return self.rule_replied_messages[rule_id]
+    
+    def add_message(self, msg, sender, chat, source_type):
+        """按多规则匹配添加消息到队列，返回第一条入队的消息项（没有时返回None）"""
+        added_messages = [item for item in self.add_message_items(msg, sender, chat, source_type)
+                          if item['status'] == 'pending']
+        return added_messages[0] if added_messages else None
+    
+    def add_message_items(self, msg, sender, chat, source_type, save=True):
+        """按多规则匹配添加消息到队列
+        
+        Args:
+            save (bool): 是否立即保存队列文件（批量注入时最后统一保存）
+        
+        Returns:
+            list: 创建的消息项，包括入队的和合并到相同问题上的（status 为 waiting）
+        """
+        # 提取真实的聊天名称
+        if hasattr(chat, 'name'):
+            chat_name = chat.name
+        elif hasattr(chat, 'nickname'):
+            chat_name = chat.nickname
+        else:
+            # 从字符串中提取聊天名称，处理 <wxauto - Chat object("矿泉水会飞")> 格式
+            chat_str = str(chat)
+            if '"' in chat_str:
+                # 提取引号中的内容
+                start = chat_str.find('"') + 1
+                end = chat_str.rfind('"')
+                if start > 0 and end > start:
+                    chat_name = chat_str[start:end]
+                else:
+                    chat_name = chat_str
+            else:
+                chat_name = chat_str
+        
+        # 查找匹配的规则
+        matching_rules = self.forwarder.find_matching_rules(msg, chat_name, source_type)
+        
+        if not matching_rules:
+            # 没有匹配的规则，不添加到队列
+            self.forwarder.log_message(f"⚠️ 消息未匹配任何规则，跳过: {msg.content[:30]}...")
+            return []
+        
+        # 目标相同的规则只创建一个消息项，只发送一次，处理结果分别记入每条规则
+        rules_by_target = {}
+        for rule in matching_rules:
+            target_key = (rule['target']['type'], rule['target']['contact'])
+            rules_by_target.setdefault(target_key, []).append(rule)
+        
+        # 发往企业微信的问题入队时先查回复缓存（锁外查询，不阻塞队列）
+        cached_replies = {}
+        cache_checked = self.forwarder.reply_cache.enabled
+        for (target_type, target_contact), rules in rules_by_target.items():
+            if target_type == 'wecom':
+                cached = self.forwarder.reply_cache.get(target_contact, msg.content)
+                if cached:
+                    cached_replies[(target_type, target_contact)] = cached
+        
+        # 为每个目标创建一个消息项
+        with self.lock:
+            created_messages = []
+            added_messages = []
+            for target_key, (rule, *extra_rules) in rules_by_target.items():
+                message_item = {
+                    'id': f"{int(time.time() * 1000)}_{next(self.id_sequence)}_{hash(msg.content)}_{rule['id']}",
+                    'content': msg.content,
+                    'sender': sender,
+                    'chat_name': chat_name,
+                    'source_type': source_type,
+                    'matched_rule': rule,  # 存储匹配的规则
+                    'timestamp': time.time(),
+                    'status': 'pending',
+                    'created_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                }
+                if extra_rules:
+                    # 同时匹配、目标相同的其他规则
+                    message_item['extra_rules'] = extra_rules
+                    self.forwarder.log_message(
+                        f"🔀 {len(extra_rules) + 1} 条规则目标相同，只发送一次: "
+                        f"{', '.join(r['name'] for r in [rule] + extra_rules)}", rule['id'])
+                
+                created_messages.append(message_item)
+                if cache_checked and target_key[0] == 'wecom':
+                    # 入队时已计入缓存查找次数，出队时再查不重复计数
+                    message_item['reply_cache_checked'] = True
+                if target_key in cached_replies:
+                    message_item['cached_reply'] = cached_replies[target_key]
+                    self._enqueue_cached_locked(message_item)
+                elif self._enqueue_locked(message_item):
+                    added_messages.append(message_item)
+            
+            if save:
+                self.save_to_file()  # 立即保存到文件
+            else:
+                self.touch()
+            if added_messages:
+                self.forwarder.log_message(f"✅ 共添加 {len(added_messages)} 条消息到队列 (总长度: {len(self.pending_messages)})")
+        
+        return created_messages
+    
+    def _enqueue_locked(self, message_item):
+        """新消息项入队，或合并到等待中的相同问题上（返回是否入队）"""
+        rule = message_item['matched_rule']
+        self.forwarder.tracer.start_trace(message_item)
+        leader = self.attach_to_inflight(message_item)
+        if leader:
+            self.forwarder.log_message(
+                f"🔗 相同问题正在等待AI回复，合并到 {leader['chat_name']}/{leader['sender']} 的提问"
+                f"（共{len(leader['waiters']) + 1}人）: {message_item['content'][:30]}...", rule['id'])
+            self.publish_event('coalesced', message_item, leader=leader['id'])
+            return False
+        
+        self.pending_messages.append(message_item)
+        self.forwarder.metrics.inc('messages_enqueued_total', help='入队消息数', rule=rule['id'])
+        self.forwarder.log_message(f"📝 消息入队[{rule['name']}]: {message_item['content'][:30]}...", rule['id'])
+        self.publish_event('enqueued', message_item)
+        return True
+    
+    def _enqueue_cached_locked(self, message_item):
+        """命中回复缓存的消息项入队，不排在待处理消息后面"""
+        rule = message_item['matched_rule']
+        self.forwarder.tracer.start_trace(message_item)
+        self.cached_messages.append(message_item)
+        self.cached_ready.set()
+        self.forwarder.metrics.inc('messages_enqueued_total', help='入队消息数', rule=rule['id'])
+        self.forwarder.log_message(f"💾 命中回复缓存，直接回复[{rule['name']}]: {message_item['content'][:30]}...", rule['id'])
+        self.publish_event('enqueued', message_item, cached=True)
+    
+    def next_cached_message(self):
+        """取出下一条命中回复缓存的消息，没有时返回None"""
+        with self.lock:
+            if not self.cached_messages:
+                self.cached_ready.clear()
+                return None
+            message_item = self.cached_messages.pop(0)
+            message_item['status'] = 'processing'
+            self.touch()
+        self.publish_event('processing', message_item)
+        return message_item
+    
+    def requeue(self, message_item):
+        """缓存回复转发失败的消息改为排队发送给目标"""
+        with self.lock:
+            message_item.pop('cached_reply', None)
+            message_item['status'] = 'pending'
+            message_item['skip_reply_cache'] = True
+            self.pending_messages.append(message_item)
+            self.save_to_file()
+    
+    def publish_event(self, event_type, message_item, **data):
+        """发布队列事件（控制接口的事件流）"""
+        rule = message_item.get('matched_rule') or {}
+        self.forwarder.events.publish(
+            event_type, id=message_item.get('id'), rule=rule.get('id'), chat=message_item.get('chat_name'),
+            sender=message_item.get('sender'), content=message_item.get('content', '')[:100], **data)
+    
+    def configure_coalescing(self, enabled=True, near_duplicate=True, threshold=0.85):
+        """更新相同问题合并设置"""
+        with self.coalesce_lock:
+            self.coalesce_enabled = enabled
+            self.inflight_questions.configure(near_duplicate, threshold)
+    
+    def is_inflight(self, message_item):
+        """消息是否仍在等待处理或正在处理"""
+        return message_item is self.processing_message or any(m is message_item for m in self.pending_messages)
+    
+    def attach_to_inflight(self, message_item):
+        """把发往企业微信的消息合并到等待中或处理中的相同问题上
+        
+        Returns:
+            dict: 合并到的消息项；没有可合并的消息时登记为新的提问并返回None
+        """
+        target = message_item['matched_rule']['target']
+        if not self.coalesce_enabled or target['type'] != 'wecom':
+            return None
+        
+        question = normalize_question(message_item['content'])
+        with self.coalesce_lock:
+            key, _ = self.inflight_questions.find(target['contact'], question)
+            leader = self.inflight_items.get(key)
+            if leader is not None and self.is_inflight(leader):
+                message_item['status'] = 'waiting'
+                message_item['coalesced_into'] = leader['id']
+                leader.setdefault('waiters', []).append(message_item)
+                return leader
+            if key is not None:
+                # 已被删除或清空的消息，不再接受合并
+                self._release_locked(key)
+            self._register_locked(message_item, target['contact'], question)
+            return None
+    
+    def _register_locked(self, message_item, target_contact, question):
+        self.inflight_questions.add(message_item['id'], target_contact, question)
+        self.inflight_items[message_item['id']] = message_item
+    
+    def _release_locked(self, message_id):
+        self.inflight_questions.remove(message_id)
+        self.inflight_items.pop(message_id, None)
+    
+    def take_waiters(self, message_item):
+        """取出合并到该消息上的提问，此后相同问题不再合并到该消息"""
+        with self.coalesce_lock:
+            self._release_locked(message_item['id'])
+            return message_item.pop('waiters', [])
+    
+    def get_next_message(self):
+        """获取下一条待处理消息"""
+        with self.lock:
+            if self.pending_messages and not self.is_processing:
+                self.touch()
+                return self.pending_messages.pop(0)
+            return None
+    
+    def touch(self):
+        """标记队列内容已变化，并通知变化回调"""
+        with self.lock:
+            self.version += 1
+        if self.on_change:
+            self.on_change()
+    
+    def save_to_file(self):
+        """保存当前状态到文件（队列的每次修改都会保存，同时标记队列已变化）"""
+        with self.lock:
+            self.touch()
+            self._save_locked()
+    
+    def _save_locked(self):
+        try:
+            queue_data = {
+                'pending_messages': self.pending_messages,
+                'cached_messages': self.cached_messages,
+                'processing_message': self.processing_message,
+                'is_processing': self.is_processing,
+                'last_save_time': time.time(),
+                'version': '1.0'
+            }
+            
+            # 保存队列状态
+            with open(self.queue_file, 'w', encoding='utf-8') as f:
+                json.dump(queue_data, f, ensure_ascii=False, indent=2)
+            
+            # 保存规则对应的历史记录（每个规则保留最近100条）
+            for rule_id, messages in self.rule_replied_messages.items():
+                if len(messages) > 0:
+                    # 获取规则信息用于生成文件名
+                    rule = self.find_rule_by_id(rule_id)
+                    if rule:
+                        history_file = self.get_rule_history_file(rule)
+                        with open(history_file, 'w', encoding='utf-8') as f:
+                            json.dump(messages[-100:], f, ensure_ascii=False, indent=2)
+            
+            # 为了兼容性，仍然保存一个总的历史文件（将所有规则的消息合并）
+            all_replied_messages = []
+            for messages in self.rule_replied_messages.values():
+                all_replied_messages.extend(messages)
+            
+            if len(all_replied_messages) > 0:
+                # 按时间排序
+                all_replied_messages.sort(key=lambda x: x.get('completed_time', 0))
+                with open(self.history_file, 'w', encoding='utf-8') as f:
+                    json.dump(all_replied_messages[-100:], f, ensure_ascii=False, indent=2)
+                    
+        except Exception as e:
+            self.forwarder.log_message(f"💾 保存消息队列失败: {e}")
+    
+    def find_rule_by_id(self, rule_id):
+        """根据ID查找规则"""
+        try:
+            for rule in self.forwarder.forwarding_rules:
+                if rule['id'] == rule_id:
+                    return rule
+            return None
+        except Exception:
+            return None
+    
+    def load_rule_history_files(self):
+        """加载所有规则对应的历史文件"""
+        try:
+            # 遍历所有存在的message_history文件
+            import glob
+            history_files = glob.glob("message_history*.json")
+            
+            for file_path in history_files:
+                # 跳过旧的全局历史文件
+                if file_path == self.history_file:
+                    continue
+                
+                try:
+                    with open(file_path, 'r', encoding='utf-8') as f:
+                        messages = json.load(f)
+                    
+                    # 尝试从消息中提取规则ID
+                    if messages and len(messages) > 0:
+                        for msg in messages:
+                            if 'matched_rule' in msg and msg['matched_rule']:
+                                rule_id = msg['matched_rule']['id']
+                                if rule_id not in self.rule_replied_messages:
+                                    self.rule_replied_messages[rule_id] = []
+                                # 避免重复添加
+                                if msg not in self.rule_replied_messages[rule_id]:
+                                    self.rule_replied_messages[rule_id].append(msg)
+                                break  # 找到规则ID后停止遍历
+                        
+                        # 如果找到了规则ID，更新文件路径映射
+                        if messages and 'matched_rule' in messages[0]:
+                            rule_id = messages[0]['matched_rule']['id']
+                            self.rule_history_files[rule_id] = file_path
+                            # 确保所有消息都在正确的规则下
+                            if rule_id not in self.rule_replied_messages:
+                                self.rule_replied_messages[rule_id] = []
+                            self.rule_replied_messages[rule_id] = messages
+                                
+                except Exception as e:
+                    if self.forwarder:
+                        self.forwarder.log_message(f"⚠️ 加载历史文件{file_path}失败: {e}")
+                        
+        except Exception as e:
+            if self.forwarder:
+                self.forwarder.log_message(f"⚠️ 加载规则历史文件失败: {e}")
+    
+    def load_from_file(self):
+        """从文件加载历史状态"""
+        try:
+            # 加载队列状态
+            if os.path.exists(self.queue_file):
+                with open(self.queue_file, 'r', encoding='utf-8') as f:
+                    queue_data = json.load(f)
+                    self.pending_messages = queue_data.get('pending_messages', [])
+                    # 命中缓存但未来得及转发的消息重新入队（处理时会再查一次缓存）
+                    for message_item in reversed(queue_data.get('cached_messages', [])):
+                        message_item.pop('cached_reply', None)
+                        message_item['status'] = 'pending'
+                        self.pending_messages.insert(0, message_item)
+                    self.processing_message = queue_data.get('processing_message')
+                    # 重启后重置处理状态
+                    self.is_processing = False
+                
+                # 恢复待处理问题的合并索引，重启后相同问题仍合并到原来的提问上
+                with self.coalesce_lock:
+                    for message_item in self.pending_messages:
+                        target = message_item.get('matched_rule', {}).get('target', {})
+                        if target.get('type') == 'wecom':
+                            self._register_locked(message_item, target['contact'], normalize_question(message_item['content']))
+            
+            # 加载规则对应的历史记录
+            self.load_rule_history_files()
+            
+            # 为了兼容性，仍然加载旧的全局历史文件
+            all_replied_messages = []
+            if os.path.exists(self.history_file):
+                with open(self.history_file, 'r', encoding='utf-8') as f:
+                    legacy_messages = json.load(f)
+                    all_replied_messages.extend(legacy_messages)
+            
+            # 合并所有规则的历史消息用于显示
+            for messages in self.rule_replied_messages.values():
+                all_replied_messages.extend(messages)
+            
+            # 按时间排序并去重
+            all_replied_messages.sort(key=lambda x: x.get('completed_time', 0))
+            seen_ids = set()
+            self.replied_messages = []
+            for msg in all_replied_messages:
+                msg_id = msg.get('id')
+                if msg_id and msg_id not in seen_ids:
+                    seen_ids.add(msg_id)
+                    self.replied_messages.append(msg)
+            
+            if self.forwarder:
+                total_rule_messages = sum(len(messages) for messages in self.rule_replied_messages.values())
+                self.forwarder.log_message(f"📂 加载消息队列: 待处理{len(self.pending_messages)}条, 历史{len(self.replied_messages)}条 (各规则共{total_rule_messages}条)")
+                
+                # 检查是否有未回复或失败的消息
+                failed_messages = []
+                for messages in self.rule_replied_messages.values():
+                    failed_messages.extend([msg for msg in messages if msg.get('status') == 'failed'])
+                
+                if self.pending_messages or failed_messages:
+                    # 延迟调用警告，等待message_queue属性设置完成
+                    self.forwarder.call_later(100, self.forwarder.show_restart_warning)
+            
+        except Exception as e:
+            if self.forwarder:
+                self.forwarder.log_message(f"📂 加载消息队列失败: {e}")
+    
+    def get_queue_status(self):
+        """获取队列状态信息"""
+        with self.lock:
+            return {
+                'pending_count': len(self.pending_messages) + len(self.cached_messages),
+                'processing': self.processing_message is not None,
+                'replied_count': len(self.replied_messages),
+                'is_processing': self.is_processing
+            }
+    
+    def build_snapshot(self, queue_label, recent_count=10):
+        """生成界面显示用的队列快照（在后台线程调用）
+        
+        锁内只复制需要显示的字段，字符串截取和队列ID计算在锁外进行
+        
+        Args:
+            queue_label (Callable[[str], str]): 规则ID -> 队列ID显示文本
+            recent_count (int): 显示最近完成的消息条数
+        """
+        def fields(msg):
+            rule = msg.get('matched_rule') or {}
+            return (msg['id'], msg.get('created_time', ''), msg.get('chat_name', ''),
+                    msg.get('sender', ''), msg.get('content', ''), rule.get('id'))
+        
+        with self.lock:
+            version = self.version
+            pending = [(fields(msg), msg.get('status')) for msg in self.cached_messages + self.pending_messages]
+            processing = fields(self.processing_message) if self.processing_message else None
+            recent = [(fields(msg), msg.get('status')) for msg in self.replied_messages[-recent_count:]]
+            replied_count = len(self.replied_messages)
+            is_processing = self.is_processing
+        
+        rows = build_queue_rows(pending, processing, recent, queue_label)
+        return QueueSnapshot(version, rows, len(pending), is_processing, replied_count)
+    
+    def start_processing(self, message_item):
+        """标记消息开始处理"""
+        with self.lock:
+            self.is_processing = True
+            self.processing_message = message_item
+            message_item['status'] = 'processing'
+            message_item['process_start_time'] = time.time()
+            self.save_to_file()  # 保存处理状态
+        self.publish_event('processing', message_item)
+    
+    def _all_messages_locked(self):
+        """全部消息项：处理中、待处理（各自后面是合并到其上的提问）、历史（最新的在前）"""
+        active = [self.processing_message] if self.processing_message else []
+        yield from self.cached_messages
+        for message_item in active + self.pending_messages:
+            yield message_item
+            yield from message_item.get('waiters', [])
+        yield from reversed(self.replied_messages)
+    
+    @staticmethod
+    def _summary(message_item):
+        rule = message_item.get('matched_rule') or {}
+        summary = {
+            'id': message_item.get('id'),
+            'status': message_item.get('status'),
+            'rule': rule.get('id'),
+            'target': rule.get('target', {}).get('contact'),
+            'chat': message_item.get('chat_name'),
+            'sender': message_item.get('sender'),
+            'content': message_item.get('content'),
+            'source_type': message_item.get('source_type'),
+            'created_time': message_item.get('created_time'),
+        }
+        for key in ('ai_reply', 'last_error', 'completed_time', 'failed_time', 'coalesced_into', 'retry_of'):
+            if key in message_item:
+                summary[key] = message_item[key]
+        if message_item.get('waiters'):
+            summary['waiters'] = [waiter['id'] for waiter in message_item['waiters']]
+        return summary
+    
+    def query_messages(self, statuses=None, rule_id=None, offset=0, limit=50):
+        """分页查询消息（控制接口）
+        
+        Args:
+            statuses (list, optional): 只返回这些状态的消息
+            rule_id (str, optional): 只返回该规则的消息
+        
+        Returns:
+            tuple: (符合条件的消息总数, {状态: 全部消息中该状态的数量}, [本页消息摘要])
+        """
+        with self.lock:
+            counts = {}
+            matched = []
+            for message_item in self._all_messages_locked():
+                status = message_item.get('status')
+                counts[status] = counts.get(status, 0) + 1
+                if statuses and status not in statuses:
+                    continue
+                if rule_id and (message_item.get('matched_rule') or {}).get('id') != rule_id:
+                    continue
+                matched.append(message_item)
+            page = [self._summary(message_item) for message_item in matched[offset:offset + limit]]
+        return len(matched), counts, page
+    
+    def find_message(self, message_id):
+        """按ID查找队列或历史中的消息项"""
+        with self.lock:
+            for message_item in self._all_messages_locked():
+                if message_item.get('id') == message_id:
+                    return message_item
+        return None
+    
+    def delete_messages(self, message_ids):
+        """按ID删除待处理、处理中、合并等待中和历史消息，返回删除条数
+        
+        删除的提问上合并了其他提问时，由第一位未删除的提问者接替，重新排队（见 _promote_waiters_locked）
+        """
+        ids_to_delete = set(message_ids)
+        deleted = []
+        promoted = []   # [(接替的消息项, 被删除的消息项)]
+        with self.lock:
+            with self.coalesce_lock:
+                # 删除合并到等待中问题上的提问
+                active = [self.processing_message] if self.processing_message else []
+                for leader in active + self.pending_messages:
+                    waiters = leader.get('waiters')
+                    if waiters:
+                        leader['waiters'] = [waiter for waiter in waiters if waiter['id'] not in ids_to_delete]
+                        deleted.extend(waiter for waiter in waiters if waiter['id'] in ids_to_delete)
+                
+                # 删除待处理消息，接替的提问排在原来的位置
+                remaining = []
+                for message_item in self.pending_messages:
+                    if message_item['id'] not in ids_to_delete:
+                        remaining.append(message_item)
+                        continue
+                    deleted.append(message_item)
+                    new_leader = self._promote_waiters_locked(message_item)
+                    if new_leader:
+                        remaining.append(new_leader)
+                        promoted.append((new_leader, message_item))
+                self.pending_messages = remaining
+                
+                # 检查正在处理的消息，接替的提问排在最前面
+                if self.processing_message and self.processing_message['id'] in ids_to_delete:
+                    deleted.append(self.processing_message)
+                    new_leader = self._promote_waiters_locked(self.processing_message)
+                    if new_leader:
+                        self.pending_messages.insert(0, new_leader)
+                        promoted.append((new_leader, self.processing_message))
+                    self.processing_message = None
+                    self.is_processing = False
+            
+            remaining = []
+            for message_item in self.cached_messages:
+                (deleted if message_item['id'] in ids_to_delete else remaining).append(message_item)
+            self.cached_messages = remaining
+            
+            # 删除历史消息
+            remaining = []
+            for message_item in self.replied_messages:
+                (deleted if message_item['id'] in ids_to_delete else remaining).append(message_item)
+            self.replied_messages = remaining
+            
+            if deleted:
+                self.save_to_file()
+        
+        for message_item in deleted:
+            if message_item.get('status') in ('pending', 'waiting', 'processing'):
+                self.forwarder.tracer.end_trace(message_item, 'deleted')
+            self.publish_event('deleted', message_item)
+        for new_leader, old_leader in promoted:
+            self.forwarder.log_message(
+                f"🔁 合并到的提问已删除，改由 {new_leader['chat_name']}/{new_leader['sender']} 重新提问"
+                f"（共{len(new_leader.get('waiters', [])) + 1}人）: {new_leader['content'][:30]}...",
+                new_leader['matched_rule']['id'])
+            self.publish_event('enqueued', new_leader, replaced=old_leader['id'])
+            for waiter in new_leader.get('waiters', []):
+                self.publish_event('coalesced', waiter, leader=new_leader['id'])
+        return len(deleted)
+    
+    def _promote_waiters_locked(self, leader):
+        """被删除的消息上合并的提问改由第一位提问者作为新的提问，其余提问合并到它上面（需持有 coalesce_lock）
+        
+        Returns:
+            dict: 接替的消息项，没有合并的提问时返回None
+        """
+        self._release_locked(leader['id'])
+        waiters = leader.pop('waiters', None)
+        if not waiters:
+            return None
+        new_leader, *rest = waiters
+        new_leader['status'] = 'pending'
+        new_leader.pop('coalesced_into', None)
+        if rest:
+            new_leader['waiters'] = rest
+            for waiter in rest:
+                waiter['coalesced_into'] = new_leader['id']
+        self._register_locked(new_leader, new_leader['matched_rule']['target']['contact'],
+                              normalize_question(new_leader['content']))
+        return new_leader
+    
+    def retry_messages(self, message_ids):
+        """按当前规则重新入队失败的消息（原失败记录保留在规则历史中）
+        
+        Returns:
+            tuple: ([(原消息ID, 新消息ID)], [跳过的消息ID])
+        """
+        retried, skipped = [], []
+        with self.lock:
+            failed = {msg['id']: msg for msg in self.replied_messages
+                      if msg.get('status') == 'failed' and not msg.get('deduplicated_into')}
+            for message_id in message_ids:
+                original = failed.pop(message_id, None)
+                rule = self.find_rule_by_id((original.get('matched_rule') or {}).get('id')) if original else None
+                if rule is None:
+                    skipped.append(message_id)
+                    continue
+                
+                retry_item = {
+                    'id': f"{int(time.time() * 1000)}_{next(self.id_sequence)}_{hash(original['content'])}_{rule['id']}",
+                    'content': original['content'],
+                    'sender': original.get('sender'),
+                    'chat_name': original.get('chat_name'),
+                    'source_type': original.get('source_type'),
+                    'matched_rule': rule,
+                    'timestamp': time.time(),
+                    'status': 'pending',
+                    'created_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    'retry_of': message_id
+                }
+                extra_rules = [self.find_rule_by_id(extra['id']) for extra in original.get('extra_rules', [])]
+                if any(extra_rules):
+                    retry_item['extra_rules'] = [extra for extra in extra_rules if extra]
+                
+                self.replied_messages.remove(original)
+                self._enqueue_locked(retry_item)
+                self.publish_event('retried', original, new_id=retry_item['id'])
+                retried.append((message_id, retry_item['id']))
+            
+            if retried:
+                self.save_to_file()
+                self.forwarder.log_message(f"🔁 已重新入队 {len(retried)} 条失败消息")
+        return retried, skipped
+    
+    def clear_completed(self):
+        """清除已完成的历史消息（保留失败的），返回清除条数"""
+        with self.lock:
+            failed_messages = [msg for msg in self.replied_messages if msg['status'] == 'failed']
+            cleared = len(self.replied_messages) - len(failed_messages)
+            self.replied_messages = failed_messages
+            self.save_to_file()
+        self.forwarder.events.publish('cleared', scope='completed', count=cleared)
+        return cleared
+    
+    def clear_all(self):
+        """清除全部待处理、处理中和历史消息，返回清除条数"""
+        with self.lock:
+            unfinished = self.cached_messages + self.pending_messages
+            if self.processing_message:
+                unfinished.append(self.processing_message)
+            # 合并在这些提问上的提问一起清除
+            unfinished += [waiter for message_item in unfinished for waiter in message_item.get('waiters', [])]
+            cleared = len(unfinished) + len(self.replied_messages)
+            
+            self.cached_messages = []
+            self.pending_messages = []
+            self.replied_messages.clear()
+            self.processing_message = None
+            self.is_processing = False
+            self.save_to_file()
+        
+        for message_item in unfinished:
+            self.forwarder.tracer.end_trace(message_item, 'deleted')
+        self.forwarder.events.publish('cleared', scope='all', count=cleared)
+        return cleared
+    
+    def mark_message_completed(self, message_item, ai_reply, success=True):
+        """标记消息处理完成"""
+        with self.lock:
+            self.record_result(message_item, ai_reply, success)
+            
+            # 回复未能分发的合并提问随该消息一起结束
+            for waiter in self.take_waiters(message_item):
+                self.record_result(waiter, ai_reply if not success else "未收到合并提问的回复", success=False)
+            
+            self.processing_message = None
+            self.is_processing = False
+            self.save_to_file()
+    
+    def record_result(self, message_item, ai_reply, success=True):
+        """记录消息的处理结果到规则历史（不改变队列的处理状态）
+        
+        消息同时属于多条目标相同的规则时，为其他规则各记一条结果，规则统计不受合并发送影响
+        """
+        with self.lock:
+            self._record_results_locked(message_item, ai_reply, success)
+        if success:
+            self.publish_event('replied', message_item)
+        else:
+            self.publish_event('failed', message_item, error=ai_reply)
+        self.forwarder.tracer.end_trace(message_item, 'replied' if success else 'failed')
+    
+    def _record_results_locked(self, message_item, ai_reply, success):
+        self._record_rule_result(message_item, ai_reply, success)
+        for rule in message_item.get('extra_rules', []):
+            rule_item = {
+                key: value for key, value in message_item.items()
+                if key not in ('extra_rules', 'waiters')
+            }
+            rule_item['id'] = f"{message_item['id']}_{rule['id']}"
+            rule_item['matched_rule'] = rule
+            rule_item['deduplicated_into'] = message_item['id']
+            self._record_rule_result(rule_item, ai_reply, success)
+    
+    def _record_rule_result(self, message_item, ai_reply, success):
+        # 提取规则ID用于日志
+        rule_id = None
+        if 'matched_rule' in message_item and message_item['matched_rule']:
+            rule_id = message_item['matched_rule']['id']
+        
+        self.forwarder.metrics.inc('messages_completed_total', help='处理完成的消息数（按结果）',
+                                   rule=rule_id or '', result='replied' if success else 'failed')
+        if success:
+            message_item['status'] = 'replied'
+            message_item['ai_reply'] = ai_reply
+            message_item['completed_time'] = time.time()
+            
+            # 添加到规则对应的历史消息中
+            if rule_id:
+                rule_messages = self.get_rule_replied_messages(rule_id)
+                rule_messages.append(message_item)
+            
+            # 为了兼容性，仍然保持全局列表
+            self.replied_messages.append(message_item)
+            self.forwarder.log_message(f"✅ 消息处理完成: {message_item['content'][:30]}...", rule_id, message_item.get('id'), 'completed')
+        else:
+            message_item['status'] = 'failed'
+            message_item['last_error'] = ai_reply  # 这里ai_reply实际是错误信息
+            message_item['failed_time'] = time.time()
+            
+            # 添加到规则对应的历史消息中
+            if rule_id:
+                rule_messages = self.get_rule_replied_messages(rule_id)
+                rule_messages.append(message_item)
+            
+            # 为了兼容性，仍然保持全局列表
+            self.replied_messages.append(message_item)
+            self.forwarder.log_message(f"❌ 消息处理失败: {ai_reply}", rule_id, message_item.get('id'), 'failed')
+    
+    def trim_queue(self, max_size):
+        """修剪队列到指定大小"""
+        with self.lock:
+            self._trim_locked(max_size)
+    
+    def _trim_locked(self, max_size):
+        try:
+            total_messages = len(self.pending_messages) + len(self.replied_messages)
+            if total_messages > max_size:
+                # 首先从已完成的消息中删除最早的
+                excess = total_messages - max_size
+                if len(self.replied_messages) > excess:
+                    self.replied_messages = self.replied_messages[excess:]
+                    self.forwarder.log_message(f"🗑️ 已清理 {excess} 条历史消息，保持队列在 {max_size} 条以内")
+                else:
+                    # 如果历史消息不够删，需要从待处理中删除
+                    remaining_excess = excess - len(self.replied_messages)
+                    self.replied_messages.clear()
+                    if remaining_excess < len(self.pending_messages):
+                        self.pending_messages = self.pending_messages[remaining_excess:]
+                        self.forwarder.log_message(f"⚠️ 队列满，已删除 {excess} 条消息（包括待处理消息）")
+                
+                self.save_to_file()
+        except Exception as e:
+            self.forwarder.log_message(f"❌ 修剪队列失败: {e}")
+
+
+def enable_dpi_awareness():
+    """设置进程DPI感知，截图和点击坐标使用物理像素"""
+    try:
+        # 设置进程DPI感知
+        windll.shcore.SetProcessDpiAwareness(1)
+    except Exception:
+        try:
+            windll.user32.SetProcessDPIAware()
+        except Exception:
+            pass  # 如果都失败就忽略
+
+
+class ForwarderEngine:
+    """转发引擎：规则、消息队列、监听和处理线程、持久化、日志和指标"""
+    
+    def __init__(self, config_path='forwarder_config.json'):
+        # 转发状态
+        self.is_forwarding = False
+        self.forward_thread = None
+        
+        # 微信实例
+        self.wechat = None
+        self.wecom = None
+        
+        # 记录最近的AI回复，避免循环转发（保留30分钟内最多2000条的指纹）
+        self.loop_guard = LoopGuard(window_seconds=1800, max_entries=2000)
+        
+        # AI回复缓存（默认关闭，通过配置 reply_cache 启用）
+        self.reply_cache = ReplyCache('reply_cache.json', log=self.log_message)
+        
+        # 界面操作锁：发送、检测截图、复制回复和转发回复都要切换窗口、点击、粘贴或读写剪贴板，
+        # 消息处理器和缓存回复转发线程同时运行时不能交错（等待回复期间只在每次截图和复制时持有）
+        self.ui_lock = threading.RLock()
+
+        # 处理耗时指标（本地 /metrics 接口和界面统计面板，通过配置 metrics 设置端口）
+        self.metrics = MetricsRegistry()
+        self.metrics_server = MetricsServer(self.metrics, log=self.log_message)
+        self.register_metric_gauges()
+        
+        # 消息处理跟踪（默认关闭，通过配置 tracing 启用，输出 traces/trace_YYYY-MM-DD.json）
+        self.tracer = Tracer('traces')
+        
+        # 运行中性能分析（界面按钮或本地接口 POST /profile 触发，结果写入 profiles/）
+        self.profiling_config = {}
+        self.profiler = Profiler('profiles', log=self.log_message, object_counts=self.get_profiling_counts)
+        self.metrics_server.add_route('POST', '/profile', self.handle_profile_request, json_body=True)
+        self.metrics_server.add_route('GET', '/profile', self.handle_profile_status)
+        
+        # 本地控制接口（查询、注入、重试、删除消息和事件流，默认关闭，通过配置 control_api 启用）
+        self.events = EventStream()
+        self.control_api = ControlAPI(self)
+        self.control_api.register(self.metrics_server)
+        
+        # 其他设置默认值
+        self.log_retention_days = 10
+        self.queue_max_size = 600
+        self.detection_delay = 2    # AI回复检测延迟（秒）
+        self.mention_name = ''      # @检测使用的昵称，为空时使用当前微信昵称
+        
+        # 日志文件（后台线程写入 logs/forwarder_YYYY-MM-DD.log，处理线程不等待磁盘）
+        self.file_log = AsyncFileLogWriter('logs', retention_days=self.log_retention_days)
+        self.file_log.start()
+        
+        # 配置存储（启动时加载一次，之后从内存快照读取）
+        self.config_store = ConfigStore(config_path, log=self.log_message)
+        
+        # 调试截图记录器（默认关闭，通过配置 debug_frames 启用）
+        self.frame_recorder = FrameRecorder(log=self.log_message)
+        
+        # AI回复完成检测引擎（检测策略可按目标联系人通过配置 reply_detection 选择）
+        self.reply_detection_config = {}
+        self.reply_detector = ReplyCompletionDetector({
+            'uia': UIAStructureStrategy,
+            'pixel': lambda: PixelDiffStrategy(self.capture_for_detection),
+            'block_hash': lambda: BlockHashStrategy(self.capture_for_detection),
+        }, log=self.log_message)
+        
+        # 当前微信昵称
+        self.current_wechat_nickname = None
+        
+        # 多规则转发系统
+        self.forwarding_rules = []
+        self.rule_index = RuleIndex()
+        self.rules_version = 0      # 每次重建规则索引递增，转发循环据此对账监听
+        # "指定范围"过滤的跨消息窗口状态（持久化，重启后继续有效）
+        self.range_tracker = RangeWindowTracker('range_windows.json', log=self.log_message)
+        # 系统消息、自己消息和规则匹配判断
+        self.message_classifier = MessageClassifier(
+            lambda: self.rule_index,
+            self.loop_guard,
+            self_name_provider=self.get_wechat_nickname,
+            log=self.log_message
+        )
+        self.selected_rule_index = 0
+        self.init_default_rule()  # 初始化默认规则
+        
+        # 消息队列系统（在 initialize 中创建）
+        self.message_queue = None
+        self.message_processor_thread = None
+        
+        # 转发配置
+        self.config = {
+            'source': {
+                'type': 'wechat',  # wechat 或 wecom
+                'contact': '',
+                'filter_type': 'all',  # all, mention_me, mention_range
+                'range_start': '@本人',
+                'range_end': '@本人并说结束'
+            },
+            'target': {
+                'type': 'wecom',  # wechat 或 wecom
+                'contact': ''
+            }
+        }
+    
+    def initialize(self):
+        """创建消息队列并加载配置（界面模式在界面创建之后调用）"""
+        self.message_queue = MessageQueue(self)
+        self.load_config()
+    
+    def shutdown(self, timeout=5):
+        """停止转发、等待监听移除并关闭本地接口"""
+        if self.is_forwarding:
+            self.stop_forwarding()
+        if self.forward_thread:
+            self.forward_thread.join(timeout)
+        self.profiler.stop()
+        self.events.close()
+        self.metrics_server.stop()
+    
+    # ---------- 界面回调（界面模式重写） ----------
+    
+    def call_later(self, delay_ms, callback):
+        """延迟调用（界面模式在界面线程中调用）"""
+        timer = threading.Timer(delay_ms / 1000, callback)
+        timer.daemon = True
+        timer.start()
+    
+    def notify_error(self, title, message):
+        """提示错误（界面模式同时弹出对话框）"""
+        self.log_message(f"❌ {title}: {message}")
+    
+    def display_log(self, log_entry):
+        """显示一行日志（界面模式写入日志文本框）"""
+        print(log_entry.strip())
+    
+    def rules_changed(self):
+        """规则重新加载后调用（界面模式同时刷新规则列表）"""
+        self.rebuild_rule_index()
+    
+    def set_clipboard_fallback(self, text):
+        """win32剪贴板设置失败时的备用方法"""
+        SetClipboardText(text)
+    
+    def init_default_rule(self):
+        """初始化默认转发规则"""
+        default_rule = {
+            'id': 'rule_1',
+            'name': '规列1',
+            'enabled': True,
+            'source': {
+                'type': 'wechat',
+                'contact': '',
+                'filter_type': 'all',
+                'range_start': '',
+                'range_end': ''
+            },
+            'target': {
+                'type': 'wecom',
+                'contact': ''
+            }
+        }
+        self.forwarding_rules = [default_rule]
+        self.rebuild_rule_index()
+    
+    def rebuild_rule_index(self):
+        """规则变化后重建规则索引（构建完成后整体替换引用，匹配线程无需加锁）"""
+        self.rule_index = RuleIndex(
+            self.forwarding_rules,
+            nickname_provider=self.get_wechat_nickname,
+            range_tracker=self.range_tracker
+        )
+        self.rules_version += 1
+        for rule_name, error in self.rule_index.errors:
+            self.log_message(f"⚠️ 规则 {rule_name} 的过滤条件无效，已跳过: {error}")
+    
+    def get_wechat_nickname(self):
+        """当前微信昵称（用于@本人过滤）"""
+        return getattr(self.wechat, 'nickname', None) if self.wechat else None
+    
+    def show_restart_warning(self):
+        """记录重启后的未处理消息
+        
+        Returns:
+            tuple: (待处理消息数, 失败消息数)
+        """
+        try:
+            pending_count = len(self.message_queue.pending_messages)
+            failed_count = sum(1 for msg in self.message_queue.replied_messages if msg['status'] == 'failed')
+            
+            if pending_count > 0 or failed_count > 0:
+                self.log_message(f"⚠️ 发现未处理消息: 待处理{pending_count}条, 失败{failed_count}条")
+            return pending_count, failed_count
+                
+        except Exception as e:
+            self.log_message(f"❌ 显示重启警告失败: {e}")
+            return 0, 0
+    
+    def refresh_wechat_nickname(self):
+        """刷新当前微信昵称
+        
+        Returns:
+            bool: 是否获取成功
+        """
+        try:
+            if not self.wechat:
+                self.wechat = WeChat()
+            
+            if hasattr(self.wechat, 'nickname') and self.wechat.nickname:
+                self.current_wechat_nickname = self.wechat.nickname
+                self.log_message(f"✅ 已获取当前微信昵称: {self.current_wechat_nickname}")
+                
+                # 自动保存昵称到配置文件
+                self.save_nickname_to_config()
+                return True
+                    
+            else:
+                self.log_message("❌ 无法获取微信昵称，请确保微信已打开并登录")
+                
+        except Exception as e:
+            self.log_message(f"❌ 获取微信昵称失败: {e}")
+        return False
+    
+    def save_nickname_to_config(self):
+        """单独保存昵称到配置文件"""
+        try:
+            self.config_store.update(wechat_nickname=self.current_wechat_nickname or "")
+        except Exception as e:
+            self.log_message(f"保存昵称到配置失败: {e}")
+    
+    def get_contacts(self, wechat_type):
+        """获取指定微信类型的联系人列表"""
+        try:
+            if wechat_type == "wechat":
+                # 普通微信：通过会话列表获取联系人
+                if not self.wechat:
+                    self.wechat = WeChat()
+                sessions = self.wechat.GetSession()
+                return [session.name for session in sessions]
+            else:  # wecom
+                # 企业微信：通过查找独立聊天窗口获取联系人
+                return self.get_wecom_chat_windows()
+        except Exception as e:
+            self.log_message(f"获取{wechat_type}联系人失败: {e}")
+            return []
+    
+    def get_wecom_chat_windows(self):
+        """获取企业微信独立聊天窗口列表"""
+        try:
+            import win32gui
+            import win32process
+            from wxauto.utils.win32 import GetAllWindows
+            
+            chat_windows = []
+            all_windows = GetAllWindows()
+            
+            for hwnd, class_name, window_title in all_windows:
+                # 检查是否是企业微信的独立聊天窗口
+                if self.is_wecom_chat_window(hwnd, class_name, window_title):
+                    chat_windows.append(window_title)
+            
+            self.log_message(f"找到 {len(chat_windows)} 个企业微信聊天窗口: {chat_windows}")
+            return chat_windows
+            
+        except Exception as e:
+            self.log_message(f"获取企业微信聊天窗口失败: {e}")
+            return []
+    
+    def is_wecom_chat_window(self, hwnd, class_name, window_title):
+        """判断是否是企业微信聊天窗口"""
+        try:
+            # 检查类名是否匹配企业微信聊天窗口
+            wecom_chat_classes = [
+                'WwStandaloneConversationWnd',  # 企业微信独立对话窗口
+                'ChatWnd',                      # 通用聊天窗口
+                'WeComChatWnd',                 # 企业微信聊天窗口
+                'WorkWeChatChatWnd'             # 工作微信聊天窗口
+            ]
+            
+            if class_name in wecom_chat_classes:
+                # 进一步验证：检查窗口标题不为空且不是主窗口标题
+                if window_title and window_title not in ['', '企业微信', 'WeCom', 'WeChat Work']:
+                    # 验证是否属于企业微信进程
+                    try:
+                        import win32process
+                        import win32api
+                        thread_id, process_id = win32process.GetWindowThreadProcessId(hwnd)
+                        process_handle = win32api.OpenProcess(win32process.PROCESS_QUERY_INFORMATION, False, process_id)
+                        try:
+                            process_name = win32process.GetModuleFileNameEx(process_handle, 0)
+                            if 'WXWork.exe' in process_name or 'WeWork' in process_name:
+                                return True
+                        finally:
+                            win32api.CloseHandle(process_handle)
+                    except:
+                        # 如果无法验证进程，但类名匹配，也认为是有效的
+                        return True
+            
+            return False
+            
+        except Exception as e:
+            self.log_message(f"验证企业微信窗口失败: {e}")
+            return False
+    
+    def start_forwarding(self):
+        """开始转发
+        
+        Returns:
+            bool: 规则配置有效并已启动返回True
+        """
+        if not self.validate_config():
+            return False
+            
+        self.is_forwarding = True
+        
+        # 启动转发线程
+        self.forward_thread = threading.Thread(target=self.forwarding_loop, daemon=True)
+        self.forward_thread.start()
+        
+        # 启动消息处理器线程
+        self.start_message_processor()
+        
+        self.log_message("开始消息转发")
+        return True
+    
+    def stop_forwarding(self):
+        """停止转发"""
+        self.is_forwarding = False
+        self.log_message("停止消息转发")
+    
+    def start_message_processor(self):
+        """启动消息处理器线程"""
+        def process_loop():
+            self.log_message("🚀 消息处理器已启动")
+            while self.is_forwarding:
+                try:
+                    if not self.message_queue.is_processing and len(self.message_queue.pending_messages) > 0:
+                        next_message = self.message_queue.get_next_message()
+                        if next_message:
+                            self.tracer.mark_dequeued(next_message)
+                            with self.tracer.activate(next_message):
+                                self.process_single_message(next_message)
+                    time.sleep(2)  # 每2秒检查一次队列
+                except Exception as e:
+                    self.log_message(f"❌ 消息处理循环错误: {e}")
+                    time.sleep(5)  # 出错后等待5秒重试
+            self.log_message("🛑 消息处理器已停止")
+        
+        self.message_processor_thread = threading.Thread(target=process_loop, daemon=True)
+        self.message_processor_thread.start()
+        
+        def cached_reply_loop():
+            # 命中回复缓存的消息不排在待处理消息后面，入队后立即转发
+            while self.is_forwarding:
+                if not self.message_queue.cached_ready.wait(1):
+                    continue
+                message_item = self.message_queue.next_cached_message()
+                if message_item:
+                    self.tracer.mark_dequeued(message_item)
+                    with self.tracer.activate(message_item):
+                        self.process_cached_message(message_item)
+        
+        self.cached_reply_thread = threading.Thread(target=cached_reply_loop, name='cached-reply', daemon=True)
+        self.cached_reply_thread.start()
+    
+    def process_single_message(self, message_item):
+        """处理单条消息的完整流程（支持多规则）"""
+        try:
+            self.message_queue.start_processing(message_item)
+            
+            # 从消息项中获取匹配的规则
+            rule = message_item.get('matched_rule')
+            if not rule:
+                raise Exception("消息项中未找到匹配的规则")
+            self.observe_stage('queue_wait', message_item.get('timestamp'), message_item, end=message_item['process_start_time'])
+            
+            rule_id = rule.get('id')
+            message_id = message_item.get('id')
+            
+            self.log_message(f"🔄 开始处理消息: {message_item['content'][:30]}...", rule_id, message_id, 'start')
+            
+            target_type = rule['target']['type']
+            target_contact = rule['target']['contact']
+            
+            self.log_message(f"🎯 使用规则: {rule['name']} -> {target_type}:{target_contact}", rule_id)
+            
+            # 0. 排队期间可能已缓存了相同问题的回复（入队时已查过一次），命中则直接回复源聊天
+            if target_type == "wecom" and not message_item.get('skip_reply_cache'):
+                with self.tracer.span('reply_cache_lookup'):
+                    cached = self.reply_cache.get(target_contact, message_item['content'],
+                                                  count_lookup=not message_item.get('reply_cache_checked'))
+                if cached:
+                    if self.reply_from_cache(message_item, cached):
+                        self.message_queue.mark_message_completed(message_item, cached['reply'], success=True)
+                        self.observe_stage('total', message_item.get('timestamp'), message_item)
+                        return
+                    self.log_message("⚠️ 缓存回复转发失败，改为发送给AI助手", rule_id)
+            
+            # 1. 发送消息到目标
+            sent_at = time.time()
+            with self.ui_lock:
+                success = self.send_message_to_target(message_item, target_type, target_contact)
+            if not success:
+                self.record_stage_failure('send', message_item)
+                raise Exception("发送到目标失败")
+            self.observe_stage('send', sent_at, message_item)
+            
+            # 2. 如果目标是企业微信，等待AI回复
+            if target_type == "wecom":
+                ai_reply = self.wait_for_ai_reply_with_timeout(timeout=300, rule_id=rule_id, target_contact=target_contact)  # 5分钟超时
+                if not ai_reply:
+                    self.record_stage_failure('reply_wait', message_item)
+                    raise Exception("AI回复超时")
+                self.log_message(f"🤖 收到AI回复，耗时{time.time() - sent_at:.1f}秒", rule_id, message_id, 'reply')
+                
+                # 3. 转发回复到源发送者
+                forward_start = time.time()
+                success = self.forward_ai_reply_to_source(ai_reply, message_item)
+                if not success:
+                    self.record_stage_failure('forward', message_item)
+                    raise Exception("转发回复失败")
+                self.observe_stage('forward', forward_start, message_item)
+                self.fan_out_ai_reply(ai_reply, message_item)
+                
+                # 4. 记录AI回复，避免循环转发；缓存回复，相同问题下次直接回答
+                self.record_ai_reply(ai_reply)
+                self.reply_cache.put(target_contact, message_item['content'], ai_reply, latency=time.time() - sent_at)
+                
+                # 5. 检查是否需要复制回复（是否有复制坐标配置）
+                needs_copy = self.check_if_needs_copy(target_contact)
+                if needs_copy:
+                    # 如果需要复制，不要在这里标记完成，等待复制完成后再标记
+                    self.log_message("⏳ 等待AI回复复制过程完成...", rule_id)
+                    return  # 不标记完成，让复制过程来标记
+                else:
+                    ai_reply = ai_reply
+            else:
+                ai_reply = "消息已转发"
+            
+            # 5. 标记完成（只有不需要复制的情况才会到这里）
+            self.message_queue.mark_message_completed(message_item, ai_reply, success=True)
+            self.observe_stage('total', message_item.get('timestamp'), message_item)
+            
+        except Exception as e:
+            # 处理失败
+            error_msg = str(e)
+            # 尝试获取规则ID用于日志
+            rule_id = None
+            if 'matched_rule' in message_item:
+                rule_id = message_item['matched_rule'].get('id')
+            
+            self.log_message(f"❌ 消息处理失败: {error_msg}", rule_id, message_item.get('id'), 'failed')
+            self.message_queue.mark_message_completed(message_item, error_msg, success=False)
+    
+    def reply_from_cache(self, message_item, cached):
+        """把缓存的AI回复转发回源聊天（不经过目标），返回是否转发成功"""
+        rule_id = message_item['matched_rule'].get('id')
+        self.metrics.inc('reply_cache_hits_total', help='回复缓存命中次数', rule=rule_id)
+        forward_start = time.time()
+        if not self.forward_ai_reply_to_source(cached['reply'], message_item):
+            return False
+        self.observe_stage('forward', forward_start, message_item)
+        self.fan_out_ai_reply(cached['reply'], message_item)
+        stats = self.reply_cache.get_stats()
+        self.log_message(
+            f"💾 命中回复缓存，节省约{cached['latency']:.0f}秒"
+            f"（命中率{stats['hit_rate']:.0%}，累计节省{stats['saved_seconds']:.0f}秒）",
+            rule_id, message_item.get('id'), 'cache_hit')
+        self.record_ai_reply(cached['reply'])
+        return True
+    
+    def process_cached_message(self, message_item):
+        """处理入队时命中回复缓存的消息：直接转发缓存的回复，不占用消息处理器"""
+        cached = message_item.pop('cached_reply')
+        self.observe_stage('queue_wait', message_item.get('timestamp'), message_item)
+        try:
+            success = self.reply_from_cache(message_item, cached)
+        except Exception as e:
+            self.log_message(f"❌ 转发缓存回复出错: {e}", message_item['matched_rule'].get('id'))
+            success = False
+        if not success:
+            self.log_message("⚠️ 缓存回复转发失败，改为发送给AI助手", message_item['matched_rule'].get('id'))
+            self.message_queue.requeue(message_item)
+            return
+        self.message_queue.record_result(message_item, cached['reply'], success=True)
+        self.message_queue.save_to_file()
+        self.observe_stage('total', message_item.get('timestamp'), message_item)
+    
+    def observe_stage(self, stage, start, message_item, end=None):
+        """记录消息某个处理阶段的耗时（按规则和目标统计）"""
+        if not start:
+            return
+        rule = message_item.get('matched_rule') or {}
+        self.metrics.observe(stage, (end or time.time()) - start,
+                             rule=rule.get('id', ''), target=rule.get('target', {}).get('contact', ''))
+    
+    def record_stage_failure(self, stage, message_item):
+        """记录消息在某个处理阶段失败"""
+        rule = message_item.get('matched_rule') or {}
+        self.metrics.inc('stage_failures_total', help='各处理阶段的失败次数',
+                         stage=stage, rule=rule.get('id', ''), target=rule.get('target', {}).get('contact', ''))
+    
+    def register_metric_gauges(self):
+        """登记输出指标时读取的实时值"""
+        def queue_status():
+            status = self.message_queue.get_queue_status()
+            return {(('state', 'pending'),): status['pending_count'],
+                    (('state', 'processing'),): int(status['processing']),
+                    (('state', 'finished'),): status['replied_count']}
+        
+        self.metrics.register_gauge('queue_messages', '队列中的消息数（按状态）', queue_status)
+        self.metrics.register_gauge('reply_cache_entries', '回复缓存条目数',
+                                    lambda: self.reply_cache.get_stats()['entries'])
+        self.metrics.register_gauge('reply_cache_hit_ratio', '回复缓存命中率',
+                                    lambda: self.reply_cache.get_stats()['hit_rate'])
+        self.metrics.register_gauge('log_dropped_lines', '日志文件写入过慢丢弃的行数（尚未写入提示）',
+                                    lambda: self.file_log.dropped)
+    
+    def start_profiling(self, seconds=None, mode=None, memory=None):
+        """开始一次限时性能分析（未指定的参数取配置 profiling 中的值）"""
+        config = self.profiling_config
+        return self.profiler.start(
+            seconds=float(seconds if seconds is not None else config.get('seconds', 30)),
+            mode=mode or config.get('mode', 'sample'),
+            interval=config.get('interval_ms', 5) / 1000,
+            memory=memory if memory is not None else config.get('memory', False)
+        )
+    
+    def handle_profile_status(self, query, body):
+        """本地接口 GET /profile：分析状态和最近一次的结果文件"""
+        status = 'running' if self.profiler.running else 'idle'
+        return 200, f"{status}\n" + ''.join(f"{path}\n" for path in self.profiler.last_files)
+    
+    def handle_profile_request(self, query, body):
+        """本地接口 POST /profile 开始分析，请求体为 JSON：{"seconds": 30, "mode": "sample", "memory": true}，
+        {"action": "stop"} 提前结束；未指定的参数取配置 profiling 中的值
+        """
+        if body is None:
+            body = {}
+        if not isinstance(body, dict):
+            return 400, "请求体需要是 JSON 对象\n"
+        if body.get('action') == 'stop':
+            self.profiler.stop()
+            return 200, "stopping\n"
+        memory = body.get('memory')
+        try:
+            started = self.start_profiling(
+                seconds=body.get('seconds'),
+                mode=body.get('mode'),
+                memory=bool(memory) if memory is not None else None
+            )
+        except (TypeError, ValueError) as e:
+            return 400, f"参数无效: {e}\n"
+        if not started:
+            return 409, "already running\n"
+        return 202, "started\n"
+    
+    def get_profiling_counts(self):
+        """内存分析时对比的计数"""
+        queue = self.message_queue
+        counts = {
+            'reply_cache_entries': self.reply_cache.get_stats()['entries'],
+        }
+        if queue is not None:
+            with queue.lock:
+                counts['pending_messages'] = len(queue.pending_messages)
+                counts['replied_messages'] = len(queue.replied_messages)
+                counts['rule_history_messages'] = sum(len(messages) for messages in queue.rule_replied_messages.values())
+        return counts
+    
+    def fan_out_ai_reply(self, ai_reply, message_item):
+        """把AI回复分发给合并到该消息上的其他提问者，各自回复到所在聊天并引用发送者"""
+        waiters = self.message_queue.take_waiters(message_item)
+        if not waiters:
+            return
+        
+        self.log_message(f"📢 分发AI回复给合并的 {len(waiters)} 位提问者", message_item['matched_rule'].get('id'))
+        for waiter in waiters:
+            success = self.forward_ai_reply_to_source(ai_reply, waiter)
+            self.message_queue.record_result(waiter, ai_reply if success else "转发合并提问的回复失败", success)
+        self.message_queue.save_to_file()
+    
+    def check_if_needs_copy(self, target_contact):
+        """检查是否需要复制回复（是否配置了复制坐标）"""
+        try:
+            return self.config_store.snapshot().copy_coordinates(target_contact) is not None
+            
+        except Exception as e:
+            self.log_message(f"⚠️ 检查复制配置失败: {e}")
+            return False
+    
+    def send_message_to_target(self, message_item, target_type, target_contact):
+        """发送消息到目标"""
+        try:
+            # 构建转发消息内容
+            sender = message_item['sender']
+            content = message_item['content']
+            chat_name = message_item['chat_name']
+            rule_id = message_item.get('matched_rule', {}).get('id')
+            
+            self.log_message(f"📤 准备发送消息:", rule_id)
+            self.log_message(f"   源聊天: {chat_name}", rule_id)
+            self.log_message(f"   发送者: {sender}", rule_id)
+            self.log_message(f"   目标类型: {target_type}", rule_id)
+            self.log_message(f"   目标联系人: {target_contact}", rule_id)
+            
+            # 构建转发消息
+            forward_content = f"[来自 {chat_name}] {sender}: {content}"
+            
+            if target_type == "wecom":
+                # 发送到企业微信窗口
+                self.log_message(f"🎯 尝试发送到企业微信: {target_contact}", rule_id)
+                success = self.send_to_wecom_window(forward_content, target_contact)
+                if success:
+                    self.log_message(f"✅ 成功发送到企业微信: {target_contact}", rule_id, message_item.get('id'), 'sent')
+                else:
+                    self.log_message(f"❌ 发送到企业微信失败: {target_contact}", rule_id)
+                return success
+            else:
+                # 发送到普通微信
+                if self.wechat:
+                    try:
+                        target_chat = self.wechat.ChatWith(target_contact)
+                        target_chat.SendMsg(forward_content)
+                        self.log_message(f"✅ 消息已发送到普通微信: {target_contact}", rule_id, message_item.get('id'), 'sent')
+                        return True
+                    except Exception as e:
+                        self.log_message(f"❌ 发送到普通微信失败: {e}", rule_id)
+                        return False
+                else:
+                    self.log_message("❌ 普通微信实例未初始化", rule_id)
+                    return False
+                
+        except Exception as e:
+            rule_id = message_item.get('matched_rule', {}).get('id')
+            self.log_message(f"❌ 发送消息到目标失败: {e}", rule_id)
+            return False
+    
+    def wait_for_ai_reply_with_timeout(self, timeout=300, rule_id=None, target_contact=None):
+        """等待AI回复完成（带超时）"""
+        try:
+            self.log_message(f"⏳ 等待AI回复完成（超时: {timeout}秒）...", rule_id)
+            
+            # 查找企业微信窗口
+            if not target_contact:
+                # 如果没有提供目标联系人，尝试从规则ID获取
+                if rule_id:
+                    rule = next((r for r in self.forwarding_rules if r['id'] == rule_id), None)
+                    if rule:
+                        target_contact = rule['target']['contact']
+                
+                if not target_contact:
+                    self.log_message("❌ 无法确定目标联系人", rule_id)
+                    return None
+            
+            with self.tracer.span('find_window', window=target_contact):
+                hwnd = self.find_wecom_chat_window(target_contact)
+            
+            if not hwnd:
+                self.log_message(f"❌ 未找到企业微信聊天窗口: {target_contact}", rule_id)
+                return None
+            
+            # 启动同步AI回复检测
+            ai_reply = self.start_ai_reply_detection_sync(hwnd, timeout, rule_id)
+            
+            if ai_reply:
+                self.log_message(f"✅ AI回复检测完成: {ai_reply[:50]}...", rule_id)
+                return ai_reply
+            else:
+                self.log_message("⏰ AI回复检测超时", rule_id)
+                return None
+                
+        except Exception as e:
+            self.log_message(f"❌ AI回复检测错误: {e}", rule_id)
+            return None
+    
+    def start_ai_reply_detection_sync(self, hwnd, timeout=300, rule_id=None):
+        """同步版本的AI回复检测（通过回复完成检测引擎，按目标配置选择检测策略）"""
+        try:
+            self.log_message("🔍 开始同步检测AI回复...", rule_id)
+            
+            # 从规则中获取目标联系人
+            target_contact = None
+            if rule_id:
+                rule = next((r for r in self.forwarding_rules if r['id'] == rule_id), None)
+                if rule:
+                    target_contact = rule['target']['contact']
+            
+            frame_id = f"rule_{rule_id}"
+            if self.message_queue and self.message_queue.processing_message:
+                frame_id = self.message_queue.processing_message.get('id', frame_id)
+            
+            detect_start = time.time()
+            result = self.run_reply_detection(hwnd, target_contact, timeout, frame_id, rule_id)
+            self.metrics.inc('detection_runs_total', help='回复检测次数（按策略和结果）',
+                             strategy=result.strategy or '', result=result.reason)
+            self.metrics.inc('detection_polls_total', result.polls, help='回复检测轮询次数',
+                             strategy=result.strategy or '')
+            if not result:
+                return None
+            self.metrics.observe('reply_wait', time.time() - detect_start, rule=rule_id or '', target=target_contact or '')
+            
+            # UIA策略直接得到回复文本，截图策略完成后再提取
+            if result.text:
+                ai_reply = result.text
+            else:
+                copy_start = time.time()
+                ai_reply = self.extract_ai_reply(hwnd, rule_id, target_contact)
+                self.metrics.observe('reply_copy', time.time() - copy_start, rule=rule_id or '', target=target_contact or '')
+            
+            self.reply_detector.report_outcome(result.strategy, bool(ai_reply and ai_reply.strip()))
+            self.log_message(self.reply_detector.format_stats(result.strategy), rule_id)
+            return ai_reply
+                    
+        except Exception as e:
+            self.log_message(f"❌ 同步AI回复检测出错: {e}", rule_id)
+            return None
+    
+    def get_detection_strategies(self, target_contact):
+        """获取目标联系人的回复检测策略优先级列表"""
+        strategies = self.reply_detection_config.get('targets', {}).get(target_contact)
+        if not strategies:
+            strategies = self.reply_detection_config.get('default', ReplyCompletionDetector.DEFAULT_STRATEGIES)
+        if isinstance(strategies, str):
+            strategies = [strategies]
+        return list(strategies)
+    
+    def run_reply_detection(self, hwnd, target_contact, timeout, frame_id, rule_id=None):
+        """使用回复完成检测引擎等待回复完成，返回DetectionResult"""
+        # 读取配置的延迟时间
+        try:
+            delay_seconds = self.detection_delay
+        except:
+            delay_seconds = 2
+        
+        strategies = self.get_detection_strategies(target_contact)
+        with self.tracer.span('detect_reply', strategies=strategies):
+            result = self.reply_detector.detect(
+                hwnd,
+                strategies=strategies,
+                timeout=timeout,
+                initial_delay=delay_seconds,
+                should_continue=lambda: self.is_forwarding,
+                on_frame=lambda image: self.frame_recorder.record(frame_id, image),
+                log=lambda message: self.log_message(message, rule_id)
+            )
+        
+        if result.completed and self.frame_recorder.enabled and result.strategy != 'uia':
+            # 记录判定完成时间，截图序列可用于离线回放基准测试
+            self.frame_recorder.mark_completed(frame_id, result.strategy)
+            # 截图到判定完成为止，再独立采样一段时间的回复文本，离线回放时才能发现提前判定
+            self.frame_recorder.record_truth_tail(frame_id, self.last_reply_sampler(hwnd))
+            self.log_message(f"📸 调试截图目录: {self.frame_recorder.frame_dir(frame_id)}", rule_id)
+        return result
+    
+    @staticmethod
+    def last_reply_sampler(hwnd):
+        """读取窗口最后一条对方消息文本的采样函数（UIA读取，不截图、不激活窗口）"""
+        probe = UIAMessageListProbe(hwnd)
+        
+        def sample():
+            if probe.msgbox is None and not probe.attach(0.2):
+                return None
+            return probe.last_incoming_text()
+        
+        return sample
+    
+    def extract_ai_reply(self, hwnd, rule_id=None, target_contact=None):
+        """提取AI回复文本：优先从UIA消息列表直接读取，失败时按复制坐标复制"""
+        with self.tracer.span('uia_extract'):
+            ai_reply, elapsed_ms = extract_last_reply(hwnd)
+        if ai_reply and ai_reply.strip():
+            self.log_message(f"✅ UIA提取AI回复成功（耗时{elapsed_ms:.0f}毫秒）: {ai_reply[:50]}...", rule_id)
+            return ai_reply.strip()
+        
+        self.log_message(f"⚠️ UIA提取AI回复失败（耗时{elapsed_ms:.0f}毫秒），回退到坐标复制", rule_id)
+        start_time = time.perf_counter()
+        with self.ui_lock, self.tracer.span('copy'):
+            ai_reply = self.copy_ai_reply_sync(hwnd, rule_id, target_contact)
+        self.log_message(f"⏱ 坐标复制耗时{(time.perf_counter() - start_time) * 1000:.0f}毫秒", rule_id)
+        return ai_reply
+    
+    def copy_ai_reply_sync(self, hwnd, rule_id=None, target_contact=None):
+        """同步复制AI回复消息（通过复制坐标右键复制，UIA提取失败时的备用方式）"""
+        try:
+            self.log_message("📋 开始复制AI回复消息...", rule_id)
+            
+            # 获取目标联系人名称
+            if not target_contact:
+                # 如果没有提供目标联系人，尝试从规则ID获取
+                if rule_id:
+                    rule = next((r for r in self.forwarding_rules if r['id'] == rule_id), None)
+                    if rule:
+                        target_contact = rule['target']['contact']
+                
+                if not target_contact:
+                    self.log_message("❌ 无法确定目标联系人", rule_id)
+                    return None
+            
+            # 从配置快照加载复制坐标
+            try:
+                copy_coords = self.config_store.snapshot().copy_coordinates(target_contact)
+                if not copy_coords:
+                    self.log_message(f"❌ 未找到 {target_contact} 的复制坐标配置", rule_id)
+                    return None
+                
+                right_click_offset = copy_coords['right_click']
+                copy_click_offset = copy_coords['copy_click']
+                
+            except Exception as e:
+                self.log_message(f"❌ 加载复制坐标配置失败: {e}", rule_id)
+                return None
+            
+            # 激活企业微信窗口
+            win32gui.SetForegroundWindow(hwnd)
+            time.sleep(0.3)
+            
+            # 获取窗口位置，计算基准点（左下角）
+            window_rect = win32gui.GetWindowRect(hwnd)
+            base_x = window_rect[0]  # 窗口左边界
+            base_y = window_rect[3]  # 窗口下边界（左下角）
+            
+            # 计算右键点击的绝对坐标
+            right_click_x = base_x + right_click_offset[0]
+            right_click_y = base_y - right_click_offset[1]  # Y轴反向
+            
+            # 移动鼠标并右键点击
+            win32api.SetCursorPos((right_click_x, right_click_y))
+            time.sleep(0.3)
+            
+            # 右键点击
+            win32api.mouse_event(win32con.MOUSEEVENTF_RIGHTDOWN, 0, 0, 0, 0)
+            win32api.mouse_event(win32con.MOUSEEVENTF_RIGHTUP, 0, 0, 0, 0)
+            time.sleep(0.5)  # 等待右键菜单出现
+            
+            # 计算复制按钮的绝对坐标
+            copy_x = base_x + copy_click_offset[0]
+            copy_y = base_y - copy_click_offset[1]  # Y轴反向
+            
+            # 移动鼠标并点击复制
+            win32api.SetCursorPos((copy_x, copy_y))
+            time.sleep(0.2)
+            
+            # 左键点击复制按钮
+            win32api.mouse_event(win32con.MOUSEEVENTF_LEFTDOWN, 0, 0, 0, 0)
+            win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, 0, 0, 0, 0)
+            time.sleep(0.5)  # 等待复制完成
+            
+            # 获取剪贴板内容
+            try:
+                import win32clipboard
+                win32clipboard.OpenClipboard()
+                ai_reply = win32clipboard.GetClipboardData()
+                win32clipboard.CloseClipboard()
+                
+                if ai_reply and ai_reply.strip():
+                    self.log_message(f"✅ 成功复制AI回复: {ai_reply[:50]}...", rule_id)
+                    return ai_reply.strip()
+                else:
+                    self.log_message("❌ 剪贴板内容为空", rule_id)
+                    return None
+                    
+            except Exception as e:
+                self.log_message(f"❌ 获取剪贴板内容失败: {e}", rule_id)
+                return None
+                
+        except Exception as e:
+            self.log_message(f"❌ 同步复制回复失败: {e}", rule_id)
+            return None
+    
+    def find_wecom_chat_window(self, target_contact):
+        """查找指定联系人的企业微信聊天窗口句柄"""
+        try:
+            from wxauto.utils.win32 import FindWindow, GetAllWindows
+            
+            self.log_message(f"🔍 查找企业微信聊天窗口: {target_contact}")
+            
+            # 首先尝试直接通过窗口标题查找
+            hwnd = FindWindow(name=target_contact)
+            if hwnd:
+                class_name = win32gui.GetClassName(hwnd)
+                self.log_message(f"📋 找到窗口: {target_contact}, 类名: {class_name}, 句柄: {hwnd}")
+                if self.is_wecom_chat_window(hwnd, class_name, target_contact):
+                    self.log_message(f"✅ 直接找到企业微信窗口: {target_contact}, 句柄: {hwnd}")
+                    return hwnd
+                else:
+                    self.log_message(f"⚠️ 窗口不是企业微信聊天窗口: {class_name}")
+            else:
+                self.log_message(f"⚠️ 直接查找窗口失败: {target_contact}")
+            
+            # 如果直接查找失败，遍历所有企业微信窗口
+            self.log_message("🔍 开始遍历所有窗口查找企业微信聊天窗口...")
+            all_windows = GetAllWindows()
+            wecom_windows = []
+            
+            for hwnd, class_name, window_title in all_windows:
+                if self.is_wecom_chat_window(hwnd, class_name, window_title):
+                    wecom_windows.append((hwnd, class_name, window_title))
+                    self.log_message(f"📋 发现企业微信窗口: {window_title} (类名: {class_name})")
+                    
+                    # 检查窗口标题是否包含目标联系人名称
+                    if target_contact in window_title or window_title == target_contact:
+                        self.log_message(f"✅ 遍历找到匹配窗口: {window_title}, 句柄: {hwnd}")
+                        return hwnd
+            
+            if wecom_windows:
+                self.log_message(f"📊 找到 {len(wecom_windows)} 个企业微信聊天窗口，但没有匹配的:")
+                for hwnd, class_name, window_title in wecom_windows:
+                    self.log_message(f"   - {window_title} (类名: {class_name})")
+            else:
+                self.log_message("❌ 没有找到任何企业微信聊天窗口")
+            
+            self.log_message(f"❌ 未找到企业微信聊天窗口: {target_contact}")
+            return None
+            
+        except Exception as e:
+            self.log_message(f"❌ 查找企业微信聊天窗口失败: {e}")
+            import traceback
+            self.log_message(f"详细错误: {traceback.format_exc()}")
+            return None
+    
+    def forward_ai_reply_to_source(self, ai_reply, message_item):
+        """将AI回复转发到源发送者"""
+        try:
+            # 从消息项中获取规则和源信息
+            rule = message_item.get('matched_rule', {})
+            rule_id = rule.get('id')
+            source_type = message_item.get('source_type', 'wechat')
+            chat_name = message_item['chat_name']
+            sender = message_item['sender']
+            
+            self.log_message(f"📨 准备转发AI回复到源:", rule_id)
+            self.log_message(f"   目标聊天: {chat_name}", rule_id)
+            self.log_message(f"   原发送者: {sender}", rule_id)
+            self.log_message(f"   源类型: {source_type}", rule_id)
+            
+            if source_type == "wechat" and self.wechat:
+                # 转发到普通微信 - 直接查找独立聊天窗口
+                try:
+                    self.log_message(f"🔍 查找微信独立聊天窗口: {chat_name}")
+                    
+                    # 使用UIAutomation直接查找独立的聊天窗口
+                    with self.ui_lock:
+                        success = self.send_to_wechat_window(chat_name, ai_reply, sender)
+                    if success:
+                        self.log_message(f"✅ AI回复已成功转发到普通微信: {chat_name}", rule_id, message_item.get('id'), 'forward')
+                        return True
+                    else:
+                        self.log_message(f"❌ 无法找到或发送到微信聊天窗口: {chat_name}")
+                        return False
+                    
+                except Exception as e:
+                    self.log_message(f"❌ 转发AI回复到普通微信失败: {e}")
+                    self.log_message(f"详细错误信息: {type(e).__name__}: {str(e)}")
+                    import traceback
+                    self.log_message(f"错误堆栈: {traceback.format_exc()}")
+                    return False
+            else:
+                # 如果源是企业微信，暂不支持反向转发
+                self.log_message("⚠️ 暂不支持转发到企业微信源")
+                return True  # 标记为成功，避免重试
+            
+        except Exception as e:
+            self.log_message(f"❌ 转发AI回复失败: {e}")
+            return False
+    
+    def validate_config(self):
+        """验证多规则配置"""
+        try:
+            # 检查是否有规则
+            if not self.forwarding_rules:
+                self.notify_error("错误", "没有转发规则，请先添加规则")
+                return False
+            
+            # 检查是否有启用的规则
+            enabled_rules = [rule for rule in self.forwarding_rules if rule.get('enabled', True)]
+            if not enabled_rules:
+                self.notify_error("错误", "没有启用的转发规则，请先启用至少一个规则")
+                return False
+            
+            # 逐个验证启用的规则
+            invalid_rules = []
+            for i, rule in enumerate(enabled_rules, 1):
+                rule_name = rule.get('name', f'规则{i}')
+                
+                # 检查源联系人
+                if not rule['source'].get('contact'):
+                    invalid_rules.append(f"{rule_name}: 未设置源联系人")
+                    continue
+                
+                # 检查目标联系人
+                if not rule['target'].get('contact'):
+                    invalid_rules.append(f"{rule_name}: 未设置目标联系人")
+                    continue
+                
+                # 检查过滤条件
+                filter_type = rule['source'].get('filter_type', 'all')
+                if filter_type == 'range':
+                    if not rule['source'].get('range_start') or not rule['source'].get('range_end'):
+                        invalid_rules.append(f"{rule_name}: 范围过滤未设置开始和结束标记")
+            
+            # 如果有无效规则，显示错误
+            if invalid_rules:
+                error_msg = "以下规则配置不完整：\n\n" + "\n".join(invalid_rules[:5])
+                if len(invalid_rules) > 5:
+                    error_msg += f"\n\n...还有{len(invalid_rules)-5}个规则有问题"
+                error_msg += "\n\n请先完善规则配置后再开始转发。"
+                self.notify_error("配置错误", error_msg)
+                return False
+            
+            return True
+            
+        except Exception as e:
+            self.notify_error("验证错误", f"配置验证失败: {e}")
+            return False
+    
+    def forwarding_loop(self):
+        """多规则转发循环（规则变化时只增删来源发生变化的监听）"""
+        try:
+            # 获取所有启用的规则
+            enabled_rules = [rule for rule in self.forwarding_rules if rule['enabled']]
+            if not enabled_rules:
+                self.log_message("⚠️ 没有启用的转发规则")
+                return
+            
+            # 创建消息回调函数
+            def create_message_callback(source_type):
+                def message_callback(msg, chat):
+                    # 过滤系统消息和自己的消息
+                    if self.is_system_message(msg) or self.is_self_message(msg):
+                        return
+                    
+                    # 将消息加入队列（会按当前规则索引自动匹配规则）
+                    sender = getattr(msg, 'sender', '未知发送者')
+                    self.message_queue.add_message(msg, sender, chat, source_type)
+                
+                return message_callback
+            
+            # 监听列表以独立窗口的名称为键，可能与规则中的联系人不同
+            listen_names = {}       # {(来源类型, 联系人): 窗口名称}
+            
+            def add_listener(source_type, contact):
+                if source_type == 'wecom':
+                    if not self.wecom:
+                        self.wecom = WeCom()
+                    client, label = self.wecom, '企业微信'
+                else:
+                    if not self.wechat:
+                        self.wechat = WeChat()
+                    client, label = self.wechat, '微信'
+                result = client.AddListenChat(nickname=contact, callback=create_message_callback(source_type))
+                # 失败时返回 WxResponse.failure（布尔值为假），不抛出异常
+                if not result:
+                    raise RuntimeError(result['message'])
+                listen_names[(source_type, contact)] = getattr(result, 'who', contact)
+                self.log_message(f"✅ 开始监听{label}: {contact}")
+            
+            def remove_listener(source_type, contact):
+                client = self.wecom if source_type == 'wecom' else self.wechat
+                if client:
+                    name = listen_names.get((source_type, contact), contact)
+                    result = client.RemoveListenChat(nickname=name)
+                    # 窗口被关闭时 wxauto 已自行移除监听，视为成功
+                    if not result and result['message'] != '未找到监听对象':
+                        raise RuntimeError(result['message'])
+                    listen_names.pop((source_type, contact), None)
+                    self.log_message(f"停止监听{'企业微信' if source_type == 'wecom' else '微信'}: {contact}")
+            
+            reconciler = ListenerReconciler(add_listener, remove_listener, log=self.log_message)
+            applied_version = None
+            retry_at = None         # 有监听添加或移除失败时，下次重试的时间
+            
+            # 保持监听状态，规则索引版本变化时对账
+            while self.is_forwarding:
+                rules_version = self.rules_version
+                if rules_version != applied_version or (retry_at and time.time() >= retry_at):
+                    rules = list(self.forwarding_rules)
+                    
+                    # 为目标是微信的规则初始化微信实例
+                    if not self.wechat and any(
+                        rule['enabled'] and rule['target']['type'] == 'wechat' for rule in rules
+                    ):
+                        self.wechat = WeChat()
+                    
+                    added, removed = reconciler.reconcile(rules)
+                    applied_version = rules_version
+                    # 添加或移除失败的监听30秒后重试
+                    retry_at = time.time() + 30 if reconciler.active != desired_listeners(rules) else None
+                    
+                    enabled_count = len([rule for rule in rules if rule['enabled']])
+                    wechat_count = len([key for key in reconciler.active if key[0] == 'wechat'])
+                    wecom_count = len(reconciler.active) - wechat_count
+                    if added or removed:
+                        self.log_message(f"🚀 多规则转发监听已更新：{enabled_count}条规则，监听 {wechat_count} 个微信联系人和 {wecom_count} 个企业微信联系人（新增{len(added)}，移除{len(removed)}）")
+                
+                time.sleep(1)
+            
+            # 停止所有监听
+            reconciler.clear()
+            
+        except Exception as e:
+            self.log_message(f"转发循环错误: {e}")
+            self.call_later(0, self.stop_forwarding)
+    
+    def is_self_message(self, msg):
+        """检查是否是自己发送的消息（改进版 - 支持群聊区分）"""
+        return self.message_classifier.is_self_message(msg)
+    
+    def is_mentioned_me(self, msg):
+        """检查消息是否@了指定的人（基于输入框中的昵称匹配）"""
+        try:
+            # 优先使用设置的@检测昵称
+            target_nickname = self.mention_name.strip()
+            
+            # 如果未设置，尝试使用当前微信昵称
+            if not target_nickname:
+                if self.current_wechat_nickname:
+                    target_nickname = self.current_wechat_nickname
+                elif self.wechat and hasattr(self.wechat, 'nickname'):
+                    target_nickname = self.wechat.nickname
+                else:
+                    self.log_message("⚠️ 未设置@检测目标昵称")
+                    return False
+            
+            content = msg.content
+            
+            self.log_message(f"🔍 检查@消息: 目标昵称='{target_nickname}', 消息内容='{content}'")
+            
+            # 主要检查方法：消息中是否包含 @目标昵称
+            if f"@{target_nickname}" in content:
+                self.log_message(f"✅ 检测到@消息: @{target_nickname}")
+                return True
+            
+            # 备用检查：全角@符号
+            if f"＠{target_nickname}" in content:
+                self.log_message(f"✅ 检测到@消息(全角): ＠{target_nickname}")
+                return True
+            
+            # 如果没有检测到@消息，记录日志用于调试
+            self.log_message(f"❌ 未检测到@消息")
+            return False
+                
+        except Exception as e:
+            self.log_message(f"检查@消息失败: {e}")
+        
+        return False
+    
+    def find_matching_rules(self, msg, chat_name, source_type):
+        """查找匹配的转发规则"""
+        return self.message_classifier.find_matching_rules(msg, chat_name, source_type)
+    
+    def message_matches_filter(self, msg, source_config):
+        """检查消息是否符合过滤条件"""
+        return self.message_classifier.message_matches_filter(msg, source_config)
+    
+    def is_system_message(self, msg):
+        """判断是否是系统消息"""
+        return self.message_classifier.is_system_message(msg)
+    
+    def send_to_wecom_window(self, message, window_title):
+        """通过坐标点击向企业微信聊天窗口发送消息"""
+        try:
+            import win32gui
+            import win32con
+            import win32api
+            import win32clipboard
+            import time
+            
+            # 使用改进的窗口查找逻辑
+            with self.tracer.span('find_window', window=window_title):
+                hwnd = self.find_wecom_chat_window(window_title)
+            if not hwnd:
+                self.log_message(f"❌ 未找到企业微信窗口: {window_title}")
+                return False
+            
+            self.log_message(f"找到企业微信窗口: {window_title} (句柄: {hwnd})")
+            
+            # 激活窗口
+            with self.tracer.span('activate', window=window_title):
+                win32gui.ShowWindow(hwnd, win32con.SW_RESTORE)
+                win32gui.SetForegroundWindow(hwnd)
+                win32gui.BringWindowToTop(hwnd)
+                time.sleep(0.3)
+            self.log_message(f"已激活窗口: {window_title}")
+            
+            # 获取窗口位置和大小
+            rect = win32gui.GetWindowRect(hwnd)
+            width = rect[2] - rect[0]
+            height = rect[3] - rect[1]
+            
+            # 🎯 计算输入区域坐标 - 基于窗口左下角的相对位置
+            # 坐标说明:
+            # - rect[0] = 窗口左边界的屏幕坐标
+            # - rect[3] = 窗口下边界的屏幕坐标  
+            # - 窗口左下角 = (rect[0], rect[3])
+            # - 从左下角向右50像素，向上50像素就是输入区域
+            
+            offset_right = 50    # 从左下角向右的偏移量（像素）
+            offset_up = 100       # 从左下角向上的偏移量（像素）
+            
+            input_x = rect[0] + offset_right        # 窗口左边界 + 向右偏移
+            input_y = rect[3] - offset_up           # 窗口下边界 - 向上偏移
+            
+            self.log_message(f"输入区域坐标: ({input_x}, {input_y})")
+            self.log_message(f"窗口信息: 位置{rect}, 大小{width}x{height}")
+            
+            with self.tracer.span('paste', window=window_title):
+                # 将消息放入剪贴板（使用Unicode支持）
+                try:
+                    import win32con
+                    win32clipboard.OpenClipboard()
+                    win32clipboard.EmptyClipboard()
+                    # 使用Unicode格式设置剪贴板
+                    win32clipboard.SetClipboardData(win32con.CF_UNICODETEXT, message)
+                    win32clipboard.CloseClipboard()
+                    self.log_message("消息已放入剪贴板（Unicode格式）")
+                except Exception as clipboard_error:
+                    self.log_message(f"❌ 设置剪贴板失败: {clipboard_error}")
+                    # 备用方法
+                    try:
+                        self.set_clipboard_fallback(message)
+                        self.log_message("使用备用方法设置剪贴板成功")
+                    except Exception as backup_error:
+                        self.log_message(f"❌ 备用剪贴板方法也失败: {backup_error}")
+                        raise clipboard_error
+                
+                # 点击输入区域
+                win32api.SetCursorPos((input_x, input_y))
+                win32api.mouse_event(win32con.MOUSEEVENTF_LEFTDOWN, 0, 0, 0, 0)
+                win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, 0, 0, 0, 0)
+                time.sleep(0.2)
+                self.log_message(f"已点击输入区域: ({input_x}, {input_y})")
+                
+                # Ctrl+V 粘贴
+                win32api.keybd_event(win32con.VK_CONTROL, 0, 0, 0)
+                win32api.keybd_event(ord('V'), 0, 0, 0)
+                win32api.keybd_event(ord('V'), 0, win32con.KEYEVENTF_KEYUP, 0)
+                win32api.keybd_event(win32con.VK_CONTROL, 0, win32con.KEYEVENTF_KEYUP, 0)
+                time.sleep(0.3)
+                self.log_message("已执行粘贴操作 (Ctrl+V)")
+                
+                # 回车发送
+                win32api.keybd_event(win32con.VK_RETURN, 0, 0, 0)
+                win32api.keybd_event(win32con.VK_RETURN, 0, win32con.KEYEVENTF_KEYUP, 0)
+                self.log_message("已发送回车键")
+            
+            self.log_message(f"✅ 通过坐标点击发送消息到: {window_title}")
+            
+            # 🔄 只有在需要复制时才启动异步回复检测
+            needs_copy = self.check_if_needs_copy(window_title)
+            if needs_copy:
+                self.log_message("🔄 启动回复检测和复制转发...")
+                self.start_ai_reply_detection(hwnd, window_title, input_x, input_y)
+            else:
+                self.log_message("⚪ 未配置复制坐标，跳过异步回复检测")
+            
+            return True
+            
+        except Exception as e:
+            self.log_message(f"坐标点击发送失败: {e}")
+            return False
+    
+    def find_input_control_in_wecom(self, parent_control, depth=0, max_depth=5):
+        """在企业微信窗口中查找输入控件"""
+        if depth > max_depth:
+            return None
+            
+        try:
+            children = parent_control.GetChildren()
+            for child in children:
+                # 检查是否是输入相关控件
+                if (child.ControlTypeName in ['EditControl', 'DocumentControl'] or
+                    'Edit' in child.ClassName or 'Input' in child.ClassName):
+                    return child
+                
+                # 递归搜索
+                result = self.find_input_control_in_wecom(child, depth + 1, max_depth)
+                if result:
+                    return result
+        except:
+            pass
+        
+        return None
+    
+    def load_config(self):
+        """加载多规则配置"""
+        try:
+            config = self.config_store.reload().to_dict()
+            
+            # 加载多规则配置
+            if 'forwarding_rules' in config:
+                self.forwarding_rules = config['forwarding_rules']
+            else:
+                # 兼容旧版单一配置格式
+                if 'source' in config and 'target' in config:
+                    self.convert_old_config_to_rules(config)
+                else:
+                    self.init_default_rule()
+            
+            # 加载延迟设置
+            if 'detection_delay' in config:
+                self.detection_delay = config['detection_delay']
+            
+            # 加载其他设置
+            if 'log_retention_days' in config:
+                self.log_retention_days = config['log_retention_days']
+                self.file_log.retention_days = self.log_retention_days
+            
+            if 'queue_max_size' in config:
+                self.queue_max_size = config['queue_max_size']
+            
+            # 加载调试截图设置
+            debug_frames = config.get('debug_frames', {})
+            self.frame_recorder.configure(
+                enabled=debug_frames.get('enabled', False),
+                keep_last=debug_frames.get('keep_last', 10),
+                scale=debug_frames.get('scale', 0.5),
+                truth_tail=debug_frames.get('truth_tail_seconds', 30)
+            )
+            
+            # 加载回复检测策略设置
+            self.reply_detection_config = config.get('reply_detection', {})
+            
+            # 指定范围转发窗口的超时时间（秒）
+            self.range_tracker.timeout = config.get('range_window_timeout', 600)
+            
+            # 加载日志文件设置
+            file_log = config.get('file_log', {})
+            self.file_log.enabled = file_log.get('enabled', True)
+            self.file_log.jsonl = file_log.get('jsonl', False)
+            self.file_log.max_bytes = int(file_log.get('max_mb', 10) * 1024 * 1024)
+            
+            # 加载相同问题合并设置
+            coalesce = config.get('coalesce_questions', {})
+            if self.message_queue:
+                self.message_queue.configure_coalescing(
+                    enabled=coalesce.get('enabled', True),
+                    near_duplicate=coalesce.get('near_duplicate', True),
+                    threshold=coalesce.get('threshold', 0.85)
+                )
+            
+            # 加载回复缓存设置
+            reply_cache = config.get('reply_cache', {})
+            self.reply_cache.configure(
+                enabled=reply_cache.get('enabled', False),
+                ttl=reply_cache.get('ttl_hours', 168) * 3600,
+                max_entries=reply_cache.get('max_entries', 500),
+                near_duplicate=reply_cache.get('near_duplicate', False),
+                threshold=reply_cache.get('threshold', 0.85)
+            )
+            
+            # 加载消息处理跟踪设置
+            tracing = config.get('tracing', {})
+            self.tracer.configure(enabled=tracing.get('enabled', False), directory=tracing.get('dir', 'traces'))
+            
+            # 加载性能分析设置
+            self.profiling_config = config.get('profiling', {})
+            
+            # 加载控制接口设置
+            self.control_api.enabled = config.get('control_api', {}).get('enabled', False)
+            
+            # 加载指标接口设置（只监听本机）
+            metrics = config.get('metrics', {})
+            self.metrics_server.stop()
+            if metrics.get('enabled', True):
+                self.metrics_server.host = metrics.get('host', '127.0.0.1')
+                self.metrics_server.port = metrics.get('port', 9464)
+                self.metrics_server.start()
+            
+            # 加载昵称设置
+            if 'wechat_nickname' in config:
+                self.current_wechat_nickname = config['wechat_nickname']
+            
+            # 重建规则索引（界面模式同时刷新规则列表）
+            self.rules_changed()
+            
+            self.log_message("多规则配置已加载")
+            
+        except FileNotFoundError:
+            self.log_message("配置文件不存在，使用默认规则")
+            self.init_default_rule()
+        except Exception as e:
+            self.notify_error("错误", f"加载配置失败: {e}")
+            self.init_default_rule()
+    
+    def convert_old_config_to_rules(self, old_config):
+        """将旧版单一配置转换为多规则格式"""
+        try:
+            converted_rule = {
+                'id': 'rule_1',
+                'name': '转换的规则',
+                'enabled': True,
+                'source': {
+                    'type': old_config['source']['type'],
+                    'contact': old_config['source']['contact'],
+                    'filter_type': old_config['source']['filter_type'],
+                    'range_start': old_config['source']['range_start'],
+                    'range_end': old_config['source']['range_end']
+                },
+                'target': {
+                    'type': old_config['target']['type'],
+                    'contact': old_config['target']['contact']
+                }
+            }
+            self.forwarding_rules = [converted_rule]
+            self.rebuild_rule_index()
+            self.log_message("✅ 已将旧版配置转换为多规则格式")
+        except Exception as e:
+            self.log_message(f"❌ 转换旧配置失败: {e}")
+            self.init_default_rule()
+    
+    def save_setting(self, key, value):
+        """保存单个设置"""
+        try:
+            # 更新设置（合并写入）
+            self.config_store.update({key: value})
+            
+            # 更新实例变量
+            if key == 'log_retention_days':
+                self.log_retention_days = value
+                self.cleanup_old_logs()
+            elif key == 'queue_max_size':
+                self.queue_max_size = value
+            elif key == 'detection_delay':
+                self.detection_delay = value
+                
+        except Exception as e:
+            self.log_message(f"保存设置失败: {e}")
+    
+    def cleanup_old_logs(self):
+        """清理过期的日志文件"""
+        try:
+            self.file_log.retention_days = self.log_retention_days
+            deleted_count = self.file_log.cleanup()
+            if deleted_count > 0:
+                self.log_message(f"🗑️ 已清理 {deleted_count} 个过期日志文件")
+                
+        except Exception as e:
+            self.log_message(f"❌ 清理日志失败: {e}")
+    
+    def log_message(self, message, rule_id=None, message_id=None, stage=None):
+        """记录日志消息
+        
+        Args:
+            rule_id: 规则ID，日志前显示规则序号
+            message_id: 队列消息ID，写入结构化日志
+            stage: 处理阶段（如 send / reply / forward / completed），写入结构化日志
+        """
+        now = datetime.now()
+        timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
+        
+        # 如果提供了rule_id，在消息前面添加规则ID
+        if rule_id is not None:
+            # 查找规则的序号
+            rule_sequence = self.get_rule_sequence_by_id(rule_id)
+            if rule_sequence:
+                message = f"【规则{rule_sequence}】{message}"
+        
+        log_entry = f"[{timestamp}] {message}\n"
+        
+        # 日志文件（__init__ 中创建日志文件之前的日志只输出到控制台）
+        if getattr(self, 'file_log', None) is not None:
+            self.file_log.write(message, now, rule_id, message_id, stage)
+        
+        self.display_log(log_entry)
+    
+    def get_rule_sequence_by_id(self, rule_id):
+        """根据规则ID获取规则序号"""
+        try:
+            for i, rule in enumerate(self.forwarding_rules):
+                if rule.get('id') == rule_id:
+                    return str(i + 1)
+            return None
+        except Exception:
+            return None
+    
+    def start_ai_reply_detection(self, hwnd, window_title, input_x, input_y):
+        """启动回复检测和反向转发"""
+        def detection_worker():
+            try:
+                self.log_message("🔍 开始检测回复...")
+                
+                # 调试截图按消息ID分目录记录
+                frame_id = window_title
+                target_contact = window_title
+                processing_message = self.message_queue.processing_message if self.message_queue else None
+                if processing_message:
+                    frame_id = processing_message.get('id', window_title)
+                    target_contact = processing_message.get('matched_rule', {}).get('target', {}).get('contact', window_title)
+                
+                # 最多检测5分钟
+                result = self.run_reply_detection(hwnd, target_contact, 300, frame_id)
+                
+                if result.completed:
+                    self.log_message("✅ 回复完成！")
+                    # 回复完成，开始复制消息
+                    with self.ui_lock:
+                        self.copy_ai_reply_and_forward(hwnd, input_x, input_y, result.text)
+                elif result.reason in ('timeout', 'unavailable'):
+                    self.log_message("⏰ 检测超时或无可用检测策略，停止回复检测")
+                    # 超时时也要标记消息完成
+                    self.handle_detection_timeout()
+                        
+            except Exception as e:
+                self.log_message(f"❌ 回复检测出错: {e}")
+                # 异常时也要标记消息完成
+                self.handle_detection_error(str(e))
+        
+        # 在新线程中运行检测（沿用当前消息的跟踪）
+        trace_id = self.tracer.current()
+        
+        def traced_detection_worker():
+            with self.tracer.activate(trace_id):
+                detection_worker()
+        
+        import threading
+        detection_thread = threading.Thread(target=traced_detection_worker, daemon=True)
+        detection_thread.start()
+    
+    def handle_detection_timeout(self):
+        """处理异步检测超时的情况"""
+        try:
+            if self.message_queue and self.message_queue.processing_message:
+                processing_message = self.message_queue.processing_message
+                self.message_queue.mark_message_completed(processing_message, "复制检测超时", success=False)
+                self.log_message("⚠️ 异步检测超时，已标记消息完成")
+        except Exception as e:
+            self.log_message(f"处理检测超时失败: {e}")
+    
+    def handle_detection_error(self, error_msg):
+        """处理异步检测错误的情况"""
+        try:
+            if self.message_queue and self.message_queue.processing_message:
+                processing_message = self.message_queue.processing_message
+                self.message_queue.mark_message_completed(processing_message, f"复制检测异常: {error_msg}", success=False)
+                self.log_message("⚠️ 异步检测异常，已标记消息完成")
+        except Exception as e:
+            self.log_message(f"处理检测错误失败: {e}")
+    
+    def capture_for_detection(self, hwnd):
+        """回复检测轮询时截图（计入当前消息的跟踪；截图要激活窗口，持有界面操作锁）"""
+        with self.ui_lock, self.tracer.span('capture'):
+            return self.capture_wecom_area(hwnd)
+    
+    def capture_wecom_area(self, hwnd, region_ratio=None):
+        """使用屏幕截图方式截取企业微信整个窗口（用于回复完成检测）"""
+        try:
+            # 设置DPI感知，避免截图缩放问题
+            try:
+                windll.shcore.SetProcessDpiAwareness(1)  # PROCESS_DPI_AWARE
+            except:
+                try:
+                    windll.user32.SetProcessDPIAware()  # 旧版本Windows
+                except:
+                    pass  # 如果都失败就忽略
+            
+            self.log_message(f"📸 开始屏幕截图 - 窗口句柄: {hwnd}")
+            self.metrics.inc('screen_captures_total', help='回复检测截图次数')
+            
+            # 检查窗口状态
+            if not win32gui.IsWindow(hwnd):
+                self.log_message("❌ 窗口句柄无效")
+                return None
+                
+            if not win32gui.IsWindowVisible(hwnd):
+                self.log_message("❌ 窗口不可见")
+                return None
+            
+            # 激活窗口
+            try:
+                if win32gui.IsIconic(hwnd):
+                    win32gui.ShowWindow(hwnd, win32con.SW_RESTORE)
+                    time.sleep(0.3)
+                
+                win32gui.ShowWindow(hwnd, win32con.SW_SHOW)
+                time.sleep(0.2)
+                
+                win32gui.SetForegroundWindow(hwnd)
+                time.sleep(0.2)
+                
+                win32gui.BringWindowToTop(hwnd)
+                time.sleep(0.5)
+                
+                current_foreground = win32gui.GetForegroundWindow()
+                if current_foreground == hwnd:
+                    self.log_message("✅ 窗口已激活")
+                else:
+                    self.log_message(f"⚠ 窗口可能未完全激活")
+                    
+            except Exception as e:
+                self.log_message(f"⚠ 窗口激活出错: {e}")
+            
+            # 使用UIAutomation获取准确的窗口信息
+            try:
+                import uiautomation as auto
+                
+                # 通过句柄获取UIAutomation控件
+                window_control = auto.ControlFromHandle(hwnd)
+                if window_control:
+                    # 获取窗口的边界矩形
+                    ui_rect = window_control.BoundingRectangle
+                    self.log_message(f"📐 UIAutomation窗口边界: ({ui_rect.left},{ui_rect.top},{ui_rect.right},{ui_rect.bottom})")
+                    
+                    # 使用UIAutomation的边界
+                    rect = (ui_rect.left, ui_rect.top, ui_rect.right, ui_rect.bottom)
+                    window_width = ui_rect.right - ui_rect.left
+                    window_height = ui_rect.bottom - ui_rect.top
+                    
+                    self.log_message(f"✅ UIAutomation窗口信息: 位置{rect}, 大小{window_width}x{window_height}")
+                else:
+                    # 如果UIAutomation失败，使用win32gui作为备选
+                    rect = win32gui.GetWindowRect(hwnd)
+                    window_width = rect[2] - rect[0]
+                    window_height = rect[3] - rect[1]
+                    self.log_message(f"⚠ UIAutomation失败，使用win32gui: 位置{rect}, 大小{window_width}x{window_height}")
+                    
+            except Exception as e:
+                # 如果导入UIAutomation失败，使用win32gui
+                rect = win32gui.GetWindowRect(hwnd)
+                window_width = rect[2] - rect[0]
+                window_height = rect[3] - rect[1]
+                self.log_message(f"⚠ UIAutomation不可用({e})，使用win32gui: 位置{rect}, 大小{window_width}x{window_height}")
+            
+            if window_width <= 0 or window_height <= 0:
+                self.log_message("❌ 窗口大小无效")
+                return None
+            
+            # 直接截取整个窗口（已验证正确）
+            full_window_img = ImageGrab.grab(bbox=(rect[0], rect[1], rect[2], rect[3]))
+            
+            self.log_message(f"✅ 企业微信窗口截图成功: {full_window_img.size}")
+            return full_window_img
+                
+        except Exception as e:
+            self.log_message(f"❌ 屏幕截图失败: {e}")
+            import traceback
+            self.log_message(f"详细错误: {traceback.format_exc()}")
+            return None
+    
+    def compare_images(self, img1, img2):
+        """比较两张图像是否完全相同"""
+        try:
+            return images_identical(img1, img2)
+        except Exception as e:
+            self.log_message(f"图像比较失败: {e}")
+            return False
+    
+    def copy_ai_reply_and_forward(self, hwnd, input_x, input_y, reply_text=None):
+        """复制AI回复并转发到普通微信（多规则系统适配）
+        
+        Args:
+            reply_text (str, optional): 检测策略已得到的回复文本（uia），有时不再提取或复制
+        """
+        try:
+            self.log_message("📋 开始复制回复消息...")
+            
+            # 获取当前正在处理的消息和规则
+            if not self.message_queue or not self.message_queue.processing_message:
+                self.log_message("⚠️ 没有正在处理的消息")
+                return
+            
+            processing_message = self.message_queue.processing_message
+            rule = processing_message.get('matched_rule')
+            if not rule:
+                self.log_message("⚠️ 无法获取消息对应的规则")
+                return
+            
+            rule_id = rule['id']
+            target_contact = rule['target']['contact']
+            
+            # 检测策略已得到回复文本时直接使用，否则优先通过UIA直接读取，不占用鼠标和剪贴板
+            if reply_text and reply_text.strip():
+                ai_reply = reply_text
+                self.log_message("✅ 检测时已取得回复文本，开始转发到目标联系人...", rule_id)
+            else:
+                ai_reply, elapsed_ms = extract_last_reply(hwnd)
+                if ai_reply and ai_reply.strip():
+                    self.log_message(f"✅ UIA提取回复成功（耗时{elapsed_ms:.0f}毫秒），开始转发到目标联系人...", rule_id)
+            if ai_reply and ai_reply.strip():
+                success = self.forward_copied_reply_to_target(rule, ai_reply.strip())
+                # 记录这条AI回复，避免被再次转发
+                self.record_ai_reply(ai_reply)
+                if success:
+                    self.message_queue.mark_message_completed(processing_message, "AI回复已提取并转发", success=True)
+                    self.observe_stage('total', processing_message.get('timestamp'), processing_message)
+                else:
+                    self.message_queue.mark_message_completed(processing_message, "提取转发失败", success=False)
+                return
+            self.log_message(f"⚠️ UIA提取回复失败（耗时{elapsed_ms:.0f}毫秒），回退到坐标复制", rule_id)
+            copy_start_time = time.perf_counter()
+            
+            # 从配置快照加载复制坐标
+            try:
+                copy_coords = self.config_store.snapshot().copy_coordinates(target_contact)
+                if not copy_coords:
+                    self.notify_error("错误", f"未找到 {target_contact} 的复制坐标配置\n请点击'设置复制坐标'按钮进行设置")
+                    return
+                
+                right_click_offset = copy_coords['right_click']
+                copy_click_offset = copy_coords['copy_click']
+                
+                self.log_message(f"📍 加载复制坐标配置:")
+                self.log_message(f"   右键偏移: {right_click_offset}")
+                self.log_message(f"   复制偏移: {copy_click_offset}")
+                
+            except Exception as e:
+                self.notify_error("错误", f"加载复制坐标配置失败: {e}")
+                return
+            
+            # 激活企业微信窗口
+            win32gui.SetForegroundWindow(hwnd)
+            time.sleep(0.3)
+            
+            # 获取窗口位置，计算基准点（左下角）
+            window_rect = win32gui.GetWindowRect(hwnd)
+            base_x = window_rect[0]  # 窗口左边界
+            base_y = window_rect[3]  # 窗口下边界（左下角）
+            
+            # 计算右键点击的绝对坐标
+            right_click_x = base_x + right_click_offset[0]
+            right_click_y = base_y - right_click_offset[1]  # Y轴反向
+            
+            self.log_message(f"🎯 右键点击坐标: ({right_click_x}, {right_click_y})")
+            
+            # 移动鼠标并右键点击
+            win32api.SetCursorPos((right_click_x, right_click_y))
+            time.sleep(0.3)
+            
+            # 右键点击
+            win32api.mouse_event(win32con.MOUSEEVENTF_RIGHTDOWN, 0, 0, 0, 0)
+            win32api.mouse_event(win32con.MOUSEEVENTF_RIGHTUP, 0, 0, 0, 0)
+            time.sleep(0.5)  # 等待右键菜单出现
+            
+            self.log_message(f"🖱 右键菜单已弹出")
+            
+            # 计算复制按钮的绝对坐标
+            copy_x = base_x + copy_click_offset[0]
+            copy_y = base_y - copy_click_offset[1]  # Y轴反向
+            
+            self.log_message(f"📋 复制按钮坐标: ({copy_x}, {copy_y})")
+            
+            # 移动鼠标并点击复制
+            win32api.SetCursorPos((copy_x, copy_y))
+            time.sleep(0.2)
+            
+            # 左键点击复制按钮
+            win32api.mouse_event(win32con.MOUSEEVENTF_LEFTDOWN, 0, 0, 0, 0)
+            win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, 0, 0, 0, 0)
+            time.sleep(0.3)
+            
+            self.log_message(f"✅ 已点击复制按钮")
+            
+            # 等待复制完成
+            time.sleep(0.5)
+            
+            # 使用多规则系统转发复制的内容
+            self.log_message(f"📋 复制完成（耗时{(time.perf_counter() - copy_start_time) * 1000:.0f}毫秒），开始转发到目标联系人...")
+            success = self.forward_copied_reply_to_target(rule)
+            
+            # 标记消息处理完成
+            if success:
+                self.message_queue.mark_message_completed(processing_message, "AI回复已复制并转发", success=True)
+                self.observe_stage('total', processing_message.get('timestamp'), processing_message)
+            else:
+                self.message_queue.mark_message_completed(processing_message, "复制转发失败", success=False)
+            
+        except Exception as e:
+            self.log_message(f"❌ 复制回复失败: {e}")
+            # 标记消息处理失败
+            if hasattr(self, 'message_queue') and self.message_queue and self.message_queue.processing_message:
+                self.message_queue.mark_message_completed(self.message_queue.processing_message, f"复制回复异常: {e}", success=False)
+    
+    def forward_copied_reply_to_target(self, rule, reply_text=None):
+        """将AI回复转发到目标联系人（多规则系统）
+
+        提供reply_text时直接发送该文本，否则发送剪贴板中复制的内容
+        """
+        try:
+            target_type = rule['target']['type']
+            target_contact = rule['target']['contact']
+            rule_id = rule['id']
+            
+            self.log_message(f"📤 准备转发到 {target_type}:{target_contact}", rule_id)
+            
+            if target_type == "wechat":
+                # 转发到普通微信
+                if not self.wechat:
+                    self.log_message("❌ 微信实例不存在", rule_id)
+                    return False
+                
+                if reply_text:
+                    self.wechat.SendMsg(reply_text, who=target_contact)
+                    self.log_message(f"✅ 已转发AI回复到微信: {target_contact}", rule_id)
+                    return True
+                
+                # 获取剪贴板内容
+                import win32clipboard
+                try:
+                    win32clipboard.OpenClipboard()
+                    clipboard_content = win32clipboard.GetClipboardData()
+                    win32clipboard.CloseClipboard()
+                    
+                    if not clipboard_content:
+                        self.log_message("❌ 剪贴板内容为空", rule_id)
+                        return False
+                    
+                    # 发送到普通微信
+                    self.wechat.SendMsg(clipboard_content, who=target_contact)
+                    self.log_message(f"✅ 已转发AI回复到微信: {target_contact}", rule_id)
+                    return True
+                    
+                except Exception as e:
+                    self.log_message(f"❌ 获取剪贴板内容失败: {e}", rule_id)
+                    return False
+                    
+            elif target_type == "wecom":
+                # 转发到企业微信（通过粘贴发送）
+                if reply_text:
+                    self.set_clipboard_text(reply_text)
+                success = self.send_clipboard_to_wecom_window(target_contact)
+                if success:
+                    self.log_message(f"✅ 已转发AI回复到企业微信: {target_contact}", rule_id)
+                else:
+                    self.log_message(f"❌ 转发AI回复到企业微信失败: {target_contact}", rule_id)
+                return success
+            else:
+                self.log_message(f"❌ 不支持的目标类型: {target_type}", rule_id)
+                return False
+                
+        except Exception as e:
+            self.log_message(f"❌ 转发复制回复失败: {e}", rule.get('id'))
+            return False
+    
+    def send_clipboard_to_wecom_window(self, window_title):
+        """将剪贴板内容发送到企业微信窗口"""
+        try:
+            import win32gui
+            import win32con
+            import win32api
+            import win32clipboard
+            import time
+            
+            # 找到企业微信窗口
+            hwnd = self.find_wecom_chat_window(window_title)
+            if not hwnd:
+                self.log_message(f"❌ 未找到企业微信窗口: {window_title}")
+                return False
+            
+            # 激活窗口
+            win32gui.ShowWindow(hwnd, win32con.SW_RESTORE)
+            win32gui.SetForegroundWindow(hwnd)
+            time.sleep(0.3)
+            
+            # 直接粘贴剪贴板内容
+            win32api.keybd_event(win32con.VK_CONTROL, 0, 0, 0)
+            win32api.keybd_event(ord('V'), 0, 0, 0)
+            win32api.keybd_event(ord('V'), 0, win32con.KEYEVENTF_KEYUP, 0)
+            win32api.keybd_event(win32con.VK_CONTROL, 0, win32con.KEYEVENTF_KEYUP, 0)
+            time.sleep(0.5)
+            
+            # 发送消息
+            win32api.keybd_event(win32con.VK_RETURN, 0, 0, 0)
+            win32api.keybd_event(win32con.VK_RETURN, 0, win32con.KEYEVENTF_KEYUP, 0)
+            time.sleep(0.3)
+            
+            return True
+            
+        except Exception as e:
+            self.log_message(f"❌ 发送剪贴板内容到企业微信失败: {e}")
+            return False
+    
+    def forward_ai_reply_to_wechat(self):
+        """旧版单规则系统的方法，已废弃，仅保留兼容性"""
+        try:
+            self.log_message("⚠️ 旧版转发方法已废弃，请使用新的多规则系统")
+            return
+            
+            # 以下代码仅保留兼容性，不会执行
+            # 获取源联系人名称（从规则中获取第一个启用的规则）
+            enabled_rules = [rule for rule in self.forwarding_rules if rule.get('enabled', True)]
+            if not enabled_rules:
+                self.log_message("⚠️ 没有启用的规则")
+                return
+            
+            source_contact = enabled_rules[0]['source']['contact']
+            
+            # 直接在当前监听的聊天窗口粘贴，因为聊天窗口已经打开
+            # 不能使用搜索，因为搜索会清空剪贴板中的AI回复内容
+            
+            if not self.wechat:
+                self.log_message("❌ 微信实例不存在")
+                return
+            
+            self.log_message("📋 直接在聊天窗口粘贴AI回复...")
+            
+            # 由于正在监听该联系人，聊天窗口应该已经是活跃状态
+            # 直接发送粘贴的内容，不调用ChatWith（避免搜索操作）
+            try:
+                # 获取剪贴板内容
+                import win32clipboard
+                win32clipboard.OpenClipboard()
+                ai_reply_content = win32clipboard.GetClipboardData()
+                win32clipboard.CloseClipboard()
+                
+                self.log_message(f"📄 获取到AI回复内容: {ai_reply_content[:50]}...")
+                
+                # 记录这条AI回复，避免被再次转发
+                self.record_ai_reply(ai_reply_content)
+                
+                # 直接使用wxauto发送消息到当前聊天窗口
+                # 不使用ChatWith方法，避免搜索操作
+                self.wechat.SendMsg(ai_reply_content, who=source_contact)
+                
+                self.log_message(f"✅ AI回复已直接发送到: {source_contact}")
+                
+            except Exception as clipboard_error:
+                self.log_message(f"❌ 剪贴板操作失败: {clipboard_error}，尝试备用方法")
+                
+                # 备用方法：直接键盘操作粘贴
+                # 确保聊天窗口处于活跃状态
+                time.sleep(0.3)
+                
+                # 使用Ctrl+V粘贴
+                win32api.keybd_event(win32con.VK_CONTROL, 0, 0, 0)
+                win32api.keybd_event(ord('V'), 0, 0, 0)
+                win32api.keybd_event(ord('V'), 0, win32con.KEYEVENTF_KEYUP, 0)
+                win32api.keybd_event(win32con.VK_CONTROL, 0, win32con.KEYEVENTF_KEYUP, 0)
+                time.sleep(0.3)
+                
+                # 发送回车
+                win32api.keybd_event(win32con.VK_RETURN, 0, 0, 0)
+                win32api.keybd_event(win32con.VK_RETURN, 0, win32con.KEYEVENTF_KEYUP, 0)
+                time.sleep(0.2)
+                
+                self.log_message(f"✅ AI回复已通过键盘粘贴发送到: {source_contact}")
+            
+        except Exception as e:    
+            self.log_message(f"❌ 转发AI回复失败: {e}")
+            return False
+    
+    def send_to_wechat_window(self, chat_name, ai_reply, sender):
+        """直接查找并发送消息到微信独立聊天窗口"""
+        try:
+            import win32gui
+            import win32con
+            import win32clipboard
+            from wxauto.utils.win32 import GetAllWindows
+            import time
+            
+            # 查找所有窗口
+            with self.tracer.span('find_window', window=chat_name):
+                all_windows = GetAllWindows()
+                target_hwnd = None
+                
+                # 查找微信聊天窗口
+                for hwnd, class_name, window_title in all_windows:
+                    # 检查是否是微信聊天窗口
+                    if self.is_wechat_chat_window(hwnd, class_name, window_title, chat_name):
+                        target_hwnd = hwnd
+                        self.log_message(f"✅ 找到微信聊天窗口: {window_title} (hwnd: {hwnd})")
+                        break
+            
+            if not target_hwnd:
+                self.log_message(f"❌ 未找到微信聊天窗口: {chat_name}")
+                return False
+            
+            # 激活窗口
+            with self.tracer.span('activate', window=chat_name):
+                win32gui.SetForegroundWindow(target_hwnd)
+                time.sleep(0.5)
+            
+            # 构建回复内容
+            if sender != chat_name:  # 群聊情况
+                reply_content = f"@{sender} {ai_reply}"
+                self.log_message(f"📝 群聊回复内容: @{sender} [AI回复内容]")
+            else:
+                reply_content = ai_reply
+                self.log_message(f"📝 私聊回复内容: [AI回复内容]")
+            
+            # 将内容复制到剪贴板，查找输入框并粘贴内容
+            with self.tracer.span('paste', window=chat_name):
+                self.set_clipboard_text(reply_content)
+                success = self.paste_to_wechat_input(target_hwnd)
+            if success:
+                # 发送消息 (Enter)
+                import win32api
+                win32api.keybd_event(win32con.VK_RETURN, 0, 0, 0)
+                win32api.keybd_event(win32con.VK_RETURN, 0, win32con.KEYEVENTF_KEYUP, 0)
+                time.sleep(0.2)
+                
+                self.log_message(f"✅ 消息已发送到微信窗口: {chat_name}")
+                return True
+            else:
+                self.log_message(f"❌ 无法在微信窗口中找到输入框")
+                return False
+                
+        except Exception as e:
+            self.log_message(f"❌ 发送到微信窗口失败: {e}")
+            import traceback
+            self.log_message(f"详细错误: {traceback.format_exc()}")
+            return False
+    
+    def is_wechat_chat_window(self, hwnd, class_name, window_title, chat_name):
+        """判断是否是微信聊天窗口"""
+        try:
+            # 检查类名是否匹配微信聊天窗口
+            wechat_chat_classes = [
+                'ChatWnd',           # 普通微信聊天窗口
+                'WeChatMainWnd',     # 微信主窗口
+                'WeUIDialog',        # 微信对话框
+            ]
+            
+            if class_name in wechat_chat_classes:
+                # 检查窗口标题是否包含聊天名称
+                if chat_name in window_title:
+                    # 验证是否属于微信进程
+                    try:
+                        import win32process
+                        import win32api
+                        thread_id, process_id = win32process.GetWindowThreadProcessId(hwnd)
+                        process_handle = win32api.OpenProcess(win32process.PROCESS_QUERY_INFORMATION, False, process_id)
+                        try:
+                            process_name = win32process.GetModuleFileNameEx(process_handle, 0)
+                            if 'WeChat.exe' in process_name or 'wechat.exe' in process_name:
+                                return True
+                        finally:
+                            win32api.CloseHandle(process_handle)
+                    except:
+                        # 如果无法验证进程，但类名和标题匹配，也认为有效
+                        return True
+            
+            return False
+            
+        except Exception as e:
+            self.log_message(f"验证微信窗口失败: {e}")
+            return False
+    
+    def paste_to_wechat_input(self, hwnd):
+        """在微信窗口中找到输入框并粘贴内容"""
+        try:
+            import win32gui
+            import win32con
+            import win32api
+            import time
+            
+            # 首先尝试直接使用全局粘贴快捷键
+            self.log_message("📝 尝试使用全局粘贴快捷键...")
+            
+            # 确保窗口激活
+            win32gui.SetForegroundWindow(hwnd)
+            time.sleep(0.3)
+            
+            # 直接使用Ctrl+V在激活窗口中粘贴
+            win32api.keybd_event(win32con.VK_CONTROL, 0, 0, 0)
+            win32api.keybd_event(ord('V'), 0, 0, 0)
+            win32api.keybd_event(ord('V'), 0, win32con.KEYEVENTF_KEYUP, 0)
+            win32api.keybd_event(win32con.VK_CONTROL, 0, win32con.KEYEVENTF_KEYUP, 0)
+            time.sleep(0.3)
+            
+            self.log_message("✅ 已使用全局粘贴快捷键")
+            return True
+            
+        except Exception as e:
+            self.log_message(f"❌ 全局粘贴失败: {e}")
+            
+            # 备用方法：查找输入框控件
+            try:
+                self.log_message("🔍 尝试查找输入框控件...")
+                
+                # 查找输入框控件
+                input_controls = []
+                
+                def enum_child_proc(child_hwnd, lparam):
+                    try:
+                        class_name = win32gui.GetClassName(child_hwnd)
+                        # 扩大微信输入框可能的类名
+                        input_classes = ['Edit', 'RichEdit', 'RichEdit20W', 'RichEdit50W', 'RichEdit20A', 'RichEdit20WPT']
+                        
+                        if class_name in input_classes:
+                            # 检查控件是否可见
+                            if win32gui.IsWindowVisible(child_hwnd):
+                                rect = win32gui.GetWindowRect(child_hwnd)
+                                width = rect[2] - rect[0]
+                                height = rect[3] - rect[1]
+                                
+                                # 输入框通常有一定的宽度和高度
+                                if width > 50 and height > 15:
+                                    input_controls.append((child_hwnd, class_name, width, height))
+                                    self.log_message(f"🔍 找到控件: {class_name} ({width}x{height})")
+                    except:
+                        pass
+                    return True
+                
+                win32gui.EnumChildWindows(hwnd, enum_child_proc, None)
+                
+                if input_controls:
+                    # 选择最大的控件作为输入框
+                    target_input = max(input_controls, key=lambda x: x[2] * x[3])[0]
+                    
+                    self.log_message(f"✅ 选中输入框控件: {target_input}")
+                    
+                    # 点击输入框获取焦点
+                    rect = win32gui.GetWindowRect(target_input)
+                    center_x = (rect[0] + rect[2]) // 2
+                    center_y = (rect[1] + rect[3]) // 2
+                    
+                    # 使用鼠标点击
+                    win32api.SetCursorPos((center_x, center_y))
+                    win32api.mouse_event(win32con.MOUSEEVENTF_LEFTDOWN, 0, 0, 0, 0)
+                    win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, 0, 0, 0, 0)
+                    time.sleep(0.2)
+                    
+                    # 粘贴
+                    win32api.keybd_event(win32con.VK_CONTROL, 0, 0, 0)
+                    win32api.keybd_event(ord('V'), 0, 0, 0)
+                    win32api.keybd_event(ord('V'), 0, win32con.KEYEVENTF_KEYUP, 0)
+                    win32api.keybd_event(win32con.VK_CONTROL, 0, win32con.KEYEVENTF_KEYUP, 0)
+                    time.sleep(0.2)
+                    
+                    self.log_message("✅ 已粘贴内容到找到的输入框")
+                    return True
+                else:
+                    self.log_message("❌ 未找到任何输入框控件")
+                    return False
+            
+            except Exception as e2:
+                self.log_message(f"❌ 备用方法也失败: {e2}")
+                return False
+    
+    def set_clipboard_text(self, text):
+        """设置剪贴板文本"""
+        try:
+            import win32clipboard
+            import win32con
+            
+            # 确保文本是字符串类型
+            if not isinstance(text, str):
+                text = str(text)
+            
+            win32clipboard.OpenClipboard()
+            win32clipboard.EmptyClipboard()
+            
+            # 使用Unicode格式设置剪贴板
+            win32clipboard.SetClipboardData(win32con.CF_UNICODETEXT, text)
+            win32clipboard.CloseClipboard()
+            
+            self.log_message(f"✅ 已复制内容到剪贴板: {text[:30]}...")
+        except Exception as e:
+            self.log_message(f"❌ 设置剪贴板失败: {e}")
+            # 备用方法
+            try:
+                self.set_clipboard_fallback(text)
+                self.log_message(f"✅ 使用备用方法设置剪贴板成功")
+            except Exception as e2:
+                self.log_message(f"❌ 备用剪贴板方法也失败: {e2}")
+    
+    def record_ai_reply(self, content):
+        """记录AI回复内容，避免循环转发"""
+        try:
+            self.loop_guard.record(content)
+            self.log_message(f"📝 已记录AI回复内容（当前记录数: {len(self.loop_guard)}）")
+            
+        except Exception as e:
+            self.log_message(f"记录AI回复失败: {e}")
+    
+    def is_recent_ai_reply(self, content):
+        """检查消息是否是最近的AI回复"""
+        return self.message_classifier.is_recent_ai_reply(content)
+    
+    def get_process_name(self, pid):
+        """获取进程名称"""
+        try:
+            import psutil
+            process = psutil.Process(pid)
+            return process.name()
+        except:
+            return ""
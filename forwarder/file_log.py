@@ -0,0 +1,173 @@
+"""
+日志文件输出
+
+日志先放入内存队列，由后台线程批量写入 logs/forwarder_YYYY-MM-DD.log，
+消息处理线程不会因为磁盘写入而阻塞（队列满时丢弃并计数）。
+
+- 按天切换文件，单个文件超过 max_bytes 时切换到 forwarder_YYYY-MM-DD.1.log、.2.log ...
+- 可选同时写入结构化的 forwarder_YYYY-MM-DD.jsonl（时间、规则ID、消息ID、处理阶段、内容）
+- 超过保留天数的日志文件在启动和跨天时清理
+"""
+
+from datetime import datetime, timedelta
+import threading
+import atexit
+import glob
+import json
+import os
+import queue
+
+
+class AsyncFileLogWriter:
+    """后台线程写入、按天和大小切换的日志文件"""
+
+    def __init__(self, directory='logs', prefix='forwarder', retention_days=10,
+                 max_bytes=10 * 1024 * 1024, jsonl=False, queue_size=10000):
+        """
+        Args:
+            directory (str): 日志目录
+            prefix (str): 文件名前缀
+            retention_days (int): 日志保留天数
+            max_bytes (int): 单个日志文件的最大字节数
+            jsonl (bool): 是否同时写入结构化JSONL日志
+            queue_size (int): 待写入队列的最大长度
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.retention_days = retention_days
+        self.max_bytes = max_bytes
+        self.jsonl = jsonl
+        self.enabled = True
+        self.dropped = 0
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._files = {}        # {扩展名: (文件对象, 日期, 序号)}
+        self._thread = None
+        self._stopped = False
+
+    def start(self):
+        if self._thread is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.cleanup()
+            self._thread = threading.Thread(target=self._run, name='file-log-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def write(self, text, timestamp=None, rule_id=None, message_id=None, stage=None):
+        """提交一行日志（不阻塞，队列满时丢弃）"""
+        if self._stopped or not self.enabled:
+            return
+        try:
+            self._queue.put_nowait((timestamp or datetime.now(), text, rule_id, message_id, stage))
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self, timeout=2.0):
+        """写完队列中剩余的日志后停止"""
+        if self._thread is None or self._stopped:
+            return
+        self._stopped = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    # ---------- 后台线程 ----------
+
+    def _run(self):
+        while True:
+            records = [self._queue.get()]
+            # 一次取出队列中已有的全部日志，合并写入
+            while True:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in records
+            try:
+                self._write_batch([r for r in records if r is not None])
+            except Exception as e:
+                print(f"写入日志文件失败: {e}")
+            if stop:
+                self._close_all()
+                return
+
+    def _write_batch(self, records):
+        if not records:
+            return
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            records.insert(0, (records[0][0], f"...（日志写入过慢，已丢弃 {dropped} 行）", None, None, None))
+
+        text_lines = []
+        json_lines = []
+        for timestamp, text, rule_id, message_id, stage in records:
+            text_lines.append(f"[{timestamp.strftime('%Y-%m-%d %H:%M:%S')}] {text}\n")
+            if self.jsonl:
+                json_lines.append(json.dumps({
+                    'time': timestamp.isoformat(timespec='milliseconds'),
+                    'rule_id': rule_id,
+                    'message_id': message_id,
+                    'stage': stage,
+                    'message': text,
+                }, ensure_ascii=False) + '\n')
+
+        day = records[-1][0].strftime('%Y-%m-%d')
+        self._append('log', day, ''.join(text_lines))
+        if json_lines:
+            self._append('jsonl', day, ''.join(json_lines))
+
+    def _path(self, extension, day, index):
+        suffix = f".{index}" if index else ''
+        return os.path.join(self.directory, f"{self.prefix}_{day}{suffix}.{extension}")
+
+    def _append(self, extension, day, data):
+        handle, current_day, index = self._files.get(extension, (None, None, 0))
+        if handle is not None and current_day != day:
+            handle.close()
+            handle, index = None, 0
+            self.cleanup()
+        if handle is not None and handle.tell() >= self.max_bytes:
+            handle.close()
+            handle, index = None, index + 1
+        if handle is None:
+            # 重启后接着写当天最后一个未满的文件
+            while os.path.exists(self._path(extension, day, index + 1)):
+                index += 1
+            path = self._path(extension, day, index)
+            if os.path.exists(path) and os.path.getsize(path) >= self.max_bytes:
+                index += 1
+                path = self._path(extension, day, index)
+            handle = open(path, 'a', encoding='utf-8')
+        handle.write(data)
+        handle.flush()
+        self._files[extension] = (handle, day, index)
+
+    def _close_all(self):
+        for handle, _, _ in self._files.values():
+            try:
+                handle.close()
+            except Exception:
+                pass
+        self._files.clear()
+
+    # ---------- 清理 ----------
+
+    def cleanup(self):
+        """删除超过保留天数的日志文件
+
+        Returns:
+            int: 删除的文件数
+        """
+        cutoff_date = datetime.now() - timedelta(days=self.retention_days)
+        start = len(self.prefix) + 1
+        deleted_count = 0
+        for pattern in ('*.log', '*.jsonl'):
+            for log_file in glob.glob(os.path.join(self.directory, f"{self.prefix}_{pattern}")):
+                try:
+                    # 文件名形如 forwarder_2024-01-31.log 或 forwarder_2024-01-31.2.log
+                    file_date = datetime.strptime(os.path.basename(log_file)[start:start + 10], '%Y-%m-%d')
+                    if file_date < cutoff_date:
+                        os.remove(log_file)
+                        deleted_count += 1
+                except (ValueError, OSError):
+                    continue
+        return deleted_count
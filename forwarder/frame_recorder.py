@@ -0,0 +1,305 @@
+"""
+调试截图记录器
+
+回复检测线程只负责把截图放入有界队列，由后台线程缩小、压缩后写盘，
+每个消息ID单独一个目录，只保留最近K张。未启用时record()直接返回，不产生任何开销。
+
+每个目录下同时维护 manifest.json，记录每帧的采集时间戳、检测引擎判定完成的时间，
+以及回复真正完成的时间（truth_completed_at），供离线回放基准测试使用
+（见 TEST/bench_reply_detection_replay.py）。按 keep_last 轮换删除的帧仍保留在清单中并标记
+dropped，这样的序列缺少回复开头，不能用于回放；录制回放用的序列需设置 keep_last 为0。
+
+截图在判定完成时就停止采集，只凭这些截图无法发现提前判定。因此判定完成后继续用
+独立的采样（消息列表最后一条回复的文本，不截图、不激活窗口）观察一段时间：
+这段时间内回复仍有变化时，truth_completed_at 取最后一次变化后的第一个采样时间
+（truth_source 为 tail）；没有变化或无法采样时，取最后一段连续相同截图的第一帧时间
+（truth_source 为 frames）。两者都可人工修改。
+"""
+
+from collections import deque
+import threading
+import hashlib
+import queue
+import json
+import os
+import re
+import time
+
+
+class FrameRecorder:
+    """有界异步调试截图记录器"""
+
+    # 最多跟踪的消息ID数量，超出后遗忘最早的消息
+    MAX_TRACKED_MESSAGES = 256
+
+    def __init__(self, root_dir="temp", max_queue=32, keep_last=10, scale=0.5, truth_tail=30.0, log=None):
+        self.root_dir = root_dir
+        self.max_queue = max_queue
+        self.keep_last = keep_last      # 每个消息ID保留的截图数量，None表示全部保留
+        self.scale = scale              # 缩放比例，1表示不缩放
+        self.truth_tail = truth_tail    # 判定完成后继续独立采样的时长（秒），0表示不采样
+        self.log = log
+        self.enabled = False
+
+        self.dropped_count = 0          # 队列满时丢弃的帧数
+        self.written_count = 0
+
+        self._queue = None
+        self._writer_thread = None
+        self._lock = threading.Lock()
+        self._sequence = {}             # {message_id: 当前帧序号}
+        self._recent_files = {}         # {message_id: deque([文件路径])}
+        self._manifests = {}            # {message_id: manifest}，仅由写入线程访问
+
+    def configure(self, enabled=None, keep_last=None, scale=None, max_queue=None, truth_tail=None):
+        """根据配置更新记录器参数"""
+        if truth_tail is not None:
+            self.truth_tail = truth_tail
+        if keep_last is not None:
+            self.keep_last = keep_last
+        if scale is not None:
+            self.scale = scale
+        if max_queue is not None:
+            self.max_queue = max_queue
+        if enabled is not None:
+            if enabled:
+                self.start()
+            else:
+                self.stop()
+
+    def start(self):
+        """启动后台写入线程"""
+        with self._lock:
+            if self.enabled:
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._writer_thread = threading.Thread(target=self._writer_loop, args=(self._queue,), daemon=True)
+            self._writer_thread.start()
+            self.enabled = True
+
+    def stop(self):
+        """停止记录，已入队的截图写完后线程退出"""
+        with self._lock:
+            if not self.enabled:
+                return
+            self.enabled = False
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                pass
+            self._queue = None
+            self._writer_thread = None
+
+    def record(self, message_id, image):
+        """记录一帧截图（非阻塞）
+
+        Args:
+            message_id (str): 消息ID，用于分目录保存
+            image (PIL.Image.Image): 截图
+
+        Returns:
+            bool: 是否成功入队
+        """
+        if not self.enabled:
+            return False
+        frame_queue = self._queue
+        if frame_queue is None:
+            return False
+        with self._lock:
+            sequence = self._sequence.get(message_id, 0) + 1
+            self._sequence[message_id] = sequence
+            if len(self._sequence) > self.MAX_TRACKED_MESSAGES:
+                oldest_id = next(iter(self._sequence))
+                del self._sequence[oldest_id]
+        try:
+            frame_queue.put_nowait(('frame', message_id, sequence, time.time(), image))
+            return True
+        except queue.Full:
+            self.dropped_count += 1
+            return False
+
+    def mark_completed(self, message_id, strategy=None, completed_at=None):
+        """记录检测引擎判定回复完成的时间，并据此写入该截图序列的完成时间
+
+        Args:
+            message_id (str): 消息ID
+            strategy (str, optional): 判定完成的检测策略
+            completed_at (float, optional): 判定完成的时间戳，默认当前时间
+        """
+        if not self.enabled:
+            return
+        frame_queue = self._queue
+        if frame_queue is None:
+            return
+        # 完成标记排在该消息所有截图之后，队列满时等待片刻
+        try:
+            frame_queue.put(('complete', message_id, strategy, completed_at or time.time()), timeout=1)
+        except queue.Full:
+            pass
+
+    def record_truth_tail(self, message_id, sampler, interval=1.0):
+        """判定完成后在后台线程继续采样 truth_tail 秒，用于确定回复真实完成的时间
+
+        Args:
+            message_id (str): 消息ID
+            sampler (Callable[[], str]): 读取当前回复内容；返回None（如已发出下一条消息）
+                或抛出异常时结束采样
+            interval (float): 采样间隔（秒）
+        """
+        if not self.enabled or not self.truth_tail:
+            return
+        threading.Thread(target=self._sample_tail, args=(message_id, sampler, self.truth_tail, interval),
+                         name='frame-truth-tail', daemon=True).start()
+
+    def _sample_tail(self, message_id, sampler, seconds, interval):
+        samples = []
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            try:
+                value = sampler()
+            except Exception:
+                break
+            if value is None:
+                break
+            samples.append({
+                'timestamp': time.time(),
+                'digest': hashlib.md5(value.encode('utf-8')).hexdigest(),
+            })
+            time.sleep(interval)
+
+        frame_queue = self._queue
+        if frame_queue is None:
+            return
+        try:
+            frame_queue.put(('truth', message_id, samples), timeout=1)
+        except queue.Full:
+            pass
+
+    def frame_dir(self, message_id):
+        """消息ID对应的截图目录"""
+        safe_id = re.sub(r'[<>:"/\\|?*\s]', '_', str(message_id))
+        return os.path.join(self.root_dir, safe_id)
+
+    def _writer_loop(self, frame_queue):
+        while True:
+            item = frame_queue.get()
+            if item is None:
+                break
+            try:
+                if item[0] == 'frame':
+                    self._write_frame(*item[1:])
+                elif item[0] == 'complete':
+                    self._write_completion(*item[1:])
+                else:
+                    self._write_truth(*item[1:])
+            except Exception as e:
+                if self.log:
+                    self.log(f"⚠️ 保存调试截图失败: {e}")
+
+    def _write_frame(self, message_id, sequence, timestamp, image):
+        if self.scale and self.scale < 1:
+            factor = max(1, int(round(1 / self.scale)))
+            image = image.reduce(factor)
+        image = image.convert('L')
+
+        frame_dir = self.frame_dir(message_id)
+        os.makedirs(frame_dir, exist_ok=True)
+        path = os.path.join(frame_dir, f"frame_{sequence:03d}.png")
+        # 压缩级别1：文件稍大，但编码耗时远低于默认级别
+        image.save(path, compress_level=1)
+        self.written_count += 1
+
+        manifest = self._get_manifest(message_id)
+        manifest['frames'].append({
+            'file': os.path.basename(path),
+            'sequence': sequence,
+            'timestamp': timestamp,
+            # 图像指纹用于确定真实完成时间，帧文件被轮换删除后仍可用
+            'digest': hashlib.md5(image.tobytes()).hexdigest(),
+        })
+
+        if self.keep_last:
+            recent = self._recent_files.setdefault(message_id, deque())
+            if len(self._recent_files) > self.MAX_TRACKED_MESSAGES:
+                oldest_id = next(iter(self._recent_files))
+                del self._recent_files[oldest_id]
+            recent.append(path)
+            while len(recent) > self.keep_last:
+                old_path = recent.popleft()
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+            # 清单保留全部帧的时间戳和指纹，只标记文件已删除，完成时间仍按完整序列计算
+            kept = {os.path.basename(path) for path in recent}
+            for frame in manifest['frames']:
+                if frame['file'] not in kept:
+                    frame['dropped'] = True
+
+        self._save_manifest(message_id)
+
+    def _get_manifest(self, message_id):
+        if message_id not in self._manifests:
+            self._manifests[message_id] = {
+                'message_id': str(message_id),
+                'scale': self.scale,
+                'frames': [],
+                'detected_completed_at': None,
+                'detected_strategy': None,
+                'truth_completed_at': None,
+                'truth_source': None,
+                'truth_samples': [],
+            }
+            if len(self._manifests) > self.MAX_TRACKED_MESSAGES:
+                oldest_id = next(iter(self._manifests))
+                del self._manifests[oldest_id]
+        return self._manifests[message_id]
+
+    def _write_completion(self, message_id, strategy, completed_at):
+        manifest = self._get_manifest(message_id)
+        manifest['detected_completed_at'] = completed_at
+        manifest['detected_strategy'] = strategy
+        manifest['truth_completed_at'], manifest['truth_source'] = completion_time(manifest['frames'])
+        self._save_manifest(message_id)
+
+    def _write_truth(self, message_id, samples):
+        manifest = self._get_manifest(message_id)
+        manifest['truth_samples'] = samples
+        manifest['truth_completed_at'], manifest['truth_source'] = completion_time(manifest['frames'], samples)
+        self._save_manifest(message_id)
+
+    def _save_manifest(self, message_id):
+        path = os.path.join(self.frame_dir(message_id), 'manifest.json')
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._manifests[message_id], f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, path)
+
+
+def stable_since(frames):
+    """最后一段连续相同内容（按 digest）的第一个时间戳"""
+    if not frames:
+        return None
+    last_digest = frames[-1].get('digest')
+    completed_at = frames[-1]['timestamp']
+    for frame in reversed(frames):
+        if frame.get('digest') != last_digest:
+            break
+        completed_at = frame['timestamp']
+    return completed_at
+
+
+def completion_time(frames, tail_samples=()):
+    """回复真实完成的时间
+
+    判定完成后的独立采样中内容仍有变化，说明判定过早，取最后一次变化后的第一个采样时间；
+    否则取最后一段连续相同截图的第一帧时间
+
+    Returns:
+        tuple: (时间戳, 来源 'tail' 或 'frames')
+    """
+    if tail_samples:
+        changed_at = stable_since(tail_samples)
+        if changed_at > tail_samples[0]['timestamp']:
+            return changed_at, 'tail'
+    return stable_since(frames), 'frames'
@@ -0,0 +1,76 @@
+"""
+监听对账
+
+转发运行中规则发生变化时，只对来源发生变化的聊天增删监听，
+其余聊天的独立窗口和监听保持不动，不需要停止再重新开始转发。
+"""
+
+
+def desired_listeners(rules):
+    """启用的规则需要监听的 (来源类型, 联系人) 集合
+
+    联系人为空的通配规则匹配所有已监听的聊天，本身不产生监听
+    """
+    return {
+        (rule['source']['type'], rule['source']['contact'])
+        for rule in rules
+        if rule.get('enabled', True) and rule['source'].get('contact')
+    }
+
+
+class ListenerReconciler:
+    """维护当前监听集合，按规则变化做差量增删"""
+
+    def __init__(self, add_listener, remove_listener, log=None):
+        """
+        Args:
+            add_listener (Callable[[str, str], None]): 添加监听 (来源类型, 联系人)，失败时抛出异常
+            remove_listener (Callable[[str, str], None]): 移除监听 (来源类型, 联系人)，失败时抛出异常
+            log (Callable[[str], None], optional): 日志回调
+        """
+        self.add_listener = add_listener
+        self.remove_listener = remove_listener
+        self.log = log
+        self.active = set()
+
+    def _log(self, message):
+        if self.log:
+            self.log(message)
+
+    def reconcile(self, rules):
+        """让当前监听与规则一致
+
+        Returns:
+            tuple: (新增的监听集合, 移除的监听集合)
+        """
+        desired = desired_listeners(rules)
+        to_remove = self.active - desired
+        to_add = desired - self.active
+
+        removed = set()
+        for source_type, contact in sorted(to_remove):
+            try:
+                self.remove_listener(source_type, contact)
+            except Exception as e:
+                # 仍视为活动监听（聊天仍在监听，通配规则仍会匹配它），下次对账时重试
+                self._log(f"⚠️ 移除监听失败 {source_type}:{contact}: {e}")
+                continue
+            self.active.discard((source_type, contact))
+            removed.add((source_type, contact))
+
+        added = set()
+        for source_type, contact in sorted(to_add):
+            try:
+                self.add_listener(source_type, contact)
+            except Exception as e:
+                # 不记入活动监听，下次对账时重试
+                self._log(f"❌ 添加监听失败 {source_type}:{contact}: {e}")
+                continue
+            self.active.add((source_type, contact))
+            added.add((source_type, contact))
+
+        return added, removed
+
+    def clear(self):
+        """移除全部监听"""
+        return self.reconcile([])
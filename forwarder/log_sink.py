@@ -0,0 +1,107 @@
+"""
+界面日志批量输出
+
+各线程的日志先写入线程安全的环形缓冲区，界面线程定时取出一批，一次性插入日志文本框：
+- 不再为每行日志单独调度一次 root.after 回调
+- 文本框只保留最近 max_lines 行，长时间运行也不会越来越卡
+- 用户向上滚动查看历史日志时不自动滚动到底部
+"""
+
+from collections import deque
+import threading
+
+
+class LogBuffer:
+    """线程安全的日志环形缓冲区，写满后丢弃最早的日志"""
+
+    def __init__(self, capacity=5000):
+        self._lock = threading.Lock()
+        self._lines = deque(maxlen=capacity)
+        self._dropped = 0
+
+    def __len__(self):
+        return len(self._lines)
+
+    def append(self, line):
+        with self._lock:
+            if len(self._lines) == self._lines.maxlen:
+                self._dropped += 1
+            self._lines.append(line)
+
+    def drain(self):
+        """取出全部日志
+
+        Returns:
+            tuple: (日志行列表, 取出前因缓冲区已满丢弃的行数)
+        """
+        with self._lock:
+            lines = list(self._lines)
+            self._lines.clear()
+            dropped, self._dropped = self._dropped, 0
+        return lines, dropped
+
+
+class TextLogSink:
+    """定时把 LogBuffer 中的日志批量写入 Tk 文本框"""
+
+    def __init__(self, root, text_widget, buffer, max_lines=3000, interval_ms=200):
+        """
+        Args:
+            root: Tk 根窗口，用于调度定时回调
+            text_widget: 日志文本框（Text / ScrolledText）
+            buffer (LogBuffer): 日志缓冲区
+            max_lines (int): 文本框最多保留的行数
+            interval_ms (int): 刷新间隔，单位毫秒
+        """
+        self.root = root
+        self.text_widget = text_widget
+        self.buffer = buffer
+        self.max_lines = max_lines
+        self.interval_ms = interval_ms
+        self._after_id = None
+
+    def start(self):
+        if self._after_id is None:
+            self._after_id = self.root.after(self.interval_ms, self._drain)
+
+    def stop(self):
+        if self._after_id is not None:
+            try:
+                self.root.after_cancel(self._after_id)
+            except Exception:
+                pass
+            self._after_id = None
+
+    def is_at_bottom(self):
+        """文本框是否显示在最底部（用户没有向上滚动）"""
+        return self.text_widget.yview()[1] >= 0.999
+
+    def flush(self):
+        """把缓冲区中的日志写入文本框（必须在界面线程调用）"""
+        lines, dropped = self.buffer.drain()
+        if not lines:
+            return
+        widget = self.text_widget
+        follow = self.is_at_bottom()
+        if dropped:
+            widget.insert('end', f"...（日志过多，已省略 {dropped} 行）\n")
+        widget.insert('end', ''.join(lines))
+
+        # 只保留最近 max_lines 行（每行以换行结尾，end-1c 位于最后一个空行）
+        line_count = int(widget.index('end-1c').split('.')[0]) - 1
+        if line_count > self.max_lines:
+            widget.delete('1.0', f'{line_count - self.max_lines + 1}.0')
+
+        if follow:
+            widget.see('end')
+
+    def _drain(self):
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"GUI log update failed: {e}")
+        try:
+            self._after_id = self.root.after(self.interval_ms, self._drain)
+        except Exception:
+            # 窗口已关闭
+            self._after_id = None
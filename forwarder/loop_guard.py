@@ -0,0 +1,165 @@
+"""
+循环转发防护
+
+记录最近转发出去的AI回复，收到新消息时判断它是否就是（或几乎就是）刚转发的回复，
+避免回复在两个聊天之间来回转发。
+
+- 完全相同：规范化（NFKC、去空白、转小写）后的内容哈希，字典O(1)查找
+- 近似重复：字符二元组的MinHash签名（32个哈希），按每4个一段分为8段做LSH索引，
+  只有至少一段完全相同的记录才进一步估算Jaccard相似度，不必遍历全部记录；
+  Jaccard为0.8时成为候选的概率约98.5%
+- 记录按时间窗口和最大数量淘汰
+"""
+
+from collections import deque
+from itertools import repeat
+import threading
+import hashlib
+import unicodedata
+import time
+import re
+
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_content(content):
+    """规范化消息内容：全角转半角、去除空白、转小写"""
+    return _WHITESPACE.sub('', unicodedata.normalize('NFKC', content)).lower()
+
+
+def shingles(text, size=2):
+    """文本的字符shingle集合"""
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def minhash(shingle_set, num_perm=32):
+    """shingle集合的MinHash签名：num_perm个种子下各自的最小哈希值
+
+    签名只在进程内比较，直接使用内置hash
+    """
+    return tuple(
+        min(map(hash, zip(repeat(seed), shingle_set)))
+        for seed in range(num_perm)
+    )
+
+
+class _Entry:
+    __slots__ = ('recorded_at', 'digest', 'signature')
+
+    def __init__(self, recorded_at, digest, signature):
+        self.recorded_at = recorded_at
+        self.digest = digest
+        self.signature = signature
+
+
+class LoopGuard:
+    """最近AI回复的指纹索引"""
+
+    NUM_PERM = 32
+    BANDS = 8
+    ROWS = NUM_PERM // BANDS
+
+    def __init__(self, window_seconds=1800, max_entries=2000, threshold=0.8, min_length=20):
+        """
+        Args:
+            window_seconds (float): 记录保留时间，单位秒
+            max_entries (int): 最多保留的记录数
+            threshold (float): 判定为近似重复的Jaccard相似度
+            min_length (int): 规范化后长度不超过该值时只做完全匹配，短文本的相似度不可靠
+        """
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.min_length = min_length
+
+        self._lock = threading.Lock()
+        self._entries = deque()         # 按记录时间排列
+        self._digests = {}              # {digest: 记录次数}
+        self._bands = [{} for _ in range(self.BANDS)]   # [{段值: {signature: 记录次数}}]
+        self._last_query = (None, None, None)           # 同一条消息会被连续检查多次
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _fingerprint(self, content):
+        if self._last_query[0] == content:
+            return self._last_query[1], self._last_query[2]
+        normalized = normalize_content(content)
+        digest = hashlib.md5(normalized.encode('utf-8')).digest()
+        signature = minhash(shingles(normalized), self.NUM_PERM) if len(normalized) > self.min_length else None
+        self._last_query = (content, digest, signature)
+        return digest, signature
+
+    def _band_values(self, signature):
+        return [signature[i * self.ROWS:(i + 1) * self.ROWS] for i in range(self.BANDS)]
+
+    def _similarity(self, sig1, sig2):
+        return sum(a == b for a, b in zip(sig1, sig2)) / self.NUM_PERM
+
+    def record(self, content, now=None):
+        """记录一条已转发的回复"""
+        now = now or time.time()
+        with self._lock:
+            digest, signature = self._fingerprint(content)
+            self._entries.append(_Entry(now, digest, signature))
+            self._digests[digest] = self._digests.get(digest, 0) + 1
+            if signature is not None:
+                for band, value in zip(self._bands, self._band_values(signature)):
+                    bucket = band.setdefault(value, {})
+                    bucket[signature] = bucket.get(signature, 0) + 1
+            self._expire(now)
+
+    def match(self, content, now=None):
+        """判断内容是否为最近记录过的回复
+
+        Returns:
+            str: 'exact' 完全相同，'near' 近似重复，None 不是最近的回复
+        """
+        now = now or time.time()
+        with self._lock:
+            self._expire(now)
+            if not self._entries:
+                return None
+            digest, signature = self._fingerprint(content)
+            if digest in self._digests:
+                return 'exact'
+            if signature is None:
+                return None
+            checked = set()
+            for band, value in zip(self._bands, self._band_values(signature)):
+                for candidate in band.get(value, ()):
+                    if candidate in checked:
+                        continue
+                    checked.add(candidate)
+                    if self._similarity(candidate, signature) >= self.threshold:
+                        return 'near'
+            return None
+
+    def is_recent(self, content, now=None):
+        return self.match(content, now) is not None
+
+    def _expire(self, now):
+        deadline = now - self.window_seconds
+        while self._entries and (
+            self._entries[0].recorded_at < deadline or len(self._entries) > self.max_entries
+        ):
+            entry = self._entries.popleft()
+            self._decrement(self._digests, entry.digest)
+            if entry.signature is not None:
+                for band, value in zip(self._bands, self._band_values(entry.signature)):
+                    bucket = band.get(value)
+                    if bucket is not None:
+                        self._decrement(bucket, entry.signature)
+                        if not bucket:
+                            del band[value]
+
+    @staticmethod
+    def _decrement(counter, key):
+        count = counter.get(key, 0) - 1
+        if count > 0:
+            counter[key] = count
+        else:
+            counter.pop(key, None)
@@ -0,0 +1,115 @@
+"""
+消息分类
+
+监听回调收到的每条消息依次经过：系统消息判断、自己消息判断（含最近AI回复的循环防护）、
+规则匹配。这些判断不依赖微信窗口，集中在这里，便于在任意平台上用模拟消息做基准测试
+（见 TEST/bench_message_classification.py）。
+"""
+
+from .message_filter import SYSTEM_MESSAGE_MATCHER
+from .rule_index import compile_filter
+
+
+SYSTEM_ATTRS = ('system', 'time', 'tickle')
+SYSTEM_SENDERS = ('system', 'time')
+SYSTEM_CLASSES = ('SystemMessage', 'TimeMessage', 'TickleMessage')
+SELF_TYPES = ('sent', 'outgoing', 'self')
+
+
+class MessageClassifier:
+    """消息的系统/自己/规则匹配判断"""
+
+    def __init__(self, rule_index_provider, loop_guard, self_name_provider=None, log=None):
+        """
+        Args:
+            rule_index_provider (Callable[[], RuleIndex]): 获取当前规则索引（规则变化时索引会整体替换）
+            loop_guard (LoopGuard): 最近转发的AI回复
+            self_name_provider (Callable[[], str], optional): 获取当前微信昵称，用于@本人过滤和识别自己的消息
+            log (Callable[[str], None], optional): 日志回调
+        """
+        self.rule_index_provider = rule_index_provider
+        self.loop_guard = loop_guard
+        self.self_name_provider = self_name_provider or (lambda: None)
+        self.log = log
+
+    def _log(self, message):
+        if self.log:
+            self.log(message)
+
+    def is_system_message(self, msg):
+        """判断是否是系统消息"""
+        try:
+            # 检查消息属性
+            if getattr(msg, 'attr', None) in SYSTEM_ATTRS:
+                return True
+
+            # 检查发送者
+            if getattr(msg, 'sender', None) in SYSTEM_SENDERS:
+                return True
+
+            # 检查消息内容是否是系统提示（关键词已预编译为单个正则）
+            if SYSTEM_MESSAGE_MATCHER.search(msg.content):
+                return True
+
+            # 检查消息类名
+            return msg.__class__.__name__ in SYSTEM_CLASSES
+
+        except Exception as e:
+            self._log(f"检查系统消息失败: {e}")
+            return False
+
+    def is_self_message(self, msg):
+        """检查是否是自己发送的消息（含最近转发的AI回复）"""
+        try:
+            # 方法1: 检查消息的attr属性 - 这是最可靠的方法
+            if getattr(msg, 'attr', None) == 'self':
+                return True
+
+            # 方法2: 检查消息发送者是否是自己的昵称
+            sender = getattr(msg, 'sender', None)
+            if sender and sender == self.self_name_provider():
+                return True
+
+            # 方法3: 检查消息类型
+            if hasattr(msg, 'type') and str(msg.type).lower() in SELF_TYPES:
+                return True
+
+            # 方法4: 检查是否是最近的AI回复内容，避免循环转发
+            if self.is_recent_ai_reply(msg.content):
+                return True
+
+        except Exception as e:
+            self._log(f"消息发送者检查失败: {e}")
+
+        return False
+
+    def is_recent_ai_reply(self, content):
+        """检查消息是否是最近的AI回复"""
+        try:
+            # 规范化后完全相同，或与最近的AI回复高度相似（防止格式微调）
+            return self.loop_guard.is_recent(content)
+
+        except Exception as e:
+            self._log(f"检查AI回复相似性失败: {e}")
+            return False
+
+    def find_matching_rules(self, msg, chat_name, source_type):
+        """查找匹配的转发规则"""
+        try:
+            # 只检查该聊天对应的已启用规则（含联系人为空的通配规则）
+            matching_rules = self.rule_index_provider().match(msg, chat_name, source_type)
+            for rule in matching_rules:
+                self._log(f"✅ 消息匹配规则: {rule['name']}")
+            return matching_rules
+
+        except Exception as e:
+            self._log(f"❌ 规则匹配失败: {e}")
+            return []
+
+    def message_matches_filter(self, msg, source_config):
+        """检查消息是否符合单条规则的过滤条件"""
+        try:
+            return compile_filter(source_config, self.self_name_provider)(msg.content)
+        except Exception as e:
+            self._log(f"❌ 过滤条件检查失败: {e}")
+            return False
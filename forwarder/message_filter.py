@@ -0,0 +1,135 @@
+"""
+规则过滤条件
+
+规则的 source 配置可以带一个 filters 字段，各项之间为"且"的关系，列表内为"或"：
+
+    "filters": {
+        "keywords": ["退款", "发票"],          # 包含任一关键词
+        "exclude_keywords": ["广告"],          # 不包含任一关键词
+        "regex": ["订单号\\d{6,}"],            # 匹配任一正则
+        "exclude_regex": ["^\\[自动回复\\]"],   # 不匹配任一正则
+        "senders": ["张三"],                   # 发送者白名单
+        "exclude_senders": ["群机器人"],        # 发送者黑名单
+        "msg_types": ["text", "quote"]         # 消息类型（wxauto消息的type属性）
+    }
+
+关键词在规则编译时合并为一个正则（先构建为前缀树再生成正则，公共前缀只匹配一次），
+每条消息的过滤耗时不随关键词数量线性增长。用户配置的正则各自单独编译，
+避免内联标志（如 (?i)）和编号反向引用（如 \\1）在合并后失效或出错。
+"""
+
+import re
+
+
+def build_trie_pattern(words):
+    """把一组关键词构建为前缀树形式的正则表达式"""
+    trie = {}
+    for word in words:
+        if not word:
+            continue
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = None
+    return _trie_to_pattern(trie)
+
+
+def _trie_to_pattern(node):
+    optional = '' in node
+    alternatives = [
+        re.escape(char) + _trie_to_pattern(child)
+        for char, child in sorted(node.items())
+        if char != ''
+    ]
+    if not alternatives:
+        return ''
+    if len(alternatives) == 1 and not optional:
+        return alternatives[0]
+    pattern = '(?:' + '|'.join(alternatives) + ')'
+    return pattern + '?' if optional else pattern
+
+
+class KeywordMatcher:
+    """关键词（合并为单一正则）与用户正则的匹配器"""
+
+    def __init__(self, keywords=(), regexes=()):
+        """
+        Args:
+            keywords (Iterable[str]): 关键词，按字面匹配
+            regexes (Iterable[str]): 正则表达式
+
+        Raises:
+            ValueError: 正则表达式无效
+        """
+        keywords = [k for k in keywords if k]
+        self.pattern = re.compile(build_trie_pattern(keywords)) if keywords else None
+        self.regexes = []
+        for regex in regexes:
+            try:
+                self.regexes.append(re.compile(regex))
+            except (re.error, TypeError) as e:
+                raise ValueError(f"无效的正则表达式 {regex!r}: {e}")
+
+    def __bool__(self):
+        return self.pattern is not None or bool(self.regexes)
+
+    def search(self, text):
+        """文本中是否包含任一关键词或匹配任一正则"""
+        if self.pattern is not None and self.pattern.search(text) is not None:
+            return True
+        return any(regex.search(text) is not None for regex in self.regexes)
+
+
+def compile_message_filter(filters):
+    """把规则的 filters 配置编译为 msg -> bool 的可调用对象
+
+    Args:
+        filters (dict): 规则 source 中的 filters 配置
+
+    Returns:
+        Callable[[Message], bool]: 过滤函数；没有配置任何条件时返回None
+
+    Raises:
+        ValueError: 配置无效
+    """
+    if not filters:
+        return None
+
+    include = KeywordMatcher(filters.get('keywords', ()), filters.get('regex', ()))
+    exclude = KeywordMatcher(filters.get('exclude_keywords', ()), filters.get('exclude_regex', ()))
+    senders = frozenset(filters.get('senders', ()))
+    exclude_senders = frozenset(filters.get('exclude_senders', ()))
+    msg_types = frozenset(filters.get('msg_types', ()))
+
+    checks = []
+    if msg_types:
+        checks.append(lambda msg: getattr(msg, 'type', None) in msg_types)
+    if senders:
+        checks.append(lambda msg: getattr(msg, 'sender', None) in senders)
+    if exclude_senders:
+        checks.append(lambda msg: getattr(msg, 'sender', None) not in exclude_senders)
+    if include:
+        checks.append(lambda msg: include.search(msg.content))
+    if exclude:
+        checks.append(lambda msg: not exclude.search(msg.content))
+
+    if not checks:
+        return None
+    if len(checks) == 1:
+        return checks[0]
+    return lambda msg: all(check(msg) for check in checks)
+
+
+# 系统提示类消息的内容关键词
+SYSTEM_KEYWORDS = [
+    "以下为新消息",
+    "以上是历史消息",
+    "重新载入聊天记录",
+    "消息加载中",
+    "网络连接失败",
+    "正在重新连接",
+    "你撤回了一条消息",
+    "对方撤回了一条消息",
+]
+
+SYSTEM_MESSAGE_MATCHER = KeywordMatcher(SYSTEM_KEYWORDS)
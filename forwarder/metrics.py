@@ -0,0 +1,349 @@
+"""
+处理耗时指标
+
+一条消息从入队到回复转发回源聊天分为几个阶段，每个阶段的耗时按规则和目标分别统计：
+
+- queue_wait：入队 → 开始处理
+- send：发送到目标
+- reply_wait：发送完成 → 检测到AI回复完成
+- reply_copy：检测完成 → 取得回复文本（UIA读取或坐标复制）
+- forward：回复转发回源聊天
+- total：入队 → 处理完成
+
+另有计数器（截图次数、检测轮询次数、各类失败次数等）和在输出时读取的实时值（队列长度等）。
+指标可以通过本地HTTP接口按 Prometheus 文本格式读取（默认 http://127.0.0.1:9464/metrics），
+界面上的统计面板显示每个阶段最近的 p50 / p95 / p99。
+"""
+
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import json
+import threading
+
+
+STAGES = ('queue_wait', 'send', 'reply_wait', 'reply_copy', 'forward', 'total')
+
+STAGE_NAMES = {
+    'queue_wait': '排队等待',
+    'send': '发送到目标',
+    'reply_wait': '等待AI回复',
+    'reply_copy': '提取回复',
+    'forward': '转发回复',
+    'total': '总耗时',
+}
+
+# 本地接口请求体大小上限
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+# 桶上界（秒），覆盖从界面操作的几十毫秒到AI回复的几分钟
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Histogram:
+    """累计分桶直方图，另保留最近的若干个样本用于计算分位数"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=1000):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+
+def quantiles(samples, qs=(0.5, 0.95, 0.99)):
+    """按最近邻排名计算分位数，没有样本时返回None"""
+    if not samples:
+        return [None for _ in qs]
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    return [ordered[min(last, int(q * len(ordered)))] for q in qs]
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """线程安全的指标登记表：阶段耗时直方图、计数器和输出时读取的实时值"""
+
+    def __init__(self, prefix='forwarder', buckets=DEFAULT_BUCKETS, window=1000):
+        """
+        Args:
+            prefix (str): 指标名前缀
+            buckets (tuple): 直方图桶上界（秒）
+            window (int): 每个直方图保留的最近样本数（用于计算分位数）
+        """
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self.window = window
+        self._lock = threading.Lock()
+        self._histograms = {}   # {(阶段, 规则ID, 目标): Histogram}
+        self._counters = {}     # {(名称, ((标签, 值), ...)): 数值}
+        self._help = {}         # {名称: 说明}
+        self._gauges = []       # [(名称, 说明, Callable[[], number 或 {标签元组: number}])]
+
+    # ---------- 记录 ----------
+
+    def observe(self, stage, seconds, rule='', target=''):
+        """记录一个阶段的耗时（秒）"""
+        if seconds is None or seconds < 0:
+            return
+        key = (stage, rule or '', target or '')
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets, self.window)
+            histogram.observe(seconds)
+
+    def inc(self, name, amount=1, help=None, **labels):
+        """计数器加一（或加 amount）"""
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            if help:
+                self._help.setdefault(name, help)
+
+    def register_gauge(self, name, help, read):
+        """登记输出时读取的实时值
+
+        Args:
+            read (Callable): 返回数值，或 {((标签, 值), ...): 数值}
+        """
+        with self._lock:
+            self._gauges.append((name, help, read))
+
+    def clear(self):
+        """清空耗时和计数（保留登记的实时值）"""
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    # ---------- 读取 ----------
+
+    def stage_summary(self):
+        """每个阶段最近样本的次数和分位数（合并所有规则和目标）
+
+        Returns:
+            dict: {阶段: {'count': 累计次数, 'p50': 秒, 'p95': 秒, 'p99': 秒}}，没有样本的阶段不返回
+        """
+        with self._lock:
+            merged = {}
+            for (stage, _, _), histogram in self._histograms.items():
+                entry = merged.setdefault(stage, [0, []])
+                entry[0] += histogram.count
+                entry[1].extend(histogram.recent)
+
+        summary = {}
+        for stage, (count, samples) in merged.items():
+            p50, p95, p99 = quantiles(samples)
+            summary[stage] = {'count': count, 'p50': p50, 'p95': p95, 'p99': p99}
+        return summary
+
+    def counter_value(self, name, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def render(self):
+        """按 Prometheus 文本格式输出全部指标"""
+        prefix = self.prefix
+        with self._lock:
+            histograms = [
+                (key, histogram.buckets, list(histogram.counts), histogram.count, histogram.sum)
+                for key, histogram in sorted(self._histograms.items())
+            ]
+            counters = sorted(self._counters.items())
+            help_texts = dict(self._help)
+            gauges = list(self._gauges)
+
+        lines = []
+        name = f'{prefix}_stage_duration_seconds'
+        lines.append(f'# HELP {name} 消息各处理阶段的耗时')
+        lines.append(f'# TYPE {name} histogram')
+        for (stage, rule, target), buckets, counts, count, total in histograms:
+            labels = (('stage', stage), ('rule', rule), ('target', target))
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", _format_value(float(bound))),))} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+
+        current = None
+        for (counter, labels), value in counters:
+            full_name = f'{prefix}_{counter}'
+            if counter != current:
+                current = counter
+                if counter in help_texts:
+                    lines.append(f'# HELP {full_name} {help_texts[counter]}')
+                lines.append(f'# TYPE {full_name} counter')
+            lines.append(f'{full_name}{_format_labels(labels)} {_format_value(value)}')
+
+        for gauge, help_text, read in gauges:
+            try:
+                value = read()
+            except Exception:
+                continue
+            full_name = f'{prefix}_{gauge}'
+            lines.append(f'# HELP {full_name} {help_text}')
+            lines.append(f'# TYPE {full_name} gauge')
+            values = value.items() if isinstance(value, dict) else [((), value)]
+            for labels, number in values:
+                lines.append(f'{full_name}{_format_labels(labels)} {_format_value(number)}')
+
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """本地HTTP接口，GET /metrics 返回 Prometheus 文本格式的指标
+
+    其他本地控制功能可以用 add_route 登记到同一个端口上
+    """
+
+    def __init__(self, registry, host='127.0.0.1', port=9464, log=None):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.log = log
+        self._server = None
+        self._thread = None
+        self._routes = {('GET', '/metrics'): (self._metrics, False)}
+
+    def add_route(self, method, path, handler, json_body=False):
+        """登记接口
+
+        Args:
+            method (str): GET / POST 等
+            path (str): 路径（不含查询参数）
+            handler (Callable[[dict, bytes], tuple]): 参数为查询参数 {名称: 值} 和请求体，
+                返回 (状态码, 响应文本) 或 (状态码, 响应文本, Content-Type)；
+                响应文本也可以是逐段生成文本的迭代器（事件流），客户端断开时关闭
+            json_body (bool): 请求体必须是 JSON（Content-Type: application/json），
+                handler 收到解析后的对象；浏览器页面不能跨站发送这类请求
+        """
+        self._routes[(method.upper(), path)] = (handler, json_body)
+
+    def _metrics(self, query, body):
+        return 200, self.registry.render(), 'text/plain; version=0.0.4; charset=utf-8'
+
+    def _dispatch(self, request, method):
+        url = urlsplit(request.path)
+        route = self._routes.get((method, url.path))
+        if route is None:
+            known = any(path == url.path for _, path in self._routes)
+            request.send_error(405 if known else 404)
+            return
+        handler, json_body = route
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        length = int(request.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            request.send_error(413)
+            return
+        body = request.rfile.read(length) if length else b''
+        if json_body:
+            if request.headers.get_content_type() != 'application/json':
+                request.send_error(415, 'Content-Type must be application/json')
+                return
+            try:
+                body = json.loads(body.decode('utf-8')) if body else None
+            except ValueError as e:
+                request.send_error(400, f'Invalid JSON: {e}')
+                return
+        try:
+            status, text, *content_type = handler(query, body)
+        except Exception as e:
+            status, text, content_type = 500, f"{type(e).__name__}: {e}\n", []
+        content_type = content_type[0] if content_type else 'text/plain; charset=utf-8'
+        if not isinstance(text, str):
+            self._stream(request, status, text, content_type)
+            return
+        data = text.encode('utf-8')
+        request.send_response(status)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    @staticmethod
+    def _stream(request, status, chunks, content_type):
+        """逐段发送响应（不带 Content-Length，发送结束后关闭连接）"""
+        request.send_response(status)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Cache-Control', 'no-cache')
+        request.end_headers()
+        try:
+            for chunk in chunks:
+                request.wfile.write(chunk.encode('utf-8'))
+                request.wfile.flush()
+        except OSError:
+            pass    # 客户端已断开
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close:
+                close()
+
+    @property
+    def running(self):
+        return self._server is not None
+
+    def start(self):
+        """启动HTTP服务（端口被占用时记录日志并返回False）"""
+        if self._server is not None:
+            return True
+        dispatch = self._dispatch
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                dispatch(self, 'GET')
+
+            def do_POST(self):
+                dispatch(self, 'POST')
+
+            def log_message(self, format, *args):
+                pass    # 不输出每次请求的访问日志
+
+        try:
+            self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            if self.log:
+                self.log(f"⚠️ 指标接口启动失败（{self.host}:{self.port}）: {e}")
+            return False
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True)
+        self._thread.start()
+        if self.log:
+            self.log(f"📊 指标接口已启动: http://{self.host}:{self.port}/metrics")
+        return True
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        self._thread = None
@@ -0,0 +1,258 @@
+"""
+运行中性能分析
+
+转发程序变慢时，不必重启即可对正在运行的程序做一次限时分析，结果写入 profiles/ 目录：
+
+- sample（默认）：按固定间隔采样所有线程（监听、处理、检测、界面）的调用栈，输出
+  profile_<时间>.collapsed（折叠栈格式，可用 speedscope 或 flamegraph.pl 生成火焰图）
+  和 profile_<时间>.txt（各线程采样数、按自身/累计采样数排序的函数）
+- cprofile：用 cProfile 统计所有线程的函数调用，输出 profile_<时间>.pstats 和文本摘要；
+  cProfile 在 Python 3.12 之前只能统计调用它的线程，此时自动改用 sample
+- 可选内存分析：分析期间开启 tracemalloc，输出 memory_<时间>.txt，包含按代码行的内存增长、
+  各类对象的数量变化（如截图、界面控件对象）以及调用方提供的计数（如已完成消息数）
+
+分析在后台线程中进行，同一时间只运行一次。
+"""
+
+from collections import Counter
+from datetime import datetime
+import cProfile
+import gc
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+
+MODES = ('sample', 'cprofile')
+
+# 单次分析的最长时长（秒），避免内存分析长时间开着 tracemalloc
+MAX_SECONDS = 600
+
+# cProfile 从 3.12 起基于 sys.monitoring，对所有线程生效
+CPROFILE_ALL_THREADS = sys.version_info >= (3, 12)
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Profiler:
+    """限时性能分析会话"""
+
+    def __init__(self, directory='profiles', log=None, object_counts=None):
+        """
+        Args:
+            directory (str): 结果目录
+            log (Callable[[str], None], optional): 日志回调
+            object_counts (Callable[[], dict], optional): 内存分析时在开始和结束各调用一次，
+                返回需要对比的计数（如 {'replied_messages': 120}）
+        """
+        self.directory = directory
+        self.log = log
+        self.object_counts = object_counts
+        self.last_files = []
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _log(self, message):
+        if self.log:
+            self.log(message)
+
+    def start(self, seconds=30, mode='sample', interval=0.005, memory=False):
+        """开始分析
+
+        Args:
+            seconds (float): 分析时长
+            mode (str): sample 或 cprofile
+            interval (float): sample 模式的采样间隔（秒）
+            memory (bool): 是否同时做内存分析
+
+        Returns:
+            bool: 是否已开始（已有分析在运行时返回False）
+
+        Raises:
+            ValueError: 分析方式未知或时长不是正数
+        """
+        if not seconds > 0:
+            raise ValueError(f"分析时长需要大于0: {seconds}")
+        if seconds > MAX_SECONDS:
+            self._log(f"ℹ️ 分析时长最多{MAX_SECONDS}秒，已从{seconds:g}秒缩短")
+            seconds = MAX_SECONDS
+        if self.running:
+            self._log("⚠️ 性能分析正在进行，请等待完成")
+            return False
+        if mode not in MODES:
+            raise ValueError(f"未知的分析方式: {mode}")
+        if mode == 'cprofile' and not CPROFILE_ALL_THREADS:
+            self._log("ℹ️ 当前Python版本的cProfile只能统计单个线程，改用采样方式分析所有线程")
+            mode = 'sample'
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(seconds, mode, interval, memory), name='profiler', daemon=True)
+        self._thread.start()
+        self._log(f"🔬 开始性能分析（{mode}，{seconds:g}秒{'，含内存分析' if memory else ''}）")
+        return True
+
+    def stop(self):
+        """提前结束正在进行的分析（结果照常写入）"""
+        self._stop.set()
+
+    # ---------- 后台线程 ----------
+
+    def _run(self, seconds, mode, interval, memory):
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            memory_before = self._memory_begin() if memory else None
+
+            if mode == 'cprofile':
+                files = self._run_cprofile(seconds, stamp)
+            else:
+                files = self._run_sampler(seconds, interval, stamp)
+
+            if memory_before is not None:
+                files.append(self._memory_end(memory_before, stamp))
+
+            self.last_files = files
+            self._log(f"✅ 性能分析完成: {', '.join(files)}")
+        except Exception as e:
+            self._log(f"❌ 性能分析失败: {e}")
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _run_cprofile(self, seconds, stamp):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            self._stop.wait(seconds)
+        finally:
+            profile.disable()
+
+        stats_path = self._path(f"profile_{stamp}.pstats")
+        profile.dump_stats(stats_path)
+        text_path = self._path(f"profile_{stamp}.txt")
+        stream = io.StringIO()
+        stats = pstats.Stats(profile, stream=stream)
+        stats.sort_stats('cumulative').print_stats(40)
+        stats.sort_stats('tottime').print_stats(40)
+        with open(text_path, 'w', encoding='utf-8') as f:
+            f.write(stream.getvalue())
+        return [stats_path, text_path]
+
+    def _run_sampler(self, seconds, interval, stamp):
+        own = threading.get_ident()
+        stacks = Counter()
+        deadline = time.perf_counter() + seconds
+        samples = 0
+        while not self._stop.is_set() and time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                stacks[tuple(reversed(stack))] += 1
+            samples += 1
+            self._stop.wait(interval)
+
+        collapsed_path = self._path(f"profile_{stamp}.collapsed")
+        with open(collapsed_path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{';'.join(part.replace(';', ',') for part in stack)} {count}\n")
+
+        text_path = self._path(f"profile_{stamp}.txt")
+        with open(text_path, 'w', encoding='utf-8') as f:
+            f.write(self._sample_summary(stacks, samples, interval))
+        return [collapsed_path, text_path]
+
+    @staticmethod
+    def _sample_summary(stacks, samples, interval, top=40):
+        per_thread = Counter()
+        self_counts = Counter()
+        total_counts = Counter()
+        for stack, count in stacks.items():
+            per_thread[stack[0]] += count
+            if len(stack) > 1:
+                self_counts[stack[-1]] += count
+            for label in set(stack[1:]):
+                total_counts[label] += count
+
+        lines = [f"采样轮数: {samples}，间隔: {interval * 1000:g}毫秒", "", "各线程采样数:"]
+        lines += [f"  {count:>8}  {name}" for name, count in per_thread.most_common()]
+        lines += ["", f"自身采样数最多的函数（前{top}）:"]
+        lines += [f"  {count:>8}  {label}" for label, count in self_counts.most_common(top)]
+        lines += ["", f"累计采样数最多的函数（前{top}）:"]
+        lines += [f"  {count:>8}  {label}" for label, count in total_counts.most_common(top)]
+        return '\n'.join(lines) + '\n'
+
+    # ---------- 内存 ----------
+
+    def _memory_begin(self):
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(10)
+        return {
+            'started': started,
+            'snapshot': tracemalloc.take_snapshot(),
+            'types': self._type_counts(),
+            'counts': self._object_counts(),
+        }
+
+    def _memory_end(self, before, stamp, top=30):
+        snapshot = tracemalloc.take_snapshot()
+        if before['started']:
+            tracemalloc.stop()
+        types = self._type_counts()
+        counts = self._object_counts()
+
+        lines = [f"内存增长最多的代码行（前{top}）:"]
+        for stat in snapshot.compare_to(before['snapshot'], 'lineno')[:top]:
+            lines.append(f"  {stat}")
+
+        lines += ["", f"数量增长最多的对象类型（前{top}）:"]
+        growth = Counter({name: types[name] - before['types'].get(name, 0) for name in types})
+        for name, delta in growth.most_common(top):
+            if delta <= 0:
+                break
+            lines.append(f"  {delta:>+8}  {name}（现有 {types[name]}）")
+
+        if counts or before['counts']:
+            lines += ["", "计数变化:"]
+            for name in sorted(set(counts) | set(before['counts'])):
+                old, new = before['counts'].get(name, 0), counts.get(name, 0)
+                lines.append(f"  {name}: {old} -> {new} ({new - old:+})")
+
+        path = self._path(f"memory_{stamp}.txt")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        return path
+
+    @staticmethod
+    def _type_counts():
+        counts = Counter()
+        for obj in gc.get_objects():
+            cls = type(obj)
+            counts[f"{cls.__module__}.{cls.__qualname__}"] += 1
+        return counts
+
+    def _object_counts(self):
+        if not self.object_counts:
+            return {}
+        try:
+            return dict(self.object_counts())
+        except Exception as e:
+            self._log(f"⚠️ 获取对象计数失败: {e}")
+            return {}
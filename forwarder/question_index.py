@@ -0,0 +1,127 @@
+"""
+问题相似索引
+
+按目标联系人分组索引规范化后的问题文本，用于回复缓存和相同问题合并：
+- 完全相同：字典O(1)查找
+- 近似相同（可选）：字符二元组的MinHash签名按段做LSH索引，只对至少一段相同的候选
+  估算Jaccard相似度，不必遍历全部问题
+"""
+
+import re
+
+from .loop_guard import normalize_content, shingles, minhash
+
+
+_MENTION = re.compile(r'[@＠]\S+')
+
+
+def normalize_question(content):
+    """规范化问题文本：去掉@提及后再做通用规范化"""
+    return normalize_content(_MENTION.sub('', content))
+
+
+class QuestionIndex:
+    """按目标联系人分组的问题索引，值为调用方给定的键"""
+
+    NUM_PERM = 32
+    BANDS = 8
+    ROWS = NUM_PERM // BANDS
+
+    def __init__(self, near_duplicate=False, threshold=0.85, min_length=6):
+        """
+        Args:
+            near_duplicate (bool): 是否启用近似匹配
+            threshold (float): 近似匹配的Jaccard相似度阈值
+            min_length (int): 规范化后短于该长度的问题只做完全匹配，短文本的相似度不可靠
+        """
+        self.near_duplicate = near_duplicate
+        self.threshold = threshold
+        self.min_length = min_length
+        self._exact = {}        # {(target, question): key}
+        self._items = {}        # {key: (target, question, signature)}
+        self._bands = {}        # {(target, 段序号, 段值): set(key)}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def _band_keys(self, target, signature):
+        return [
+            (target, i, signature[i * self.ROWS:(i + 1) * self.ROWS])
+            for i in range(self.BANDS)
+        ]
+
+    def _signature(self, question):
+        if not self.near_duplicate or len(question) < self.min_length:
+            return None
+        return minhash(shingles(question), self.NUM_PERM)
+
+    def add(self, key, target, question):
+        """添加（或替换）一个问题，question应已规范化"""
+        self.remove(key)
+        old_key = self._exact.get((target, question))
+        if old_key is not None:
+            self.remove(old_key)
+        signature = self._signature(question)
+        self._exact[(target, question)] = key
+        self._items[key] = (target, question, signature)
+        if signature is not None:
+            for band_key in self._band_keys(target, signature):
+                self._bands.setdefault(band_key, set()).add(key)
+
+    def remove(self, key):
+        item = self._items.pop(key, None)
+        if item is None:
+            return
+        target, question, signature = item
+        if self._exact.get((target, question)) == key:
+            del self._exact[(target, question)]
+        if signature is not None:
+            for band_key in self._band_keys(target, signature):
+                bucket = self._bands.get(band_key)
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del self._bands[band_key]
+
+    def find(self, target, question):
+        """查找相同或近似的问题
+
+        Returns:
+            tuple: (键, 是否为近似匹配)，未找到时键为None
+        """
+        key = self._exact.get((target, question))
+        if key is not None:
+            return key, False
+        signature = self._signature(question)
+        if signature is None:
+            return None, False
+        checked = set()
+        best_key, best_score = None, 0.0
+        for band_key in self._band_keys(target, signature):
+            for candidate in self._bands.get(band_key, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                score = sum(a == b for a, b in zip(signature, self._items[candidate][2])) / self.NUM_PERM
+                if score >= self.threshold and score > best_score:
+                    best_key, best_score = candidate, score
+        return best_key, best_key is not None
+
+    def configure(self, near_duplicate=None, threshold=None):
+        """更新匹配参数，用已有问题重建索引"""
+        if near_duplicate is not None:
+            self.near_duplicate = near_duplicate
+        if threshold is not None:
+            self.threshold = threshold
+        items = [(key, target, question) for key, (target, question, _) in self._items.items()]
+        self.clear()
+        for key, target, question in items:
+            self.add(key, target, question)
+
+    def clear(self):
+        self._exact.clear()
+        self._items.clear()
+        self._bands.clear()
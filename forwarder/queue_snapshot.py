@@ -0,0 +1,124 @@
+"""
+消息队列快照
+
+监听线程和处理线程修改消息队列，界面线程只读取后台线程生成的不可变快照：
+- 队列或规则变化时唤醒后台线程（不轮询），版本号变化后在队列锁内复制需要显示的字段，锁外生成表格行
+- 快照生成后整体替换引用，界面线程读取时不需要加锁，也不会读到修改了一半的队列
+- 界面线程只按快照中预先生成的行更新表格，不再做字符串截取和队列ID计算
+- 新快照生成后通过回调通知界面线程刷新，界面线程也不需要定时检查
+"""
+
+import threading
+
+
+class QueueSnapshot:
+    """某一版本队列内容的只读快照"""
+
+    __slots__ = ('version', 'rows', 'pending_count', 'is_processing', 'replied_count')
+
+    def __init__(self, version, rows, pending_count, is_processing, replied_count):
+        """
+        Args:
+            version: 生成快照时的队列版本号
+            rows (tuple): ((消息ID, values, tag), ...)，values 为表格各列的值
+            pending_count (int): 待处理消息数
+            is_processing (bool): 是否正在处理消息
+            replied_count (int): 已完成（含失败）消息数
+        """
+        self.version = version
+        self.rows = rows
+        self.pending_count = pending_count
+        self.is_processing = is_processing
+        self.replied_count = replied_count
+
+    def filtered_rows(self, queue_id):
+        """只保留某个队列的行，'全部显示' 时返回全部行"""
+        if queue_id == '全部显示':
+            return self.rows
+        return tuple(row for row in self.rows if row[1][0] == queue_id)
+
+
+def _row(fields, queue_label, status_text, tag):
+    message_id, created_time, chat_name, sender, content, rule_id = fields
+    content = content[:50] + '...' if len(content) > 50 else content
+    return (message_id, (queue_label(rule_id), created_time, chat_name, sender, content, status_text), tag)
+
+
+def build_queue_rows(pending, processing, recent, queue_label):
+    """生成表格行：待处理、处理中、最近的已完成/失败
+
+    Args:
+        pending (list): 待处理消息的 (字段元组, 状态)
+        processing (tuple): 处理中消息的字段元组，没有时为None
+        recent (list): 最近完成消息的 (字段元组, 状态)
+        queue_label (Callable[[str], str]): 规则ID -> 队列ID显示文本
+    """
+    rows = []
+    for fields, status in pending:
+        if status == 'processing':
+            rows.append(_row(fields, queue_label, "🔄 处理中", 'processing'))
+        else:
+            rows.append(_row(fields, queue_label, "⏳ 待处理", 'pending'))
+
+    if processing is not None:
+        rows.append(_row(processing, queue_label, "🔄 处理中", 'processing'))
+
+    for fields, status in recent:
+        if status == 'replied':
+            rows.append(_row(fields, queue_label, "✅ 已完成", 'completed'))
+        elif status == 'failed':
+            rows.append(_row(fields, queue_label, "❌ 失败", 'failed'))
+        else:
+            rows.append(_row(fields, queue_label, status, 'other'))
+    return tuple(rows)
+
+
+class SnapshotPublisher:
+    """后台线程：被唤醒且版本号变化时重新生成快照"""
+
+    def __init__(self, build, version_provider, on_snapshot=None, log=None):
+        """
+        Args:
+            build (Callable[[], QueueSnapshot]): 生成快照
+            version_provider (Callable[[], object]): 当前版本号，与上次快照不同时重新生成
+            on_snapshot (Callable[[QueueSnapshot], None], optional): 生成新快照后调用（在快照线程中）
+            log (Callable[[str], None], optional): 日志回调
+        """
+        self.build = build
+        self.version_provider = version_provider
+        self.on_snapshot = on_snapshot
+        self.log = log
+        self.snapshot = None
+        self._built_version = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='queue-snapshot', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self):
+        """通知队列或规则已变化（可在任意线程调用，多次唤醒合并为一次检查）"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                version = self.version_provider()
+                if version != self._built_version:
+                    self.snapshot = self.build()
+                    self._built_version = version
+                    if self.on_snapshot:
+                        self.on_snapshot(self.snapshot)
+            except Exception as e:
+                if self.log:
+                    self.log(f"⚠️ 生成队列快照失败: {e}")
+            # 没有变化时不轮询，等待下一次唤醒
+            self._wake.wait()
+            self._wake.clear()
@@ -0,0 +1,153 @@
+"""
+指定范围转发窗口
+
+"指定范围"过滤条件的本意是一段对话：某人发出开始标记（如"@本人"）后，
+其后续消息都转发，直到发出结束标记（如"@本人并说结束"）或超时无新消息。
+每个 (规则, 聊天, 发送者) 独立维护一个窗口状态，每条消息O(1)更新，
+状态保存到文件，程序重启后窗口继续有效。写盘与 ConfigStore 相同，由定时器线程
+延迟合并执行，监听回调中只标记状态已变化，不做磁盘IO。
+"""
+
+import threading
+import atexit
+import json
+import os
+import time
+
+
+class RangeWindowTracker:
+    """按 (规则, 聊天, 发送者) 维护的转发窗口状态机"""
+
+    # 窗口内消息只刷新最后活动时间时，延迟多久写盘（秒）
+    SAVE_INTERVAL = 5.0
+
+    def __init__(self, path='range_windows.json', timeout=600, write_delay=0.5, log=None):
+        """
+        Args:
+            path (str): 状态文件路径
+            timeout (float): 窗口内超过多少秒没有新消息自动关闭
+            write_delay (float): 窗口打开或关闭后延迟多久写盘，期间的修改合并为一次写入
+            log (Callable[[str], None], optional): 日志回调
+        """
+        self.path = path
+        self.timeout = timeout
+        self.write_delay = write_delay
+        self.log = log
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()     # 保证先取的快照先写入
+        self._windows = {}          # {key: {'opened_at': float, 'last_seen': float}}
+        self._dirty = False
+        self._write_timer = None
+        self.load()
+
+        # 程序退出时保存窗口内最后活动时间
+        atexit.register(self.flush)
+
+    def _log(self, message):
+        if self.log:
+            self.log(message)
+
+    @staticmethod
+    def _key(rule_id, chat_name, sender):
+        return f"{rule_id}\x1f{chat_name}\x1f{sender}"
+
+    def feed(self, rule_id, chat_name, sender, content, start_marker, end_marker, now=None):
+        """处理一条消息并返回它是否应被转发
+
+        结束标记先于开始标记检查（结束标记通常包含开始标记，如"@本人并说结束"）：
+        - 窗口打开时收到结束标记：关闭窗口，结束消息本身不转发
+        - 窗口关闭时同一条消息里先后出现开始和结束标记：按单条消息范围转发，不打开窗口
+        - 收到开始标记：打开（或续期）窗口，该消息转发
+        - 窗口打开期间的其他消息：转发并刷新超时
+        """
+        now = now or time.time()
+        key = self._key(rule_id, chat_name, sender)
+        with self._lock:
+            window = self._windows.get(key)
+            if window and now - window['last_seen'] > self.timeout:
+                del self._windows[key]
+                window = None
+                self._schedule_write(self.SAVE_INTERVAL)
+                self._log(f"⏰ 范围转发窗口超时关闭: {chat_name}/{sender}")
+
+            if end_marker in content:
+                if window:
+                    del self._windows[key]
+                    self._schedule_write(self.write_delay)
+                    self._log(f"🔚 范围转发窗口已关闭: {chat_name}/{sender}")
+                    return False
+                start_pos = content.find(start_marker)
+                return start_pos != -1 and content.find(end_marker, start_pos + len(start_marker)) != -1
+
+            if start_marker in content:
+                if window:
+                    window['last_seen'] = now
+                else:
+                    self._windows[key] = {'opened_at': now, 'last_seen': now}
+                    self._log(f"▶️ 范围转发窗口已打开: {chat_name}/{sender}")
+                self._schedule_write(self.write_delay)
+                return True
+
+            if window:
+                window['last_seen'] = now
+                self._schedule_write(self.SAVE_INTERVAL)
+                return True
+            return False
+
+    def is_open(self, rule_id, chat_name, sender, now=None):
+        now = now or time.time()
+        window = self._windows.get(self._key(rule_id, chat_name, sender))
+        return bool(window) and now - window['last_seen'] <= self.timeout
+
+    def load(self):
+        """从文件恢复窗口状态，丢弃已超时的窗口"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                windows = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            self._log(f"⚠️ 加载范围转发窗口状态失败: {e}")
+            return
+        now = time.time()
+        with self._lock:
+            self._windows = {
+                key: window for key, window in windows.items()
+                if now - window.get('last_seen', 0) <= self.timeout
+            }
+
+    def _schedule_write(self, delay):
+        """标记状态已变化，delay 秒后由定时器线程写盘（已有待执行的写入时合并到该次）"""
+        self._dirty = True
+        if self._write_timer is None:
+            self._write_timer = threading.Timer(delay, self.flush)
+            self._write_timer.daemon = True
+            self._write_timer.start()
+
+    def flush(self):
+        """立即写入尚未保存的状态（原子替换）"""
+        with self._write_lock:
+            with self._lock:
+                if self._write_timer is not None:
+                    self._write_timer.cancel()
+                    self._write_timer = None
+                if not self._dirty:
+                    return
+                # 顺带清理已超时的窗口，状态文件不会无限增长
+                now = time.time()
+                self._windows = {
+                    key: window for key, window in self._windows.items()
+                    if now - window['last_seen'] <= self.timeout
+                }
+                data = json.dumps(self._windows, ensure_ascii=False)
+                self._dirty = False
+
+            temp_path = f"{self.path}.tmp"
+            try:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    f.write(data)
+                os.replace(temp_path, self.path)
+            except Exception as e:
+                self._log(f"⚠️ 保存范围转发窗口状态失败: {e}")
+                with self._lock:
+                    self._schedule_write(self.SAVE_INTERVAL)
@@ -0,0 +1,217 @@
+"""
+AI回复缓存
+
+同一个问题发给同一个企业微信AI助手，得到的回复基本相同。命中缓存时直接把缓存的回复
+转发回源聊天，省掉一次发送、8~300秒的回复等待和复制。
+
+- 键：(目标联系人, 规范化后的问题)，规范化时去掉@提及、空白、全半角差异
+- 淘汰：超过TTL的条目在读取时删除，超过最大条目数时淘汰最久未使用的条目
+- 近似匹配（可选）：通过QuestionIndex的MinHash/LSH索引，Jaccard相似度达到阈值即视为命中
+- 持久化：保存到 reply_cache.json，重启后继续使用
+"""
+
+from collections import OrderedDict
+import threading
+import atexit
+import json
+import os
+import time
+
+from .question_index import QuestionIndex, normalize_question
+
+
+class ReplyCache:
+    """按目标联系人缓存AI回复（TTL + LRU）"""
+
+    # 只更新命中统计时，最短的写盘间隔（秒）
+    SAVE_INTERVAL = 30.0
+
+    def __init__(self, path='reply_cache.json', ttl=7 * 86400, max_entries=500,
+                 near_duplicate=False, threshold=0.85, min_length=4, log=None):
+        """
+        Args:
+            path (str): 缓存文件路径
+            ttl (float): 缓存有效期，单位秒
+            max_entries (int): 最多缓存条目数
+            near_duplicate (bool): 是否启用近似问题匹配
+            threshold (float): 近似匹配的Jaccard相似度阈值
+            min_length (int): 规范化后短于该长度的问题不缓存（如"好的""谢谢"）
+            log (Callable[[str], None], optional): 日志回调
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.min_length = min_length
+        self.log = log
+        self.enabled = False
+
+        self.lookups = 0
+        self.hits = 0
+        self.near_hits = 0
+        self.saved_seconds = 0.0        # 命中时按该条目原本的回复耗时累计
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # {key: entry}，按最近使用排序
+        self._index = QuestionIndex(near_duplicate, threshold)
+        self._dirty = False
+        self._last_save = 0.0
+
+        atexit.register(self.flush)
+
+    def _log(self, message):
+        if self.log:
+            self.log(message)
+
+    def configure(self, enabled=None, ttl=None, max_entries=None, near_duplicate=None, threshold=None):
+        """根据配置更新缓存参数，首次启用时从文件加载"""
+        if ttl is not None:
+            self.ttl = ttl
+        if max_entries is not None:
+            self.max_entries = max_entries
+        if (near_duplicate is not None and near_duplicate != self._index.near_duplicate) or \
+                (threshold is not None and threshold != self._index.threshold):
+            with self._lock:
+                self._index.configure(near_duplicate, threshold)
+        if enabled is not None:
+            if enabled and not self.enabled:
+                self.load()
+            self.enabled = enabled
+
+    @staticmethod
+    def _key(target, question):
+        return f"{target}\x1f{question}"
+
+    # ---------- 读写 ----------
+
+    def _remove(self, key):
+        del self._entries[key]
+        self._index.remove(key)
+
+    def get(self, target, content, now=None, count_lookup=True):
+        """查找缓存的回复
+
+        Args:
+            count_lookup (bool): 是否计入查找次数。同一条消息再次查找时传False，
+                未命中不重复计数，命中时只计入命中次数，命中率不会被低估
+
+        Returns:
+            dict: 命中时返回缓存条目（含reply、latency等），未命中返回None
+        """
+        if not self.enabled:
+            return None
+        question = normalize_question(content)
+        if len(question) < self.min_length:
+            return None
+        now = now or time.time()
+        with self._lock:
+            if count_lookup:
+                self.lookups += 1
+            key, near = self._index.find(target, question)
+            entry = self._entries.get(key) if key else None
+            if entry is None:
+                return None
+            if now - entry['created_at'] > self.ttl:
+                self._remove(key)
+                self._dirty = True
+                return None
+
+            self._entries.move_to_end(key)
+            entry['hits'] += 1
+            entry['last_hit'] = now
+            self.hits += 1
+            if near:
+                self.near_hits += 1
+            self.saved_seconds += entry.get('latency', 0.0)
+            self._dirty = True
+            if now - self._last_save >= self.SAVE_INTERVAL:
+                self._save_locked(now)
+            return dict(entry)
+
+    def put(self, target, content, reply, latency=0.0, now=None):
+        """缓存一条AI回复
+
+        Args:
+            latency (float): 这条回复实际花费的时间，命中时计入节省的时间
+        """
+        if not self.enabled or not reply:
+            return
+        question = normalize_question(content)
+        if len(question) < self.min_length:
+            return
+        now = now or time.time()
+        with self._lock:
+            key = self._key(target, question)
+            if key in self._entries:
+                self._remove(key)
+            entry = {
+                'target': target,
+                'question': question,
+                'reply': reply,
+                'latency': latency,
+                'created_at': now,
+                'hits': 0,
+                'last_hit': None,
+            }
+            self._entries[key] = entry
+            self._index.add(key, target, question)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            self._save_locked(now)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+            self._save_locked(time.time())
+
+    def get_stats(self):
+        """命中率和节省时间统计"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'near_hits': self.near_hits,
+                'hit_rate': min(1.0, self.hits / self.lookups) if self.lookups else 0.0,
+                'saved_seconds': self.saved_seconds,
+            }
+
+    # ---------- 持久化 ----------
+
+    def load(self):
+        """从文件加载缓存，丢弃已过期的条目"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            self._log(f"⚠️ 加载回复缓存失败: {e}")
+            return
+        now = time.time()
+        with self._lock:
+            self._entries = OrderedDict(
+                (self._key(entry['target'], entry['question']), entry)
+                for entry in entries
+                if now - entry.get('created_at', 0) <= self.ttl
+            )
+            self._index.clear()
+            for key, entry in self._entries.items():
+                self._index.add(key, entry['target'], entry['question'])
+
+    def flush(self):
+        with self._lock:
+            if self._dirty:
+                self._save_locked(time.time())
+
+    def _save_locked(self, now):
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                # 按最近使用顺序保存，加载后LRU顺序不变
+                json.dump(list(self._entries.values()), f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+            self._dirty = False
+            self._last_save = now
+        except Exception as e:
+            self._log(f"⚠️ 保存回复缓存失败: {e}")
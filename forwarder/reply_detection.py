@@ -0,0 +1,445 @@
+"""
+AI回复完成检测引擎
+
+所有回复完成检测都走同一个ReplyCompletionDetector：统一的首次延迟、轮询调度、
+超时与中断语义，具体"是否还在变化"的判断交给可插拔的检测策略：
+
+- uia: 读取消息列表最后一条列表项的runtimeid和Name长度，可直接得到回复文本
+- pixel: 整窗截图灰度像素完全一致
+- block_hash: 截图缩成分块均值，允许少量分块抖动（如输入框光标闪烁）
+
+每个策略单独统计采样次数、采样耗时、检测耗时、超时次数，以及判定完成后未取到回复的次数。
+"""
+
+from abc import ABC, abstractmethod
+import threading
+import time
+
+
+class StrategyUnavailableError(Exception):
+    """检测策略在当前窗口不可用，引擎会回退到下一个策略"""
+    ...
+
+
+class UIAUnavailableError(StrategyUnavailableError):
+    """UIA消息列表不可用（窗口不支持或控件已失效）"""
+    ...
+
+
+class UIAMessageListProbe:
+    """读取企业微信聊天窗口消息列表最后一条消息的结构信息"""
+
+    def __init__(self, hwnd):
+        self.hwnd = hwnd
+        self.msgbox = None
+        # runtimeid -> 是否为对方发来的消息，避免每次轮询都重新判断
+        self._incoming_cache = {}
+
+    def attach(self, wait=0.5):
+        """定位消息列表控件，成功返回True"""
+        try:
+            from wxauto import uiautomation as uia
+            from wxauto.languages import WECHAT_CHAT_BOX
+            from wxauto.param import WxParam
+
+            list_name = WECHAT_CHAT_BOX['消息'].get(WxParam.LANGUAGE) or '消息'
+            window_control = uia.ControlFromHandle(self.hwnd)
+            if window_control is None:
+                return False
+            msgbox = window_control.ListControl(Name=list_name)
+            if not msgbox.Exists(wait):
+                return False
+            self.msgbox = msgbox
+            return True
+        except Exception:
+            self.msgbox = None
+            return False
+
+    def _is_incoming(self, item):
+        """与parse_msg_attr相同的判断：头像在消息左侧即为对方消息"""
+        runtimeid = item.runtimeid
+        if runtimeid not in self._incoming_cache:
+            incoming = False
+            head_control = item.ButtonControl(searchDepth=2)
+            if head_control.Exists(0):
+                msg_rect = item.BoundingRectangle
+                mid = (msg_rect.left + msg_rect.right) / 2
+                incoming = head_control.BoundingRectangle.left < mid
+            self._incoming_cache[runtimeid] = incoming
+        return self._incoming_cache[runtimeid]
+
+    def sample(self):
+        """采样最后一条消息
+
+        Returns:
+            tuple: (runtimeid, Name长度, Name, 是否对方消息)，列表为空时返回None
+        """
+        if self.msgbox is None:
+            raise UIAUnavailableError('消息列表未定位')
+        try:
+            items = [
+                i for i in self.msgbox.GetChildren()
+                if i.ControlTypeName == 'ListItemControl'
+            ]
+            if not items:
+                return None
+            last = items[-1]
+            name = last.Name or ''
+            return (last.runtimeid, len(name), name, self._is_incoming(last))
+        except Exception as e:
+            raise UIAUnavailableError(f'读取消息列表失败: {e}')
+
+    def last_incoming_text(self):
+        """最后一条对方消息的文本
+
+        与ChatBox.get_msgs相同，遍历消息列表的ListItemControl，跳过时间和系统消息；
+        最后一条消息是自己发出的（回复尚未出现）时返回None
+        """
+        if self.msgbox is None:
+            raise UIAUnavailableError('消息列表未定位')
+        try:
+            items = [
+                i for i in self.msgbox.GetChildren()
+                if i.ControlTypeName == 'ListItemControl'
+            ]
+            for item in reversed(items):
+                if self._is_incoming(item):
+                    return item.Name or None
+                if item.ButtonControl(searchDepth=2).Exists(0):
+                    return None
+            return None
+        except Exception as e:
+            raise UIAUnavailableError(f'读取消息列表失败: {e}')
+
+
+def extract_last_reply(hwnd, wait=0.2):
+    """通过UIA直接读取窗口中最后一条对方消息的文本
+
+    Returns:
+        tuple: (回复文本, 耗时毫秒)，UIA不可用或没有回复时文本为None
+    """
+    t0 = time.perf_counter()
+    text = None
+    probe = UIAMessageListProbe(hwnd)
+    if probe.attach(wait):
+        try:
+            text = probe.last_incoming_text()
+        except UIAUnavailableError:
+            text = None
+    return text, (time.perf_counter() - t0) * 1000
+
+
+class DetectionStrategy(ABC):
+    """回复完成检测策略基类"""
+    name: str = 'base'
+    poll_interval: float = 5.0     # 轮询间隔，单位秒
+    stable_polls: int = 1          # 连续多少次"未变化"视为回复完成
+    on_frame = None                # 截图类策略每次截图后的回调（调试截图记录）
+
+    def prepare(self, hwnd) -> bool:
+        """绑定窗口，返回策略是否可用"""
+        self.hwnd = hwnd
+        return True
+
+    @abstractmethod
+    def sample(self):
+        """采样一次，返回观测值；本次采样失败返回None"""
+        ...
+
+    @abstractmethod
+    def is_stable(self, previous, current) -> bool:
+        """两次观测之间是否没有变化"""
+        ...
+
+    def reply_text(self, observation):
+        """从最终观测中提取回复文本，不支持时返回None"""
+        return None
+
+
+class UIAStructureStrategy(DetectionStrategy):
+    """UIA消息列表结构检测"""
+    name = 'uia'
+    poll_interval = 1.0
+    stable_polls = 2
+
+    def prepare(self, hwnd):
+        self.hwnd = hwnd
+        self.probe = UIAMessageListProbe(hwnd)
+        return self.probe.attach()
+
+    def sample(self):
+        return self.probe.sample()
+
+    def is_stable(self, previous, current):
+        # 最后一条仍是自己发出的消息时，回复尚未开始
+        if previous is None or current is None or not current[3]:
+            return False
+        return previous[:2] == current[:2]
+
+    def reply_text(self, observation):
+        return observation[2] if observation else None
+
+
+class PixelDiffStrategy(DetectionStrategy):
+    """整窗截图像素完全一致检测"""
+    name = 'pixel'
+    poll_interval = 5.0
+    stable_polls = 1
+
+    def __init__(self, capture):
+        self.capture = capture      # Callable[[hwnd], PIL.Image.Image]
+
+    def sample(self):
+        image = self.capture(self.hwnd)
+        if image is not None and self.on_frame is not None:
+            self.on_frame(image)
+        return image
+
+    def is_stable(self, previous, current):
+        return images_identical(previous, current)
+
+
+class BlockHashStrategy(DetectionStrategy):
+    """分块均值检测：把截图缩成 cols×rows 的灰度块，变化块数不超过容差即视为稳定"""
+    name = 'block_hash'
+    poll_interval = 3.0
+    stable_polls = 1
+
+    def __init__(self, capture, cols=32, rows=48, pixel_tolerance=8, block_tolerance=2):
+        self.capture = capture
+        self.cols = cols
+        self.rows = rows
+        self.pixel_tolerance = pixel_tolerance      # 单块灰度均值允许的差值
+        self.block_tolerance = block_tolerance      # 允许变化的块数
+
+    def sample(self):
+        image = self.capture(self.hwnd)
+        if image is None:
+            return None
+        if self.on_frame is not None:
+            self.on_frame(image)
+        return block_signature(image, self.cols, self.rows)
+
+    def is_stable(self, previous, current):
+        if previous is None or current is None or len(previous) != len(current):
+            return False
+        changed = 0
+        for a, b in zip(previous, current):
+            if abs(a - b) > self.pixel_tolerance:
+                changed += 1
+                if changed > self.block_tolerance:
+                    return False
+        return True
+
+
+def images_identical(img1, img2):
+    """两张截图灰度像素是否完全相同"""
+    if img1 is None or img2 is None or img1.size != img2.size:
+        return False
+    return img1.convert('L').tobytes() == img2.convert('L').tobytes()
+
+
+def block_signature(image, cols=32, rows=48):
+    """截图的分块灰度均值签名"""
+    from PIL import Image
+    return image.convert('L').resize((cols, rows), Image.BOX).tobytes()
+
+
+class StrategyStats:
+    """单个检测策略的延迟与准确性计数"""
+
+    def __init__(self):
+        self.runs = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.stopped = 0
+        self.unavailable = 0
+        self.polls = 0
+        self.sample_seconds = 0.0       # 采样累计耗时
+        self.detect_seconds = 0.0       # 成功检测累计耗时（不含首次延迟）
+        self.confirmed = 0              # 完成后成功取得回复
+        self.empty_replies = 0          # 完成后未取到回复（回复被截断无法从这里发现，见离线回放基准测试）
+
+    def to_dict(self):
+        return {
+            'runs': self.runs,
+            'completed': self.completed,
+            'timeouts': self.timeouts,
+            'stopped': self.stopped,
+            'unavailable': self.unavailable,
+            'polls': self.polls,
+            'avg_sample_ms': self.sample_seconds / self.polls * 1000 if self.polls else 0.0,
+            'avg_detect_seconds': self.detect_seconds / self.completed if self.completed else 0.0,
+            'confirmed': self.confirmed,
+            'empty_replies': self.empty_replies,
+        }
+
+
+class DetectionResult:
+    """一次回复检测的结果"""
+
+    def __init__(self, completed, strategy=None, text=None, elapsed=0.0, polls=0, reason=''):
+        self.completed = completed      # 是否检测到回复完成
+        self.strategy = strategy        # 最终使用的策略名
+        self.text = text                # 策略直接得到的回复文本（uia）
+        self.elapsed = elapsed          # 从开始轮询到结束的耗时
+        self.polls = polls
+        self.reason = reason            # completed / timeout / stopped / unavailable
+
+    def __bool__(self):
+        return self.completed
+
+    def __repr__(self):
+        return f"<DetectionResult({self.reason}, strategy={self.strategy}, polls={self.polls}, elapsed={self.elapsed:.1f}s)>"
+
+
+class ReplyCompletionDetector:
+    """回复完成检测引擎"""
+
+    DEFAULT_STRATEGIES = ('uia', 'pixel')
+
+    def __init__(self, strategy_factories, log=None, clock=time.time, sleep=time.sleep):
+        """
+        Args:
+            strategy_factories (Dict[str, Callable[[], DetectionStrategy]]): 策略名 -> 策略工厂
+            log (Callable[[str], None], optional): 日志回调
+            clock (Callable[[], float]): 时钟，离线回放时替换为虚拟时钟
+            sleep (Callable[[float], None]): 睡眠函数，离线回放时替换为推进虚拟时钟
+        """
+        self.strategy_factories = dict(strategy_factories)
+        self.log = log
+        self.clock = clock
+        self.sleep = sleep
+        self.stats = {name: StrategyStats() for name in self.strategy_factories}
+        self._lock = threading.Lock()
+
+    def _log(self, message, log=None):
+        log = log or self.log
+        if log:
+            log(message)
+
+    def detect(self, hwnd, strategies=None, timeout=300, initial_delay=0,
+               should_continue=None, on_frame=None, log=None):
+        """按策略优先级检测回复完成，前一个策略不可用时使用剩余时间回退到下一个
+
+        Args:
+            hwnd (int): 企业微信聊天窗口句柄
+            strategies (List[str], optional): 策略优先级列表，默认 uia -> pixel
+            timeout (float): 总超时时间（含首次延迟），单位秒
+            initial_delay (float): 开始检测前的等待时间，单位秒
+            should_continue (Callable[[], bool], optional): 返回False时中断检测
+            on_frame (Callable[[PIL.Image.Image], None], optional): 截图类策略每次截图后的回调
+            log (Callable[[str], None], optional): 本次检测使用的日志回调
+
+        Returns:
+            DetectionResult: 检测结果
+        """
+        deadline = self.clock() + timeout
+        strategies = [s for s in (strategies or self.DEFAULT_STRATEGIES) if s in self.strategy_factories]
+
+        if initial_delay > 0:
+            self._log(f"⏰ 等待 {initial_delay} 秒后开始检测...", log)
+            if not self._sleep_until(min(deadline, self.clock() + initial_delay), should_continue):
+                return DetectionResult(False, reason='stopped')
+
+        for name in strategies:
+            strategy = self.strategy_factories[name]()
+            strategy.on_frame = on_frame
+            stats = self.stats[name]
+            with self._lock:
+                stats.runs += 1
+            try:
+                if not strategy.prepare(hwnd):
+                    raise StrategyUnavailableError('初始化失败')
+                return self._run(strategy, stats, deadline, should_continue, log)
+            except StrategyUnavailableError as e:
+                with self._lock:
+                    stats.unavailable += 1
+                self._log(f"⚠️ 检测策略[{name}]不可用({e})，尝试下一个策略", log)
+
+        return DetectionResult(False, reason='unavailable')
+
+    def _run(self, strategy, stats, deadline, should_continue, log):
+        name = strategy.name
+        self._log(f"🔍 使用检测策略[{name}]，轮询间隔{strategy.poll_interval}秒", log)
+        start_time = self.clock()
+        previous = None
+        stable_count = 0
+        polls = 0
+
+        while True:
+            if should_continue is not None and not should_continue():
+                with self._lock:
+                    stats.stopped += 1
+                self._log(f"🛑 检测已中断[{name}]", log)
+                return DetectionResult(False, name, elapsed=self.clock() - start_time, polls=polls, reason='stopped')
+
+            t0 = time.perf_counter()
+            current = strategy.sample()
+            sample_cost = time.perf_counter() - t0
+            polls += 1
+            with self._lock:
+                stats.polls += 1
+                stats.sample_seconds += sample_cost
+
+            if current is None:
+                self._log(f"❌ 第{polls}次采样失败[{name}]", log)
+            else:
+                changed = previous is not None and not strategy.is_stable(previous, current)
+                stable_count = 0 if previous is None or changed else stable_count + 1
+                previous = current
+
+                elapsed = self.clock() - start_time
+                if stable_count >= strategy.stable_polls:
+                    with self._lock:
+                        stats.completed += 1
+                        stats.detect_seconds += elapsed
+                    self._log(f"✅ 第{polls}次采样未变化[{name}]，AI回复完成（用时{elapsed:.1f}秒）", log)
+                    return DetectionResult(True, name, strategy.reply_text(current), elapsed, polls, 'completed')
+                if changed:
+                    self._log(f"📸 第{polls}次采样有变化[{name}]，继续监控...（已用时{elapsed:.1f}秒）", log)
+
+            if self.clock() >= deadline:
+                with self._lock:
+                    stats.timeouts += 1
+                self._log(f"⏰ AI回复检测超时[{name}]（共采样{polls}次）", log)
+                return DetectionResult(False, name, elapsed=self.clock() - start_time, polls=polls, reason='timeout')
+
+            if not self._sleep_until(min(deadline, self.clock() + strategy.poll_interval), should_continue):
+                continue
+
+    def _sleep_until(self, until, should_continue=None, step=0.5):
+        """分段睡眠，期间被中断返回False"""
+        while True:
+            remaining = until - self.clock()
+            if remaining <= 0:
+                return True
+            if should_continue is not None and not should_continue():
+                return False
+            self.sleep(min(step, remaining))
+
+    def report_outcome(self, strategy, success):
+        """上报检测完成后是否取得了回复（非空）"""
+        if strategy not in self.stats:
+            return
+        with self._lock:
+            if success:
+                self.stats[strategy].confirmed += 1
+            else:
+                self.stats[strategy].empty_replies += 1
+
+    def get_stats(self):
+        """各策略统计快照"""
+        with self._lock:
+            return {name: stats.to_dict() for name, stats in self.stats.items()}
+
+    def format_stats(self, strategy):
+        """单个策略统计的单行描述"""
+        stats = self.get_stats().get(strategy)
+        if not stats:
+            return ''
+        return (
+            f"📊 检测策略[{strategy}] 完成{stats['completed']}/超时{stats['timeouts']}/不可用{stats['unavailable']}，"
+            f"平均检测{stats['avg_detect_seconds']:.1f}秒，平均采样{stats['avg_sample_ms']:.0f}毫秒，"
+            f"未取到回复{stats['empty_replies']}/取得回复{stats['confirmed']}"
+        )
@@ -0,0 +1,146 @@
+"""
+转发规则索引
+
+把 forwarding_rules 编译为 {(来源类型, 联系人): [已编译规则]} 的索引，
+联系人为空的规则放入通配桶 (来源类型, '')。过滤条件预先编译为可调用对象，
+匹配一条消息只需遍历该聊天对应的规则，不再逐条检查全部规则。
+规则变化时整体重建索引并替换引用，匹配线程不需要加锁。
+"""
+
+import heapq
+
+from .message_filter import compile_message_filter
+
+
+WILDCARD = ''
+
+
+def compile_filter(source_config, nickname_provider=None):
+    """把规则的过滤条件编译为 content -> bool 的可调用对象
+
+    Args:
+        source_config (dict): 规则的source配置
+        nickname_provider (Callable[[], str], optional): 获取当前微信昵称，用于@本人过滤
+    """
+    filter_type = source_config.get('filter_type', 'all')
+
+    if filter_type == 'at_me':
+        def match_at_me(content):
+            nickname = nickname_provider() if nickname_provider else None
+            return '@' in content and bool(nickname) and nickname in content
+        return match_at_me
+
+    if filter_type == 'range':
+        start_keyword = source_config.get('range_start', '')
+        end_keyword = source_config.get('range_end', '')
+        if start_keyword and end_keyword:
+            start_len = len(start_keyword)
+
+            def match_range(content):
+                start_pos = content.find(start_keyword)
+                return start_pos != -1 and content.find(end_keyword, start_pos + start_len) != -1
+            return match_range
+        keyword = start_keyword or end_keyword
+        if keyword:
+            return lambda content: keyword in content
+        return lambda content: False
+
+    # all 及未知过滤类型都视为全部匹配
+    return lambda content: True
+
+
+class CompiledRule:
+    """预处理后的规则"""
+
+    __slots__ = ('position', 'rule', 'id', 'name', 'matches')
+
+    def __init__(self, position, rule, nickname_provider=None, range_tracker=None):
+        """
+        Args:
+            range_tracker (RangeWindowTracker, optional): 提供时"指定范围"按跨消息的窗口处理
+
+        Raises:
+            ValueError: 规则的 filters 配置无效
+        """
+        self.position = position        # 在 forwarding_rules 中的位置，保证匹配结果顺序不变
+        self.rule = rule
+        self.id = rule.get('id')
+        self.name = rule.get('name', '')
+
+        source = rule.get('source', {})
+        message_filter = compile_message_filter(source.get('filters'))
+        start_marker = source.get('range_start', '')
+        end_marker = source.get('range_end', '')
+
+        if range_tracker is not None and source.get('filter_type') == 'range' and start_marker and end_marker:
+            rule_id = self.id
+
+            def content_filter(msg, chat_name):
+                # 每条消息都要送入状态机，开始/结束标记才能生效
+                return range_tracker.feed(
+                    rule_id, chat_name, getattr(msg, 'sender', ''), msg.content, start_marker, end_marker
+                )
+        else:
+            content_matches = compile_filter(source, nickname_provider)
+
+            def content_filter(msg, chat_name):
+                return content_matches(msg.content)
+
+        if message_filter is None:
+            self.matches = content_filter
+        else:
+            self.matches = lambda msg, chat_name: content_filter(msg, chat_name) and message_filter(msg)
+
+    def __lt__(self, other):
+        return self.position < other.position
+
+
+class RuleIndex:
+    """按来源类型和联系人索引的转发规则"""
+
+    def __init__(self, rules=(), nickname_provider=None, range_tracker=None):
+        self.nickname_provider = nickname_provider
+        self.range_tracker = range_tracker
+        self.rule_count = 0
+        self.errors = []        # [(规则名称, 错误信息)]，配置无效的规则不参与匹配
+        self._buckets = {}      # {(source_type, contact): [CompiledRule]}
+        self._merged = {}       # {(source_type, chat_name): [CompiledRule]}，具体桶与通配桶合并结果的缓存
+        self._build(rules)
+
+    def _build(self, rules):
+        for position, rule in enumerate(rules):
+            if not rule.get('enabled', True):
+                continue
+            source = rule.get('source', {})
+            key = (source.get('type'), source.get('contact') or WILDCARD)
+            try:
+                compiled = CompiledRule(position, rule, self.nickname_provider, self.range_tracker)
+            except ValueError as e:
+                self.errors.append((rule.get('name', ''), str(e)))
+                continue
+            self._buckets.setdefault(key, []).append(compiled)
+            self.rule_count += 1
+
+    def candidates(self, chat_name, source_type):
+        """该聊天可能匹配的规则（按原始顺序）"""
+        key = (source_type, chat_name)
+        merged = self._merged.get(key)
+        if merged is None:
+            exact = self._buckets.get(key, []) if chat_name != WILDCARD else []
+            wildcard = self._buckets.get((source_type, WILDCARD), [])
+            merged = list(heapq.merge(exact, wildcard)) if exact and wildcard else (exact or wildcard)
+            # 聊天名称来自监听列表，数量有限，直接缓存
+            self._merged[key] = merged
+        return merged
+
+    def match(self, msg, chat_name, source_type):
+        """返回匹配该消息的规则字典列表
+
+        Args:
+            msg: 消息对象，需要content属性，过滤条件用到时还会读取sender和type
+        """
+        return [
+            compiled.rule
+            for compiled in self.candidates(chat_name, source_type)
+            if compiled.matches(msg, chat_name)
+        ]
@@ -0,0 +1,203 @@
+"""
+消息处理跟踪
+
+一条消息会经过监听线程（入队）、消息队列、处理线程（发送、等待回复、转发）以及异步检测线程。
+消息入队时创建跟踪ID并保存在消息项中，各线程处理该消息时用 activate() 设为当前跟踪，
+其间的界面操作（查找窗口、激活、粘贴、截图、复制等）用 span() 计时。
+
+消息处理结束后，该消息的全部事件追加写入 traces/trace_YYYY-MM-DD.json（Chrome trace-event
+格式），可直接用 chrome://tracing 或 https://ui.perfetto.dev 打开：
+- 每条消息一条独立的时间线（从入队到完成，其中包含排队等待）
+- 每个线程一条时间线，显示该线程上各项操作的耗时，点击可看到所属的跟踪ID和消息ID
+
+未开启时 span() 返回共享的空上下文，几乎没有开销。
+"""
+
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+
+
+_NULL_CONTEXT = nullcontext()
+
+
+class Tracer:
+    """按消息记录跨线程的处理事件"""
+
+    def __init__(self, directory='traces', enabled=False, max_active=500, max_events=1000):
+        """
+        Args:
+            directory (str): 跟踪文件目录
+            enabled (bool): 是否记录
+            max_active (int): 同时记录的未结束跟踪数上限，超出时丢弃最早的
+            max_events (int): 单个跟踪的事件数上限
+        """
+        self.directory = directory
+        self.enabled = enabled
+        self.max_active = max_active
+        self.max_events = max_events
+        self.dropped = 0
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._active = {}           # {跟踪ID: [事件]}
+        self._ids = itertools.count(1)
+        self._pid = os.getpid()
+        self._epoch = time.perf_counter()
+        self._file_day = None
+        self._thread_names = {}     # {线程ID: 线程名}
+        self._named_threads = set() # 当前文件中已写入线程名的线程
+
+    def configure(self, enabled=None, directory=None):
+        with self._lock:
+            if enabled is not None:
+                self.enabled = enabled
+            if directory is not None and directory != self.directory:
+                self.directory = directory
+                self._file_day = None
+
+    # ---------- 跟踪 ----------
+
+    def start_trace(self, message_item, name=None):
+        """为新入队的消息创建跟踪，跟踪ID保存在消息项的 trace_id 中"""
+        if not self.enabled:
+            return None
+        trace_id = f"{int(time.time())}-{next(self._ids)}"
+        message_item['trace_id'] = trace_id
+        rule = message_item.get('matched_rule') or {}
+        args = {
+            'message_id': message_item.get('id'),
+            'rule': rule.get('id'),
+            'target': rule.get('target', {}).get('contact'),
+            'chat': message_item.get('chat_name'),
+            'sender': message_item.get('sender'),
+        }
+        ts = self._now()
+        title = name or f"{message_item.get('chat_name', '')}: {message_item.get('content', '')[:20]}"
+        events = [
+            self._async('b', 'message', title, trace_id, ts, args),
+            self._async('b', 'message', 'queue_wait', trace_id, ts),
+        ]
+        with self._lock:
+            if len(self._active) >= self.max_active:
+                self._active.pop(next(iter(self._active)))
+                self.dropped += 1
+            self._active[trace_id] = [title] + events
+        return trace_id
+
+    def mark_dequeued(self, message_item):
+        """消息出队开始处理，结束排队等待阶段"""
+        trace_id = message_item.get('trace_id')
+        if trace_id:
+            self._add(trace_id, self._async('e', 'message', 'queue_wait', trace_id, self._now()))
+
+    def end_trace(self, message_item, status):
+        """消息处理结束，把该跟踪的事件写入文件（同一跟踪只结束一次）"""
+        trace_id = message_item.get('trace_id')
+        if not trace_id:
+            return
+        with self._lock:
+            events = self._active.pop(trace_id, None)
+        if events is None:
+            return
+        title = events.pop(0)
+        if not any(event['ph'] == 'e' and event['name'] == 'queue_wait' for event in events):
+            # 未经处理线程处理就结束（合并到其他提问、被删除等）
+            events.append(self._async('e', 'message', 'queue_wait', trace_id, self._now()))
+        events.append(self._async('e', 'message', title, trace_id, self._now(), {'status': status}))
+        try:
+            self._write(events)
+        except Exception as e:
+            print(f"写入跟踪文件失败: {e}")
+
+    # ---------- 线程上下文 ----------
+
+    def current(self):
+        """当前线程正在处理的跟踪ID"""
+        return getattr(self._local, 'trace_id', None)
+
+    @contextmanager
+    def activate(self, trace_id):
+        """在当前线程中把 trace_id 设为当前跟踪（可传入消息项）"""
+        if isinstance(trace_id, dict):
+            trace_id = trace_id.get('trace_id')
+        previous = self.current()
+        self._local.trace_id = trace_id
+        try:
+            yield trace_id
+        finally:
+            self._local.trace_id = previous
+
+    def span(self, name, **args):
+        """对当前跟踪中的一项操作计时（没有当前跟踪或未开启时不记录）"""
+        trace_id = self.current() if self.enabled else None
+        if not trace_id:
+            return _NULL_CONTEXT
+        return self._span(trace_id, name, args)
+
+    @contextmanager
+    def _span(self, trace_id, name, args):
+        start = self._now()
+        try:
+            yield
+        finally:
+            args['trace_id'] = trace_id
+            thread = threading.current_thread()
+            self._thread_names[thread.ident] = thread.name
+            self._add(trace_id, {
+                'name': name, 'cat': 'ui', 'ph': 'X', 'ts': start, 'dur': self._now() - start,
+                'pid': self._pid, 'tid': thread.ident, 'args': args,
+            })
+
+    def traced(self, name):
+        """装饰器：函数的每次调用作为当前跟踪中的一项操作计时"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # ---------- 内部 ----------
+
+    def _now(self):
+        return (time.perf_counter() - self._epoch) * 1e6
+
+    def _async(self, phase, category, name, trace_id, ts, args=None):
+        event = {'name': name, 'cat': category, 'ph': phase, 'id': trace_id, 'ts': ts, 'pid': self._pid, 'tid': 0}
+        if args:
+            event['args'] = args
+        return event
+
+    def _add(self, trace_id, event):
+        with self._lock:
+            events = self._active.get(trace_id)
+            if events is not None and len(events) <= self.max_events:
+                events.append(event)
+
+    def _write(self, events):
+        """追加到当天的跟踪文件（JSON数组格式，未闭合的数组也可以被跟踪查看器直接读取）"""
+        day = datetime.now().strftime('%Y-%m-%d')
+        path = os.path.join(self.directory, f"trace_{day}.json")
+        with self._lock:
+            prefix = ''
+            if self._file_day != day or not os.path.exists(path):
+                os.makedirs(self.directory, exist_ok=True)
+                self._file_day = day
+                self._named_threads.clear()
+                if not os.path.exists(path):
+                    prefix = '[\n'
+            # 每个文件中为出现的线程写一次线程名
+            for tid in {event['tid'] for event in events if event['ph'] == 'X'} - self._named_threads:
+                self._named_threads.add(tid)
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': tid,
+                               'args': {'name': self._thread_names.get(tid, str(tid))}})
+            data = prefix + ''.join(json.dumps(event, ensure_ascii=False) + ',\n' for event in events)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(data)
@@ -1,6 +1,9 @@
 from wxauto.param import WxParam
 
 import logging
+import logging.handlers
+import atexit
+import queue
 import colorama
 from pathlib import Path
 from datetime import datetime
@@ -29,11 +32,20 @@ class ColoredFormatter(logging.Formatter):
         return f"{LOG_COLORS[levelname]}{message}{colorama.Style.RESET_ALL}"
 
 class WxautoLogger:
+    """wxauto日志
+
+    - 调用方只生成日志记录（级别未启用时直接返回，不格式化参数），控制台和文件的写入由
+      QueueListener 后台线程完成，不占用监听和自动化线程
+    - 支持 %-style 参数延迟格式化：wxlog.debug('content: %s, length: %s', content, length)
+    - 频繁调用处如需构造昂贵的参数，可先用 wxlog.isEnabledFor(logging.DEBUG) 判断
+    - 控制台按 set_debug 设置的级别输出；启用文件日志时文件始终记录DEBUG日志
+    """
     name: str = 'wxauto'
 
     def __init__(self):
+        self.file_handler = None  # 先不创建文件处理器，第一次输出日志时按WxParam.ENABLE_FILE_LOGGER创建
+        self._file_logger_checked = False  # 文件处理器已创建后为True，不再检查
         self.logger = self.setup_logger()
-        self.file_handler = None  # 先不创建文件处理器
         self.set_debug(False)
 
     def setup_logger(self) -> logging.Logger:
@@ -52,6 +64,7 @@ class WxautoLogger:
 
         # 清除现有处理器
         root_logger.handlers.clear()
+        self.log_queue = queue.SimpleQueue()
 
         # 格式
         fmt = '%(asctime)s [%(name)s] [%(levelname)s] [%(filename)s:%(lineno)d]  %(message)s'
@@ -65,7 +78,12 @@ class WxautoLogger:
         self.console_handler.setFormatter(console_formatter)
         self.console_handler.setLevel(logging.DEBUG)
 
-        root_logger.addHandler(self.console_handler)
+        # 根记录器只把日志放入队列，由后台线程写入各处理器
+        root_logger.addHandler(logging.handlers.QueueHandler(self.log_queue))
+        self.listener = logging.handlers.QueueListener(
+            self.log_queue, self.console_handler, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.listener.stop)
 
         return logging.getLogger(self.name)
 
@@ -88,41 +106,64 @@ class WxautoLogger:
             datefmt="%Y-%m-%d %H:%M:%S"
         )
         self.file_handler.setFormatter(file_formatter)
+        # 文件始终记录DEBUG日志（监听和回调异常的堆栈只以DEBUG级别记录）
         self.file_handler.setLevel(logging.DEBUG)
 
-        # 将文件处理器添加到日志记录器
-        logging.getLogger().addHandler(self.file_handler)
+        # 文件处理器同样由后台线程写入
+        self.listener.handlers = self.listener.handlers + (self.file_handler,)
+        self._update_level()
 
     def set_debug(self, debug=False):
-        """动态设置日志级别"""
-        if debug:
-            self.console_handler.setLevel(logging.DEBUG)
-        else:
-            self.console_handler.setLevel(logging.INFO)
+        """动态设置控制台日志级别（文件始终记录DEBUG日志）"""
+        self.console_handler.setLevel(logging.DEBUG if debug else logging.INFO)
+        self._update_level()
 
-    def _ensure_file_logger(self):
-        """确保文件日志处理器被初始化"""
-        if WxParam.ENABLE_FILE_LOGGER and self.file_handler is None:
-            self.setup_file_logger()
+    def _update_level(self):
+        """记录器级别取控制台和文件中较低的级别，两者都不输出的日志在调用处直接丢弃"""
+        level = self.console_handler.level
+        if WxParam.ENABLE_FILE_LOGGER or self.file_handler is not None:
+            level = min(level, logging.DEBUG)
+        self.logger.setLevel(level)
 
-    def debug(self, msg: str, stacklevel=2, *args, **kwargs):
-        self._ensure_file_logger()  # 确保文件日志初始化
-        self.logger.debug(msg, *args, stacklevel=stacklevel, **kwargs)
+    def isEnabledFor(self, level) -> bool:
+        """该级别的日志是否会被输出（控制台或文件）"""
+        return self.logger.isEnabledFor(level)
 
-    def info(self, msg: str, stacklevel=2, *args, **kwargs):
-        self._ensure_file_logger()  # 确保文件日志初始化
-        self.logger.info(msg, *args, stacklevel=stacklevel, **kwargs)
+    def _ensure_file_logger(self):
+        """确保文件日志处理器被初始化
 
-    def warning(self, msg: str, stacklevel=2, *args, **kwargs):
-        self._ensure_file_logger()  # 确保文件日志初始化
+        创建后不再检查；WxParam.ENABLE_FILE_LOGGER 为False时每次输出日志都重新检查，
+        之后再开启文件日志也能生效
+        """
+        if WxParam.ENABLE_FILE_LOGGER and self.file_handler is None:
+            self.setup_file_logger()
+        self._file_logger_checked = self.file_handler is not None
+
+    def debug(self, msg: str, *args, stacklevel=2, **kwargs):
+        if not self._file_logger_checked:
+            self._ensure_file_logger()
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(msg, *args, stacklevel=stacklevel, **kwargs)
+
+    def info(self, msg: str, *args, stacklevel=2, **kwargs):
+        if not self._file_logger_checked:
+            self._ensure_file_logger()
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(msg, *args, stacklevel=stacklevel, **kwargs)
+
+    def warning(self, msg: str, *args, stacklevel=2, **kwargs):
+        if not self._file_logger_checked:
+            self._ensure_file_logger()
         self.logger.warning(msg, *args, stacklevel=stacklevel, **kwargs)
 
-    def error(self, msg: str, stacklevel=2, *args, **kwargs):
-        self._ensure_file_logger()  # 确保文件日志初始化
+    def error(self, msg: str, *args, stacklevel=2, **kwargs):
+        if not self._file_logger_checked:
+            self._ensure_file_logger()
         self.logger.error(msg, *args, stacklevel=stacklevel, **kwargs)
 
-    def critical(self, msg: str, stacklevel=2, *args, **kwargs):
-        self._ensure_file_logger()  # 确保文件日志初始化
+    def critical(self, msg: str, *args, stacklevel=2, **kwargs):
+        if not self._file_logger_checked:
+            self._ensure_file_logger()
         self.logger.critical(msg, *args, stacklevel=stacklevel, **kwargs)
 
 wxlog = WxautoLogger()
\ No newline at end of file
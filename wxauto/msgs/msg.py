@@ -76,7 +76,7 @@ def parse_msg_type(
     ):
     for length, _ in enumerate(uia.WalkControl(control)):length += 1
     content = control.Name
-    wxlog.debug(f'content: {content}, length: {length}')
+    wxlog.debug('content: %s, length: %s', content, length)
 
     if attr == 'Friend':
         msgtype = friendmsg
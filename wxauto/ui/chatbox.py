@@ -280,7 +280,7 @@ class ChatBox(BaseUISubWnd):
             if msg.content == last_msg
         ]
         if len(matches) >= n:
-            wxlog.debug(f'匹配到基准消息：{last_msg}')
+            wxlog.debug('匹配到基准消息：%s', last_msg)
         else:
             split_last_msg = last_msg.split('：')
             nickname = split_last_msg[0]
@@ -291,9 +291,9 @@ class ChatBox(BaseUISubWnd):
                 and msg.sender_remark == nickname
             ]
             if len(matches) >= n:
-                wxlog.debug(f'匹配到基准消息：<{nickname}> {content}')
+                wxlog.debug('匹配到基准消息：<%s> %s', nickname, content)
             else:
-                wxlog.debug(f"未匹配到基准消息，以最后一条消息为基准：{msgs[-1].content}")
+                wxlog.debug("未匹配到基准消息，以最后一条消息为基准：%s", msgs[-1].content)
                 matches = [
                     i for i, msg in reversed(list(enumerate(msgs))) 
                     if msg.attr in ('self', 'friend')
@@ -302,7 +302,7 @@ class ChatBox(BaseUISubWnd):
             index = matches[n - 1]
             return msgs[index:]
         except IndexError:
-            wxlog.debug(f"未匹配到第{n}条消息，返回空列表")
+            wxlog.debug("未匹配到第%s条消息，返回空列表", n)
             return []
     
     def get_next_new_msgs(self, count=None, last_msg=None):
@@ -344,7 +344,7 @@ class ChatBox(BaseUISubWnd):
             # ), None)
 
             # if index is not None:
-            wxlog.debug(f'获取{count}条新消息，基准消息内容为：{last_msg}')
+            wxlog.debug('获取%s条新消息，基准消息内容为：%s', count, last_msg)
             return self._get_tail_after_nth_match(msgs, last_msg, count)
                 
     def get_group_members(self):
@@ -68,7 +68,7 @@ class WeCom(WeComChat, Listener):
             chat, callback = temp_listen.get(who, (None, None))
             try:
                 if chat is None or not chat.core.exists():
-                    wxlog.debug(f"企业微信窗口 {who} 已关闭，移除监听")
+                    wxlog.debug("企业微信窗口 %s 已关闭，移除监听", who)
                     self.RemoveListenChat(who, close_window=False)
                     continue
             except:
@@ -76,7 +76,7 @@ class WeCom(WeComChat, Listener):
             with self._lock:
                 msgs = chat.GetNewMessage()
                 for msg in msgs:
-                    wxlog.debug(f"[企业微信 {msg.attr} {msg.type}]获取到新消息：{who} - {msg.content}")
+                    wxlog.debug("[企业微信 %s %s]获取到新消息：%s - %s", msg.attr, msg.type, who, msg.content)
                     chat.Show()
                     self._safe_callback(callback, msg, chat)
 
@@ -101,6 +101,28 @@ class WeCom(WeComChat, Listener):
         self.listen[name] = (chat, callback)
         return chat
 
+    def RemoveListenChat(
+            self,
+            nickname: str,
+            close_window: bool = True
+        ) -> WxResponse:
+        """移除监听聊天
+
+        Args:
+            nickname (str): 要移除的监听聊天对象
+            close_window (bool, optional): 是否关闭聊天窗口. Defaults to True.
+
+        Returns:
+            WxResponse: 执行结果
+        """
+        if nickname not in self.listen:
+            return WxResponse.failure('未找到监听对象')
+        chat, _ = self.listen[nickname]
+        if close_window:
+            chat.Close()
+        del self.listen[nickname]
+        return WxResponse.success()
+
     def GetSubWindow(self, nickname: str) -> 'WeComChat':
         """获取子窗口实例
         
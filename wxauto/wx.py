@@ -17,7 +17,6 @@ from typing import (
 )
 from abc import ABC, abstractmethod
 import threading
-import traceback
 import time
 import sys
 
@@ -43,7 +42,7 @@ class Listener(ABC):
             try:
                 self._get_listen_messages()
             except:
-                wxlog.debug(f'监听消息失败：{traceback.format_exc()}')
+                wxlog.debug('监听消息失败', exc_info=True)
             time.sleep(WxParam.LISTEN_INTERVAL)
 
     def _safe_callback(self, callback, msg, chat):
@@ -51,7 +50,7 @@ class Listener(ABC):
             with self._lock:
                 callback(msg, chat)
         except Exception as e:
-            wxlog.debug(f"监听消息回调发生错误：{traceback.format_exc()}")
+            wxlog.debug("监听消息回调发生错误", exc_info=True)
 
     def _listener_stop(self):
         self._listener_is_listening = False
@@ -212,7 +211,7 @@ class WeChat(Chat, Listener):
             chat, callback = temp_listen.get(who, (None, None))
             try:
                 if chat is None or not chat.core.exists():
-                    wxlog.debug(f"窗口 {who} 已关闭，移除监听")
+                    wxlog.debug("窗口 %s 已关闭，移除监听", who)
                     self.RemoveListenChat(who, close_window=False)
                     continue
             except:
@@ -220,7 +219,7 @@ class WeChat(Chat, Listener):
             with self._lock:
                 msgs = chat.GetNewMessage()
                 for msg in msgs:
-                    wxlog.debug(f"[{msg.attr} {msg.type}]获取到新消息：{who} - {msg.content}")
+                    wxlog.debug("[%s %s]获取到新消息：%s - %s", msg.attr, msg.type, who, msg.content)
                     chat.Show()
                     self._safe_callback(callback, msg, chat)
     